@@ -6,6 +6,7 @@ Created by sheepy0125
 Client snake class
 """
 
+from collections import deque
 from multiplayer_snake.shared.common import hisock
 from multiplayer_snake.shared.config_parser import parse
 from multiplayer_snake.shared.pygame_tools import CenterRect
@@ -30,7 +31,16 @@ class ClientSnakePlayer(BaseSnakePlayer):
     def update(self, position: tuple, direction: str, tail: list):
         self.pos = position
         self.direction = direction
-        self.tail = tail
+        self.tail = deque(tail)
+
+    def apply_delta(self, head: tuple, popped: int, direction: str):
+        """Moves the snake by what changed in a delta update"""
+
+        for _ in range(min(popped, len(self.tail))):
+            self.tail.pop()
+        self.tail.appendleft(head)
+        self.pos = head
+        self.direction = direction
 
     def draw(self):
         for tail_idx, tail_pos in enumerate(self.tail):
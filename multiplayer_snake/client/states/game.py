@@ -7,11 +7,15 @@ Client join state code
 """
 
 ### Setup ###
+from collections import deque
+from threading import Event
 from multiplayer_snake.shared.common import pygame, Logger, hisock, ClientInfo
 from multiplayer_snake.shared.config_parser import parse
-from multiplayer_snake.shared.shared_game import SharedGame
+from multiplayer_snake.shared.shared_game import OPPOSITE_DIRECTIONS, SharedGame
 from multiplayer_snake.shared.pygame_tools import GlobalPygame
 from multiplayer_snake.shared.hisock_tools import GlobalHiSock, hisock_callback, send
+from multiplayer_snake.shared.codec import MissingKeyframeError, loads, pack_input
+from multiplayer_snake.shared.engine import turn
 from multiplayer_snake.client.states.state import BaseState
 from multiplayer_snake.client.snake import ClientSnakePlayer
 from multiplayer_snake.client.food import ClientFood
@@ -20,6 +24,7 @@ from multiplayer_snake.client.states.waiting_substate import WaitingSubstate
 
 CONFIG = parse()
 GUI_CONFIG = CONFIG["gui"]
+CLIENT_CONFIG = CONFIG["client"]
 
 ### Classes ###
 class SentinelName:
@@ -38,15 +43,27 @@ class MultiplayerPlayer:
         self.position: tuple | None = None
         self.direction: str | None = None
         self.tail: list | None = None
+        # Sequence number of the last input of ours the server used
+        self.input_seq: int = 0
 
     def update(self, data: dict):
         """Updates data with that from the server "update" event"""
 
-        self.position = data["pos"]
+        self.position = tuple(data["pos"])
         self.direction = data["direction"]
         self.tail = data["tail"]
+        self.input_seq = data.get("input_seq", 0)
         self.snake.update(self.position, self.direction, self.tail)
 
+    def apply_delta(self, data: dict):
+        """Moves the snake with a delta "update" (the head and popped tail cells)"""
+
+        self.position = tuple(data["head"])
+        self.direction = data["direction"]
+        self.input_seq = data.get("input_seq", 0)
+        self.snake.apply_delta(self.position, data["popped"], self.direction)
+        self.tail = self.snake.tail
+
     @property
     def exists(self):
         return not isinstance(self.name, SentinelName)
@@ -68,9 +85,20 @@ class GameState(BaseState):
         ### HiSock setup ###
         GlobalHiSock.connection = client
         self.client = GlobalHiSock.connection
+        # The server sends our username as soon as we've connected, so this has to
+        # be listening before the client starts (``recv`` could miss it)
+        join_response = {}
+        join_response_event = Event()
+
+        @client.on("join_response")
+        def _on_join_response(data: dict):
+            join_response.update(data)
+            join_response_event.set()
+
         self.client.start(callback=hisock_callback)
         # Change our name
-        name: str = self.client.recv("join_response", recv_as=dict)["username"]
+        join_response_event.wait()
+        name: str = join_response["username"]
         self.client.change_name(name)
 
         ### Directions ###
@@ -85,18 +113,13 @@ class GameState(BaseState):
             pygame.K_LEFT: "left",
             pygame.K_RIGHT: "right",
         }
-        self.rev_key_enum = {
-            "up": "down",
-            "down": "up",
-            "left": "right",
-            "right": "left",
-        }
         # Corresponds to how many players have joined
         self.default_directions = [
             "right",
             "left",
         ]
-        self.next_move: str
+        # Sequence number of the last input we sent
+        self.last_input_seq: int = 0
         # Default direction, will be changed by `_on_game_started`
         self.default_next_move: str | None = None
 
@@ -121,13 +144,32 @@ class GameState(BaseState):
             ),
         }
 
+        ### Prediction ###
+        # Our snake is drawn ahead of the server's updates, so turning shows up right
+        # away instead of after a round trip. It's the last update with the inputs
+        # the server hasn't used yet (oldest first) put on top, moved forward a tick.
+        self.predicted_snake = ClientSnakePlayer(
+            head_color=GUI_CONFIG["colors"]["snek_one_head"],
+            tail_color=GUI_CONFIG["colors"]["snek_one_tail"],
+        )
+        self.pending_inputs: deque[tuple[int, str]] = deque()  # Sequence, direction
+        # Tick -> head position that was predicted, to check against the server
+        self.predicted_heads: dict[int, tuple] = {}
+        self.mispredictions: int = 0
+
         ### Setup game and board ###
         self.foods = []
+        self.food_positions: set[tuple] = set()
+        self.round: int | None = None
         self.grid = Grid()
 
         ### Update data ###
-        self.update_called = False
-        self.update_data: dict
+        # Every "update" has to be applied in order (most of them are deltas)
+        # None is an update that couldn't be unpacked
+        self.pending_updates: deque[dict | None] = deque()
+        self.update_player_names: list[str] | None = None
+        self.last_tick: int | None = None
+        self.requested_keyframe = False
 
         ### Substates ###
         self.waiting_substate = WaitingSubstate(["Waiting to connect..."])
@@ -156,25 +198,24 @@ class GameState(BaseState):
             self.waiting_substate.active = False
 
         @client.on("game_started")
-        def _on_game_started(default_directions: dict):
+        def _on_game_started(data: bytes):
+            default_directions = loads(data)
             self.default_next_move = default_directions[name]
-            self.next_move = self.default_next_move
 
         @client.on("update")
-        def _update(data: dict):
+        def _update(data: bytes):
             """Called every frame"""
 
-            self.update_called = True
-
-            self.update_data = data
-            self.update()
+            # Deltas are unpacked with the players of the last keyframe
+            try:
+                update_data = loads(data, self.update_player_names)
+            except MissingKeyframeError:
+                update_data = None
+            if update_data is not None and update_data["keyframe"]:
+                self.update_player_names = list(update_data["players"])
 
-            # Send our data
-            send(
-                client.send,
-                "update",
-                {"direction": self.next_move},
-            )
+            # Applied by ``update`` on the main thread, so they stay in order
+            self.pending_updates.append(update_data)
 
         @client.on("force_disconnect")
         def _on_leave():
@@ -223,23 +264,84 @@ class GameState(BaseState):
 
         # Get keyboard input
         if event.type == pygame.KEYDOWN and event.key in self.key_enum:
+            player = self.players["self"]
+            if player.tail is None:
+                return
+
             next_move = self.key_enum[event.key]
+            # Where the snake will be going once the server has used our inputs
+            direction = (
+                self.pending_inputs[-1][1] if self.pending_inputs else player.direction
+            )
             # Prevent the next move if it will cause the snake to go inside itself
-            if (
-                len(self.players["self"].tail)
-                == 1  # We can move freely if we are just a head
-                or self.rev_key_enum[next_move] != self.players["self"].direction
+            if next_move == direction or (
+                len(player.tail) > 1  # We can move freely if we are just a head
+                and OPPOSITE_DIRECTIONS[next_move] == direction
             ):
-                self.next_move = next_move
+                return
+
+            self.send_input(next_move)
+
+    def send_input(self, direction: str):
+        """
+        Sends an input to the server as soon as the key is pressed. The server queues
+        it and turns with it on one of the next ticks.
+        """
+
+        self.last_input_seq += 1
+        client_input = {"direction": direction, "seq": self.last_input_seq}
+        send(
+            self.client.send,
+            "input",
+            pack_input(client_input) if CLIENT_CONFIG["binary_codec"] else client_input,
+        )
+
+        self.pending_inputs.append((self.last_input_seq, direction))
+        self.predict()
 
     def update(self):
         self.waiting_substate.update()
 
-        if not self.update_called:
-            return
+        applied_update = False
+        while self.pending_updates:
+            data = self.pending_updates.popleft()
+
+            if data is not None and data["keyframe"]:
+                self.apply_keyframe(data)
+            elif (
+                data is not None
+                and self.last_tick is not None
+                and data["tick"] == self.last_tick + 1
+            ):
+                self.apply_delta(data)
+            else:
+                # Missed an update (or joined in the middle of a round), so the deltas
+                # can't be applied until everything is sent again
+                if not self.requested_keyframe:
+                    Logger.verbose("Missed an update, requesting a keyframe")
+                    send(self.client.send, "request_data")
+                    self.requested_keyframe = True
+                continue
+
+            self.last_tick = data["tick"]
+            applied_update = True
+
+        if applied_update:
+            self.reconcile()
+
+    def apply_keyframe(self, data: dict):
+        """Replaces everything with the data from a keyframe"""
+
+        self.requested_keyframe = False
+
+        # Inputs from the last round don't matter anymore
+        if data["round"] != self.round:
+            self.round = data["round"]
+            self.pending_inputs.clear()
+            self.predicted_heads.clear()
 
         # Update players
-        player_data = self.update_data["players"]
+        player_data = data["players"]
         for player in self.players.values():
             # Ensure player exists
             if player.name not in player_data:
@@ -248,8 +350,71 @@ class GameState(BaseState):
                 continue
             player.update(player_data[player.name])
 
-        # Update foods
-        food_data = self.update_data["foods"]
+        self.update_foods(data["foods"])
+
+    def apply_delta(self, data: dict):
+        """Applies a delta "update" to the last tick"""
+
+        player_data = data["players"]
+        for player in self.players.values():
+            if player.name not in player_data:
+                Logger.verbose(f"{player.name} doesn't exist, probably disconnected")
+                continue
+            player.apply_delta(player_data[player.name])
+
+        # The foods are only sent if they moved
+        if "foods" in data:
+            self.update_foods(data["foods"])
+
+    def reconcile(self):
+        """Checks the prediction against the server's update and predicts again"""
+
+        player = self.players["self"]
+
+        # The server has used these inputs, so they're in its update already
+        while self.pending_inputs and self.pending_inputs[0][0] <= player.input_seq:
+            self.pending_inputs.popleft()
+
+        predicted_head = self.predicted_heads.pop(self.last_tick, None)
+        if predicted_head is not None and predicted_head != player.position:
+            self.mispredictions += 1
+            Logger.verbose(
+                f"Mispredicted tick {self.last_tick}: predicted {predicted_head}, "
+                f"server has {player.position}"
+            )
+        for tick in [tick for tick in self.predicted_heads if tick < self.last_tick]:
+            del self.predicted_heads[tick]
+
+        self.predict()
+
+    def predict(self):
+        """Predicts our snake from the last update and the inputs not used yet"""
+
+        player = self.players["self"]
+        if player.tail is None:
+            return
+
+        snake = self.predicted_snake
+        snake.update(player.position, player.direction, player.tail)
+
+        pending_inputs = iter(self.pending_inputs)
+        for _ in range(CLIENT_CONFIG["prediction_ticks"]):
+            # The server turns with one of the queued inputs per tick, and skips the
+            # ones it can't turn with
+            for _, direction in pending_inputs:
+                if turn(snake, direction):
+                    break
+
+            # The tail grows on the move after eating
+            snake.length = len(snake.tail) + (snake.pos in self.food_positions)
+            snake.move()
+
+        if self.last_tick is not None:
+            predicted_tick = self.last_tick + CLIENT_CONFIG["prediction_ticks"]
+            self.predicted_heads[predicted_tick] = snake.pos
+
+    def update_foods(self, food_data: list):
+        self.food_positions = {tuple(food["pos"]) for food in food_data}
         self.foods = []
         for food in food_data:
             self.foods.append(
@@ -258,8 +423,6 @@ class GameState(BaseState):
                 )
             )
 
-        self.update_called = False
-
     def draw(self):
         ### Draw substates if needed ###
         if self.waiting_substate.active:
@@ -270,9 +433,9 @@ class GameState(BaseState):
         # Grid
         self.grid.draw()
         GlobalPygame.window.blit(self.grid.grid_surf, (0, 0))
-        # Draw the snakes
-        for player in self.players.values():
-            player.snake.draw()
+        # Draw the snakes (ours is where we predict it to be)
+        self.players["other"].snake.draw()
+        self.predicted_snake.draw()
         # Draw the foods
         for food in self.foods:
             food.draw()
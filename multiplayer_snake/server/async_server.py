@@ -0,0 +1,488 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-19
+
+asyncio server that speaks the same protocol as HiSock's server, so the clients
+don't know the difference. Every connection is a task instead of needing a thread,
+so idle and lobby connections are cheap.
+"""
+
+### Setup ###
+import json
+import asyncio
+import inspect
+from typing import Callable
+from threading import Thread, get_ident
+from concurrent.futures import ThreadPoolExecutor
+from multiplayer_snake.shared.common import hisock, ClientInfo, Logger
+from multiplayer_snake.shared.config_parser import parse
+
+CONFIG = parse()
+SERVER_CONFIG = CONFIG["server"]
+
+# Same as HiSock
+HEADER_LENGTH = 16
+KEEPALIVE_INTERVAL = 30.0  # Seconds
+RESERVED_COMMANDS = ("join", "leave", "message", "name_change", "group_change")
+
+### Errors ###
+class ProtocolError(Exception):
+    """A client sent something that isn't HiSock's protocol"""
+
+
+### Helpers ###
+def make_message(content: bytes) -> bytes:
+    """Puts HiSock's header (the length, padded with spaces) before the content"""
+
+    length = str(len(content)).encode()
+    return length + b" " * (HEADER_LENGTH - len(length)) + content
+
+
+def to_bytes(content) -> bytes:
+    """Converts content that's being sent to bytes, like HiSock does"""
+
+    if content is None:
+        return b""
+    if isinstance(content, bytes):
+        return content
+    if isinstance(content, str):
+        return content.encode()
+    if isinstance(content, ClientInfo):
+        return json.dumps(content.client_dict).encode()
+    if isinstance(content, (dict, list)):
+        return json.dumps(content).encode()
+    if isinstance(content, (int, float)):
+        return str(content).encode()
+
+    raise TypeError(f"Cannot send {type(content)}")
+
+
+def from_bytes(content: bytes | None, type_hint):
+    """Converts received content to the type hint of the handler, like HiSock does"""
+
+    if type_hint in (bytes, None, inspect.Parameter.empty) or content is None:
+        return content
+    if type_hint is str:
+        return content.decode()
+    if type_hint in (dict, list):
+        return json.loads(content)
+    if type_hint in (int, float):
+        return type_hint(content.decode())
+    if type_hint is bool:
+        return content == b"True"
+
+    raise TypeError(f"Cannot type cast to {type_hint}")
+
+
+### Classes ###
+class Connection:
+    """A client's connection to the server"""
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        ip_address: tuple,
+    ):
+        self.reader = reader
+        self.writer = writer
+        self.ip_address = ip_address
+        self.name: str | None = None
+        self.group: str | None = None
+        self.responded_to_keepalive = True
+
+    @property
+    def client_dict(self) -> dict:
+        return {"ip": self.ip_address, "name": self.name, "group": self.group}
+
+    @property
+    def client_info(self) -> ClientInfo:
+        return ClientInfo(**self.client_dict)
+
+    def write(self, content: bytes):
+        if not self.writer.is_closing():
+            self.writer.write(make_message(content))
+
+    @property
+    def send_buffer_size(self) -> int:
+        """Bytes written that haven't been sent yet"""
+
+        return self.writer.transport.get_write_buffer_size()
+
+
+class AsyncHiSockServer:
+    """
+    Has the same methods as HiSock's ``ThreadedHiSockServer`` that the server uses,
+    but runs on an asyncio event loop in its own thread.
+
+    Handlers run on the event loop, one message at a time, so they mustn't block.
+    Handlers that do (``threaded=True``) run in a small thread pool instead of a
+    thread each.
+    Sending and disconnecting can be done from any thread.
+    """
+
+    def __init__(
+        self,
+        addr: tuple[str, int],
+        max_connections: int = 0,
+        cache_size: int = -1,
+        handler_threads: int = SERVER_CONFIG["async_handler_threads"],
+        max_send_buffer: int = SERVER_CONFIG["async_max_send_buffer"],
+    ):
+        self.addr = addr
+        self.max_send_buffer = max_send_buffer
+        self.max_connections = max_connections
+        self.cache_size = cache_size
+        self.cache: list = []  # For ``HiSockReceivedCache.auto``
+        self.funcs: dict[str, dict] = {}
+        self.connections: dict[tuple, Connection] = {}
+        self.closed = False
+
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(
+            max_workers=handler_threads, thread_name_prefix="async handler"
+        )
+        self._server: asyncio.AbstractServer | None = None
+        self._thread: Thread | None = None
+        self._callback: Callable | None = None
+        self._error_handler: Callable | None = None
+
+        # Bind now, so it fails here like HiSock does
+        self._server = self.loop.run_until_complete(
+            asyncio.start_server(self._handle_connection, *addr)
+        )
+
+    ### Handlers ###
+    def on(self, command: str, threaded: bool = False, override: bool = False):
+        """Same as HiSock's ``on`` decorator"""
+
+        def decorator(func: Callable) -> Callable:
+            type_hints = [
+                parameter.annotation
+                for parameter in inspect.signature(func).parameters.values()
+            ]
+            self.funcs[command] = {
+                "func": func,
+                "threaded": threaded,
+                "override": override,
+                "type_hints": type_hints,
+            }
+            return func
+
+        return decorator
+
+    def _call(self, connection: Connection, command: str, *args):
+        func = self.funcs[command]
+        if func["threaded"]:
+            self.loop.run_in_executor(
+                self.executor, self._call_handler, func, args, connection
+            )
+            return
+        self._call_handler(func, args, connection)
+
+    def _call_handler(
+        self, func: dict, args: tuple, connection: Connection | None = None
+    ):
+        """
+        Calls a handler. If it fails handling a connection's message, only that
+        connection is closed, anything else goes to the error handler.
+        """
+
+        try:
+            func["func"](*args)
+        except Exception as e:  # pylint: disable=broad-except
+            if connection is None:
+                self._handle_error(e)
+                return
+            self._run_on_loop(self._handler_failed, connection, e)
+
+    def _handler_failed(self, connection: Connection, error: Exception):
+        self._client_error(connection, error)
+        self._disconnect(connection, force=True, call_func=True)
+
+    def _call_reserved(self, connection: Connection, command: str, *args):
+        if command in self.funcs and not self.funcs[command]["override"]:
+            self._call(connection, command, *args)
+
+    def _handle_error(self, error: Exception):
+        if self._error_handler is None:
+            Logger.log_error(error)
+            return
+        self._error_handler(error)
+
+    ### Connections ###
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        ip_address = writer.get_extra_info("peername")[:2]
+        if self.max_connections and len(self.connections) >= self.max_connections:
+            writer.close()
+            return
+
+        connection = Connection(reader, writer, ip_address)
+        try:
+            hello = await self._receive(connection)
+            if hello is None:
+                writer.close()
+                return
+            if not hello.startswith(b"$CLTHELLO$"):
+                raise ProtocolError("Didn't start with a hello")
+            hello = json.loads(hello.removeprefix(b"$CLTHELLO$"))
+            if not isinstance(hello, dict) or not {"name", "group"} <= hello.keys():
+                raise ProtocolError(f"Invalid hello: {hello}")
+        except ConnectionError:
+            writer.close()
+            return
+        except (ProtocolError, ValueError) as e:
+            self._client_error(connection, e)
+            writer.close()
+            return
+
+        connection.name = hello["name"]
+        connection.group = hello["group"]
+        self.connections[ip_address] = connection
+
+        self._send_all_raw(f"$CLTCONN$ {json.dumps(connection.client_dict)}".encode())
+        self._call_reserved(connection, "join", connection.client_info)
+
+        try:
+            while (data := await self._receive(connection)) is not None:
+                if data.startswith(b"$USRCLOSE$"):
+                    break
+                self._handle_message(connection, data)
+                if self._callback is not None:
+                    self._callback()
+        except ConnectionError:
+            pass
+        except Exception as e:  # pylint: disable=broad-except
+            # Only this connection is closed, like when a handler fails (see
+            # ``_call_handler``)
+            self._client_error(connection, e)
+
+        if ip_address in self.connections:
+            self._disconnect(connection, force=True, call_func=True)
+
+    async def _receive(self, connection: Connection) -> bytes | None:
+        """Receives a message, or None if the client disconnected"""
+
+        try:
+            header = await connection.reader.readexactly(HEADER_LENGTH)
+            length = header.rstrip()
+            if not length.isdigit():
+                raise ProtocolError(f"Invalid header: {header}")
+            return await connection.reader.readexactly(int(length))
+        except asyncio.IncompleteReadError:
+            return None
+
+    def _client_error(self, connection: Connection, error: Exception):
+        """Something went wrong with one client's connection, which will be closed"""
+
+        Logger.warn(
+            f"Closing the connection to {hisock.iptup_to_str(connection.ip_address)} "
+            f"after an error: {error}"
+        )
+        # Anything but the client not following the protocol is worth a traceback
+        if not isinstance(error, ProtocolError):
+            Logger.log_error(error)
+
+    def _handle_message(self, connection: Connection, data: bytes):
+        # Reserved messages
+        for prefix, key in ((b"$CHNAME$", "name"), (b"$CHGROUP$", "group")):
+            if not data.startswith(prefix):
+                continue
+
+            old_value = getattr(connection, key)
+            new_value = data.removeprefix(prefix).decode() or old_value
+            setattr(connection, key, new_value)
+            self._call_reserved(
+                connection,
+                f"{key}_change",
+                connection.client_info,
+                old_value,
+                new_value,
+            )
+            return
+
+        if data.startswith(b"$KEEPACK$"):
+            connection.responded_to_keepalive = True
+            return
+
+        if data.startswith(b"$GETCLT$"):
+            identifier = data.removeprefix(b"$GETCLT$").decode()
+            for other_connection in self.connections.values():
+                if identifier in (
+                    other_connection.name,
+                    hisock.iptup_to_str(other_connection.ip_address),
+                ):
+                    self._write(connection, to_bytes(other_connection.client_dict))
+                    break
+            else:
+                self._write(connection, to_bytes({"traceback": "$NOEXIST$"}))
+            return
+
+        if not data.startswith(b"$CMD$"):
+            if "*" in self.funcs:
+                self._call(connection, "*", connection.client_info, None, data)
+            return
+
+        # Commands
+        command, _, content = data.removeprefix(b"$CMD$").partition(b"$MSG$")
+        command = command.decode()
+        content = content or None
+
+        self._cache(command, content)
+
+        if command in self.funcs and command not in RESERVED_COMMANDS:
+            type_hints = self.funcs[command]["type_hints"]
+            args = (connection.client_info,)
+            if len(type_hints) >= 2:
+                args += (from_bytes(content, type_hints[1]),)
+            self._call(connection, command, *args[: len(type_hints)])
+        elif "*" in self.funcs:
+            self._call(connection, "*", connection.client_info, command, content)
+
+        if "message" in self.funcs:
+            self._call(connection, "message", connection.client_info, command, content)
+
+    def _cache(self, command: str, content: bytes | None):
+        if self.cache_size == 0:
+            return
+
+        self.cache.append(
+            hisock.utils.MessageCacheMember(
+                {"header": b"", "content": content, "called": True, "command": command}
+            )
+        )
+        if 0 < self.cache_size < len(self.cache):
+            self.cache.pop(0)
+
+    async def _keepalive(self):
+        """Disconnects clients that don't respond to a keepalive, like HiSock"""
+
+        while not self.closed:
+            for connection in list(self.connections.values()):
+                connection.responded_to_keepalive = False
+                self._write(connection, b"$KEEPALIVE$")
+
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+
+            for connection in list(self.connections.values()):
+                if not connection.responded_to_keepalive:
+                    self._disconnect(connection, force=True, call_func=True)
+
+    ### Sending ###
+    def _write(self, connection: Connection, content: bytes):
+        """
+        Writes to a connection (on the event loop). A client that has more than
+        ``max_send_buffer`` bytes waiting isn't reading what it's sent, so it's
+        disconnected instead of buffering every tick for it.
+        """
+
+        connection.write(content)
+        if (
+            self.max_send_buffer <= 0
+            or connection.send_buffer_size <= self.max_send_buffer
+        ):
+            return
+
+        Logger.warn(
+            f"Disconnecting {hisock.iptup_to_str(connection.ip_address)}, "
+            f"{connection.send_buffer_size} bytes haven't been sent to them"
+        )
+        self._disconnect(connection, force=True, call_func=True)
+        # What's buffered would still be sent before closing
+        connection.writer.transport.abort()
+
+    def _get_connection(self, client) -> Connection:
+        if isinstance(client, ClientInfo):
+            client = client.ip
+        if isinstance(client, str):
+            for connection in list(self.connections.values()):
+                if connection.name == client:
+                    return connection
+        elif (connection := self.connections.get(tuple(client))) is not None:
+            return connection
+
+        raise hisock.utils.ClientNotFound(f"Client {client} is not connected")
+
+    def _run_on_loop(self, func: Callable, *args):
+        """Runs ``func`` now if on the event loop's thread, otherwise soon on it"""
+
+        if self._thread is None or get_ident() == self._thread.ident:
+            func(*args)
+            return
+        self.loop.call_soon_threadsafe(func, *args)
+
+    def send_client(self, client, command: str, content=None):
+        connection = self._get_connection(client)
+        data = b"$CMD$" + command.encode() + b"$MSG$" + to_bytes(content)
+        self._run_on_loop(self._write, connection, data)
+
+    def send_all_clients(self, command: str, content=None):
+        self._send_all_raw(b"$CMD$" + command.encode() + b"$MSG$" + to_bytes(content))
+
+    def _send_all_raw(self, data: bytes):
+        def write_all():
+            for connection in list(self.connections.values()):
+                self._write(connection, data)
+
+        self._run_on_loop(write_all)
+
+    def call_later(self, delay: float, func: Callable, *args):
+        """Calls ``func`` on the event loop after ``delay`` seconds (thread safe)"""
+
+        self._run_on_loop(self._call_later, delay, func, args)
+
+    def _call_later(self, delay: float, func: Callable, args: tuple):
+        self.loop.call_later(delay, self._call_handler, {"func": func}, args)
+
+    ### Disconnecting ###
+    def disconnect_client(self, client, force: bool = False, call_func: bool = False):
+        connection = self._get_connection(client)
+        self._run_on_loop(self._disconnect, connection, force, call_func)
+
+    def _disconnect(self, connection: Connection, force: bool, call_func: bool):
+        if self.connections.get(connection.ip_address) is not connection:
+            # Already disconnected
+            return
+
+        if not force:
+            connection.write(b"$DISCONN$")
+        connection.writer.close()
+        del self.connections[connection.ip_address]
+
+        if call_func:
+            self._call_reserved(connection, "leave", connection.client_info)
+
+    ### Running ###
+    def start(self, callback: Callable = None, error_handler: Callable = None):
+        """Starts the event loop in its own thread, like ``ThreadedHiSockServer``"""
+
+        self._callback = callback
+        self._error_handler = error_handler
+        self._thread = Thread(target=self._run, name="async server", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.create_task(self._keepalive())
+        self.loop.run_forever()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        def close_on_loop():
+            for connection in list(self.connections.values()):
+                self._disconnect(connection, force=False, call_func=False)
+            self._server.close()
+            self.loop.stop()
+
+        if self._thread is None:
+            close_on_loop()
+        else:
+            self.loop.call_soon_threadsafe(close_on_loop)
+            self._thread.join(timeout=1.0)
+        self.executor.shutdown(wait=False)
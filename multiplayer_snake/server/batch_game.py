@@ -0,0 +1,282 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-15
+
+Batched snake games, where NumPy ticks many independent rooms at once
+(used for bot vs bot matches, there's nobody to send anything to).
+The rules are the same as the engine's (:mod:`multiplayer_snake.shared.engine`),
+only the random numbers for the food come from NumPy instead.
+"""
+
+### Setup ###
+import numpy as np
+from multiplayer_snake.shared.shared_game import SharedGame
+
+# Same order as ``BatchedSnakeGames.directions``. Opposite directions only differ
+# in the lowest bit.
+DIRECTIONS = ("up", "down", "left", "right")
+VELOCITIES = np.array(((0, -1), (0, 1), (-1, 0), (1, 0)), dtype=np.int32)
+NO_INPUT = -1
+# Random cells tried for a food before looking through the whole board for one
+FOOD_TRIES = 8
+
+### Classes ###
+class BatchedSnakeGames:
+    """
+    Holds the heads, directions and body occupancy of many games in NumPy arrays
+    so one call to :meth:`tick` advances every room.
+
+    Bodies aren't stored as lists. Each cell stores which player was in it and the
+    tick their head entered it, and a cell is taken as long as
+    ``tick - birth < length`` for its owner. That way moving and growing don't have
+    to touch the tail at all.
+
+    Like the engine, the players in a room move one after another (for every room
+    at once): eating the food their head is on, turning, then moving. The players
+    that haven't moved yet this tick are still in their cells from the last tick.
+    The first player that dies ends their room's round (the players after them
+    don't move), and the room is reset.
+    """
+
+    def __init__(
+        self,
+        num_rooms: int,
+        num_players: int = 2,
+        num_foods: int = 2,
+        width: int = SharedGame.width,
+        height: int = SharedGame.height,
+        seed: int | None = None,
+    ):
+        self.num_rooms = num_rooms
+        self.num_players = num_players
+        self.num_foods = num_foods
+        self.width = width
+        self.height = height
+        self.rng = np.random.default_rng(seed)
+
+        ### Per player ###
+        # Positions are (x, y) like everywhere else
+        self.heads = np.zeros((num_rooms, num_players, 2), dtype=np.int32)
+        # Index into ``DIRECTIONS``
+        self.directions = np.zeros((num_rooms, num_players), dtype=np.int8)
+        self.lengths = np.ones((num_rooms, num_players), dtype=np.int32)
+        # How many cells the snakes are in, which is behind the length while growing
+        self.tail_lengths = np.ones((num_rooms, num_players), dtype=np.int32)
+
+        ### Per room ###
+        # Foods that aren't on the board (while placing them) are at (-1, -1)
+        self.foods = np.zeros((num_rooms, num_foods, 2), dtype=np.int32)
+        self.ticks = np.zeros(num_rooms, dtype=np.int64)
+        self.rounds = np.zeros(num_rooms, dtype=np.int64)
+        # Cells are indexed [room, y, x]
+        self.owner = np.full((num_rooms, height, width), -1, dtype=np.int8)
+        self.birth = np.zeros((num_rooms, height, width), dtype=np.int64)
+
+        # Index helpers
+        self._player_idxs = np.arange(num_players)[None, :]
+
+        ### Default positions ###
+        # Left and right sides, like ``SnakeGame``, with extra players in more rows
+        num_rows = (num_players + 1) // 2
+        self.default_heads = np.array(
+            [
+                (
+                    5 if player % 2 == 0 else width - 5,
+                    (player // 2 + 1) * height // (num_rows + 1) - 1,
+                )
+                for player in range(num_players)
+            ],
+            dtype=np.int32,
+        )
+        self.default_directions = np.array(
+            [
+                DIRECTIONS.index("right" if player % 2 == 0 else "left")
+                for player in range(num_players)
+            ],
+            dtype=np.int8,
+        )
+
+        self.reset(np.arange(num_rooms))
+
+    def reset(self, rooms: np.ndarray):
+        """Resets the given rooms (an array of room indexes) to a new round"""
+
+        if len(rooms) == 0:
+            return
+
+        self.heads[rooms] = self.default_heads
+        self.directions[rooms] = self.default_directions
+        self.lengths[rooms] = 1
+        self.tail_lengths[rooms] = 1
+        self.ticks[rooms] = 0
+        self.rounds[rooms] += 1
+
+        self.owner[rooms] = -1
+        self.birth[rooms] = 0
+        room_idxs = rooms[:, None]
+        xs, ys = self.default_heads[:, 0], self.default_heads[:, 1]
+        self.owner[room_idxs, ys, xs] = self._player_idxs
+        self.birth[room_idxs, ys, xs] = 0
+
+        # One at a time, so they aren't put on each other
+        self.foods[rooms] = -1
+        for food_idx in range(self.num_foods):
+            self.respawn_foods(rooms, np.full(len(rooms), food_idx), moved=0)
+
+    ### Board ###
+    def taken(
+        self, rooms: np.ndarray, xs: np.ndarray, ys: np.ndarray, moved: int
+    ) -> np.ndarray:
+        """
+        Returns whether each cell is taken up by a snake, partway through the
+        rooms' ticks: the players before ``moved`` have moved this tick and the
+        rest haven't yet. ``rooms``, ``xs`` and ``ys`` must broadcast together.
+        """
+
+        owner = self.owner[rooms, ys, xs]
+        birth = self.birth[rooms, ys, xs]
+        owner_idxs = np.maximum(owner, 0)
+        owner_length = self.lengths[rooms, owner_idxs]
+        # The tick the owner's cells are looked at from
+        tick = self.ticks[rooms] - (owner_idxs >= moved)
+        return (owner >= 0) & (tick - birth < owner_length)
+
+    def respawn_foods(self, rooms: np.ndarray, food_idxs: np.ndarray, moved: int):
+        """
+        Moves a food in each room (``rooms`` and ``food_idxs`` are the same length,
+        with each room once) to a random cell without a snake or another food,
+        partway through the tick like :meth:`taken`.
+        Random cells are tried first, like ``Board.random_free_cell``. A food stays
+        where it is if there isn't a free cell, like the engine.
+        """
+
+        for _ in range(FOOD_TRIES):
+            if len(rooms) == 0:
+                return
+
+            xs = self.rng.integers(0, self.width, len(rooms))
+            ys = self.rng.integers(0, self.height, len(rooms))
+            on_food = (self.foods[rooms] == np.stack((xs, ys), axis=-1)[:, None]).all(
+                axis=-1
+            )
+            free = ~self.taken(rooms, xs, ys, moved) & ~on_food.any(axis=1)
+            self.foods[rooms[free], food_idxs[free], 0] = xs[free]
+            self.foods[rooms[free], food_idxs[free], 1] = ys[free]
+            rooms, food_idxs = rooms[~free], food_idxs[~free]
+
+        if len(rooms) == 0:
+            return
+
+        # Almost everything's taken, pick the nth free cell of each room that's left
+        ys = np.arange(self.height)[None, :, None]
+        xs = np.arange(self.width)[None, None, :]
+        free = ~self.taken(rooms[:, None, None], xs, ys, moved)
+        foods = self.foods[rooms]
+        food_rooms, food_slots = np.nonzero(foods[..., 0] >= 0)
+        free[
+            food_rooms, foods[food_rooms, food_slots, 1], foods[food_rooms, food_slots, 0]
+        ] = False
+
+        free = free.reshape(len(rooms), -1)
+        num_free = free.sum(axis=1)
+        has_free = num_free > 0
+        picks = self.rng.integers(0, np.maximum(num_free, 1))
+        cell_idxs = (np.cumsum(free, axis=1) > picks[:, None]).argmax(axis=1)
+
+        rooms, food_idxs, cell_idxs = (
+            rooms[has_free],
+            food_idxs[has_free],
+            cell_idxs[has_free],
+        )
+        self.foods[rooms, food_idxs, 0] = cell_idxs % self.width
+        self.foods[rooms, food_idxs, 1] = cell_idxs // self.width
+
+    ### Ticking ###
+    def tick(self, inputs: np.ndarray | None = None) -> dict:
+        """
+        Advances every room by one tick. ``inputs`` (rooms, players) is the
+        direction each player turns (indexes into ``DIRECTIONS``, or ``NO_INPUT``).
+        Returns a dictionary of arrays:
+        ``food_eaten`` (rooms, players) players that ate this tick,
+        ``died`` (rooms, players) the player that died this tick and
+        ``game_over`` (rooms,) rooms that ended (and were reset) this tick.
+        """
+
+        self.ticks += 1
+        food_eaten = np.zeros((self.num_rooms, self.num_players), dtype=bool)
+        died = np.zeros((self.num_rooms, self.num_players), dtype=bool)
+        game_over = np.zeros(self.num_rooms, dtype=bool)
+
+        for player in range(self.num_players):
+            rooms = np.nonzero(~game_over)[0]
+            if len(rooms) == 0:
+                break
+
+            ### Food ###
+            # The head from the last tick, the tail grows on this move
+            hits = (self.heads[rooms, player, None, :] == self.foods[rooms]).all(
+                axis=-1
+            )
+            ate = hits.any(axis=1)
+            if ate.any():
+                eaten_rooms = rooms[ate]
+                self.respawn_foods(
+                    eaten_rooms, hits[ate].argmax(axis=1), moved=player
+                )
+                self.lengths[eaten_rooms, player] += 1
+                food_eaten[eaten_rooms, player] = True
+
+            ### Turn ###
+            if inputs is not None:
+                wanted = inputs[rooms, player]
+                current = self.directions[rooms, player]
+                turns = (
+                    (wanted != NO_INPUT)
+                    & (wanted != current)
+                    # Not back into itself, unless it's only a head
+                    & (
+                        (self.tail_lengths[rooms, player] == 1)
+                        | (wanted != current ^ 1)
+                    )
+                )
+                self.directions[rooms[turns], player] = wanted[turns]
+
+            ### Move ###
+            heads = self.heads[rooms, player] + VELOCITIES[self.directions[rooms, player]]
+            self.heads[rooms, player] = heads
+            self.tail_lengths[rooms, player] = np.minimum(
+                self.tail_lengths[rooms, player] + 1, self.lengths[rooms, player]
+            )
+
+            ### Collisions ###
+            xs, ys = heads[:, 0], heads[:, 1]
+            in_bounds = (0 <= xs) & (xs < self.width) & (0 <= ys) & (ys < self.height)
+            dead = ~in_bounds
+            dead[in_bounds] = self.taken(
+                rooms[in_bounds], xs[in_bounds], ys[in_bounds], moved=player + 1
+            )
+
+            alive = ~dead
+            self.owner[rooms[alive], ys[alive], xs[alive]] = player
+            self.birth[rooms[alive], ys[alive], xs[alive]] = self.ticks[rooms[alive]]
+
+            died[rooms[dead], player] = True
+            game_over[rooms[dead]] = True
+
+        self.reset(np.nonzero(game_over)[0])
+
+        return {"food_eaten": food_eaten, "died": died, "game_over": game_over}
+
+    def get_body(self, room: int, player: int) -> list[tuple[int, int]]:
+        """
+        Gets a player's body, from the head to the end of the tail, like
+        ``BaseSnakePlayer.tail``. Slow, for debugging and sending to clients only.
+        """
+
+        age = self.ticks[room] - self.birth[room]
+        ys, xs = np.nonzero(
+            (self.owner[room] == player) & (age < self.lengths[room, player])
+        )
+        order = np.argsort(age[ys, xs])
+        return [(int(xs[idx]), int(ys[idx])) for idx in order]
@@ -0,0 +1,433 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-22
+
+Tick throughput benchmarks, for sizing servers and catching slowdowns.
+Each scenario is a room with a board size, number of players, snake length and
+number of foods, ticked as fast as possible. The updates are serialized like
+normal, but there aren't any clients to send them to.
+The results are written as JSON (with the commit), so runs can be compared.
+
+Bot vs bot matches in the batched simulation (see
+:mod:`multiplayer_snake.server.batch_game`) are timed too, as room ticks per second.
+
+Run with ``python -m multiplayer_snake.server.benchmark`` (``--help`` for options)
+"""
+
+### Setup ###
+import sys
+import json
+import argparse
+import platform
+import itertools
+import subprocess
+import tracemalloc
+import numpy as np
+from time import perf_counter, time
+from pathlib import Path
+from collections import defaultdict, deque
+from multiplayer_snake.shared.common import ROOT_PATH, Logger
+from multiplayer_snake.shared.config_parser import parse
+from multiplayer_snake.shared.hisock_tools import GlobalHiSock, HiSockCache
+from multiplayer_snake.shared.shared_game import DIRECTION_VELOCITIES
+from multiplayer_snake.shared.tools import percentile
+from multiplayer_snake.shared.engine import EngineState
+from multiplayer_snake.server.game import SnakeGame
+from multiplayer_snake.server.batch_game import BatchedSnakeGames, NO_INPUT
+
+CONFIG = parse()
+
+WARMUP_TICKS = 200
+# How often the batched bots turn (they turn at random)
+BATCHED_TURN_CHANCE = 0.1
+# Phases timed by ``SnakeGame.phase_times``, in order
+PHASES = ("inputs", "food", "move", "collision", "get_data", "serialize", "send", "replay")
+
+### Classes ###
+class NullConnection:
+    """Stands in for the server, the updates are made but go nowhere"""
+
+    def send_client(self, *_):
+        # Nothing pops the sent cache without a HiSock callback
+        HiSockCache.cache["sent"].clear()
+
+    def send_all_clients(self, *_):
+        HiSockCache.cache["sent"].clear()
+
+
+class BenchmarkGame(SnakeGame):
+    """
+    A room where every snake goes around its own lane (a loop along the edges of a
+    band of rows), so they stay alive however long they are.
+    The inputs are sent when a snake gets to a corner, like a player would.
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        num_players: int,
+        length: int,
+        num_foods: int,
+        seed: int | None = None,
+    ):
+        self.width = width
+        self.height = height
+        self.length = length
+
+        # Each lane's cells in the order they're gone around, and which way to go
+        # from every cell
+        lane_height = height // num_players
+        if lane_height < 2:
+            raise ValueError(f"{num_players} players don't fit in {height} rows")
+        self.lanes = [
+            make_lane(width, idx * lane_height, lane_height)
+            for idx in range(num_players)
+        ]
+        if length >= len(self.lanes[0]):
+            raise ValueError(
+                f"Snakes of length {length} don't fit in a {len(self.lanes[0])} cell lane"
+            )
+        self.lane_directions: dict[tuple[int, int], str] = {}
+        for lane in self.lanes:
+            for pos, next_pos in zip(lane, lane[1:] + lane[:1]):
+                self.lane_directions[pos] = next(
+                    direction
+                    for direction, velocity in DIRECTION_VELOCITIES.items()
+                    if (pos[0] + velocity[0], pos[1] + velocity[1]) == next_pos
+                )
+
+        super().__init__(seed=seed)
+        self.num_players = num_players
+        self.num_foods = num_foods
+        self.input_seq = 0
+
+        for idx in range(num_players):
+            self.add_player(("127.0.0.1", idx), f"bench{idx}#0000")
+            self.players_online[idx].ready_for_events = True
+
+    def get_default_pos_dir(self, player_idx: int):
+        pos = self.lanes[player_idx][0]
+        return pos, self.lane_directions[pos]
+
+    def new_state(self) -> EngineState:
+        # Lay the snakes out along their lanes, with the head at the front
+        for player, lane in zip(self.players_online, self.lanes):
+            player.tail = deque(reversed(lane[: self.length]))
+            player.pos = player.tail[0]
+            player.length = self.length
+            player.direction = self.lane_directions[player.pos]
+
+        return EngineState(
+            list(self.players_online),
+            seed=self.rng.getrandbits(32),
+            num_foods=self.num_foods,
+            width=self.width,
+            height=self.height,
+        )
+
+    def send_inputs(self):
+        """Queue a turn for every snake that's at a corner of its lane"""
+
+        for player in self.players_online:
+            direction = self.lane_directions.get(player.pos)
+            if direction is not None and direction != player.direction:
+                self.input_seq += 1
+                player.queue_input(direction, self.input_seq)
+
+    def run_ticks(self, ticks: int) -> list[float]:
+        """Runs ``ticks`` ticks. Returns how long each took (in seconds)."""
+
+        durations = []
+        for _ in range(ticks):
+            # Not timed, the snakes grew into themselves (or each other)
+            if not self.running:
+                self.start()
+            # Not timed either, the inputs come from the clients
+            self.send_inputs()
+
+            tick_start = perf_counter()
+            self.update()
+            durations.append(perf_counter() - tick_start)
+
+        return durations
+
+
+### Functions ###
+def make_lane(width: int, top: int, height: int) -> list[tuple[int, int]]:
+    """The cells around the edge of a band of rows, clockwise from the top left"""
+
+    bottom = top + height - 1
+    return (
+        [(x, top) for x in range(width)]
+        + [(width - 1, y) for y in range(top + 1, bottom + 1)]
+        + [(x, bottom) for x in range(width - 2, -1, -1)]
+        + [(0, y) for y in range(bottom - 1, top, -1)]
+    )
+
+
+def measure_allocations(game: BenchmarkGame, ticks: int) -> dict:
+    """
+    Traces the memory allocated while ticking. Python can't count allocations, so
+    this is how much memory a tick needs at its peak and how much it keeps.
+    """
+
+    tracemalloc.start()
+    start_memory, _ = tracemalloc.get_traced_memory()
+    start_blocks = sys.getallocatedblocks()
+    peaks = []
+    for _ in range(ticks):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        game.run_ticks(1)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+    end_memory, _ = tracemalloc.get_traced_memory()
+    end_blocks = sys.getallocatedblocks()
+    tracemalloc.stop()
+
+    return {
+        "peak_bytes_per_tick": sum(peaks) / ticks,
+        "retained_bytes_per_tick": (end_memory - start_memory) / ticks,
+        "retained_blocks_per_tick": (end_blocks - start_blocks) / ticks,
+    }
+
+
+def run_scenario(scenario: dict, ticks: int, allocation_ticks: int, seed: int) -> dict:
+    game = BenchmarkGame(**scenario, seed=seed)
+    game.run_ticks(WARMUP_TICKS)
+
+    game.phase_times = defaultdict(float)
+    start_round = game.round
+    durations = game.run_ticks(ticks)
+    total = sum(durations)
+    phase_times = dict(game.phase_times)
+    game.phase_times = None
+
+    result = {
+        "scenario": scenario,
+        "ticks": ticks,
+        "rounds": game.round - start_round + 1,
+        "ticks_per_second": ticks / total,
+        "tick_us": {
+            "mean": total / ticks * 1e6,
+            "p50": percentile(durations, 50) * 1e6,
+            "p99": percentile(durations, 99) * 1e6,
+            "max": max(durations) * 1e6,
+        },
+        # Everything else is the uptime, logging and timing the phases
+        "phase_us_per_tick": {
+            **{phase: phase_times.get(phase, 0.0) / ticks * 1e6 for phase in PHASES},
+            "other": (total - sum(phase_times.values())) / ticks * 1e6,
+        },
+    }
+    if allocation_ticks:
+        result["allocations"] = measure_allocations(game, allocation_ticks)
+
+    return result
+
+
+def run_batched(scenario: dict, num_rooms: int, ticks: int, seed: int) -> dict:
+    """Ticks ``num_rooms`` bot vs bot matches at once with the batched simulation"""
+
+    games = BatchedSnakeGames(num_rooms, **scenario, seed=seed)
+    rng = np.random.default_rng(seed)
+
+    durations = []
+    for _ in range(ticks):
+        # Not timed, the inputs would come from the bots
+        inputs = np.where(
+            rng.random((num_rooms, games.num_players)) < BATCHED_TURN_CHANCE,
+            rng.integers(0, 4, (num_rooms, games.num_players)),
+            NO_INPUT,
+        ).astype(np.int8)
+
+        tick_start = perf_counter()
+        games.tick(inputs)
+        durations.append(perf_counter() - tick_start)
+    total = sum(durations)
+
+    return {
+        "scenario": scenario,
+        "rooms": num_rooms,
+        "ticks": ticks,
+        "rounds": int(games.rounds.sum()),
+        "room_ticks_per_second": num_rooms * ticks / total,
+        "tick_us": {
+            "mean": total / ticks * 1e6,
+            "p50": percentile(durations, 50) * 1e6,
+            "p99": percentile(durations, 99) * 1e6,
+            "max": max(durations) * 1e6,
+        },
+    }
+
+
+def scenario_key(scenario: dict) -> str:
+    return (
+        f"{scenario['width']}x{scenario['height']} {scenario['num_players']} players "
+        f"length {scenario['length']} {scenario['num_foods']} foods"
+    )
+
+
+def get_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ("git", "rev-parse", "--short", "HEAD"),
+            cwd=ROOT_PATH,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict], baseline_path: Path):
+    """Prints how the ticks per second changed from an earlier run"""
+
+    baseline = json.loads(baseline_path.read_text())
+    baseline_results = {
+        scenario_key(result["scenario"]): result for result in baseline["results"]
+    }
+
+    print(f"Compared to {baseline_path} (commit {baseline.get('commit')}):")
+    for result in results:
+        key = scenario_key(result["scenario"])
+        if key not in baseline_results:
+            print(f"  {key}: not in the baseline")
+            continue
+
+        old = baseline_results[key]["ticks_per_second"]
+        new = result["ticks_per_second"]
+        print(
+            f"  {key}: {old:,.0f} -> {new:,.0f} ticks/s ({(new / old - 1) * 100:+.1f}%)"
+        )
+
+
+def parse_board(board: str) -> tuple[int, int]:
+    width, _, height = board.partition("x")
+    return int(width), int(height)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m multiplayer_snake.server.benchmark",
+        description="Benchmarks ticking rooms. Every combination of the options is run.",
+    )
+    parser.add_argument(
+        "--boards",
+        nargs="+",
+        type=parse_board,
+        default=[(40, 30), (160, 120)],
+        metavar="WIDTHxHEIGHT",
+    )
+    parser.add_argument("--players", nargs="+", type=int, default=[2, 8])
+    parser.add_argument("--lengths", nargs="+", type=int, default=[4, 64])
+    parser.add_argument("--foods", nargs="+", type=int, default=[2, 32])
+    parser.add_argument(
+        "--ticks", type=int, default=5000, help="Timed ticks per scenario"
+    )
+    parser.add_argument(
+        "--allocation-ticks",
+        type=int,
+        default=500,
+        help="Ticks traced for allocations (slow, 0 to not trace)",
+    )
+    parser.add_argument(
+        "--batched-rooms",
+        nargs="*",
+        type=int,
+        default=[256],
+        help="Rooms ticked at once in the batched simulation (none to skip it)",
+    )
+    parser.add_argument(
+        "--batched-ticks",
+        type=int,
+        default=500,
+        help="Timed ticks per batched scenario",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("benchmark.json"),
+        help="Where to write the results (JSON)",
+    )
+    parser.add_argument(
+        "--compare", type=Path, help="Results of an earlier run to compare to"
+    )
+
+    return parser.parse_args()
+
+
+### Main ###
+if __name__ == "__main__":
+    args = parse_args()
+    GlobalHiSock.connection = NullConnection()
+    if CONFIG["verbose"]:
+        Logger.warn("Verbose logging is on, the ticks will be a lot slower")
+
+    results = []
+    for (width, height), num_players, length, num_foods in itertools.product(
+        args.boards, args.players, args.lengths, args.foods
+    ):
+        scenario = {
+            "width": width,
+            "height": height,
+            "num_players": num_players,
+            "length": length,
+            "num_foods": num_foods,
+        }
+        try:
+            result = run_scenario(scenario, args.ticks, args.allocation_ticks, args.seed)
+        except ValueError as e:
+            Logger.warn(f"Skipping {scenario_key(scenario)}: {e}")
+            continue
+
+        results.append(result)
+        phases = ", ".join(
+            f"{phase} {us:.1f}" for phase, us in result["phase_us_per_tick"].items()
+        )
+        print(
+            f"{scenario_key(scenario)}: {result['ticks_per_second']:,.0f} ticks/s, "
+            f"p99 {result['tick_us']['p99']:.1f} us ({phases} us)"
+        )
+
+    batched_results = []
+    for (width, height), num_players, num_foods, num_rooms in itertools.product(
+        args.boards, args.players, args.foods, args.batched_rooms
+    ):
+        scenario = {
+            "width": width,
+            "height": height,
+            "num_players": num_players,
+            "num_foods": num_foods,
+        }
+        result = run_batched(scenario, num_rooms, args.batched_ticks, args.seed)
+        batched_results.append(result)
+        print(
+            f"Batched {width}x{height} {num_players} players {num_foods} foods, "
+            f"{num_rooms} rooms: {result['room_ticks_per_second']:,.0f} room ticks/s, "
+            f"p99 {result['tick_us']['p99']:.1f} us per batch"
+        )
+
+    args.output.write_text(
+        json.dumps(
+            {
+                "commit": get_commit(),
+                "time": int(time()),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "processor": platform.processor(),
+                "config": {"binary_codec": CONFIG["server"]["binary_codec"]},
+                "results": results,
+                "batched_results": batched_results,
+            },
+            indent=4,
+        )
+    )
+    print(f"Wrote {len(results) + len(batched_results)} results to {args.output}")
+
+    if args.compare is not None:
+        compare(results, args.compare)
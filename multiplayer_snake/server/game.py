@@ -0,0 +1,715 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2021-11-14
+
+Server game code (no pygame required)
+"""
+
+### Setup ###
+import json
+from os import getpid
+from time import time, perf_counter
+from random import Random
+from pathlib import Path
+from collections import defaultdict, deque
+from threading import Event
+from multiplayer_snake.shared.common import Logger
+from multiplayer_snake.shared.config_parser import parse
+from multiplayer_snake.shared.hisock_tools import GlobalHiSock, send, send_clients
+from multiplayer_snake.shared.codec import pack_update, pack_game_started
+from multiplayer_snake.shared.shared_game import (
+    DIRECTION_VELOCITIES,
+    BaseSnakePlayer,
+    SharedGame,
+)
+from multiplayer_snake.shared.tools import check_username, get_discriminator
+from multiplayer_snake.shared.engine import EngineState, advance
+from multiplayer_snake.shared.pathfinding import Pathfinder
+from multiplayer_snake.server.replay import ReplayRecorder
+from multiplayer_snake.server import metrics
+from multiplayer_snake.server.profiler import tick_profiler
+
+CONFIG = parse()
+SERVER_CONFIG = CONFIG["server"]
+
+### Classes ###
+class GameAlreadyRunningError(Exception):
+    ...
+
+
+class SnakeGame:
+    """Handles everything that will be sent to the clients"""
+
+    def __init__(self, room_id: int = 0, seed: int | None = SERVER_CONFIG["seed"]):
+        self.room_id = room_id
+        self.num_players = 2
+        self.num_foods = 2
+        self.players_online: list[ServerSnakePlayer] = []
+
+        self.round = 0
+        self.uptime: int = 0  # Seconds
+        self.uptime_changed: bool = False  # For the GUI
+        # Start the game by ourselves once everyone's ready (no start button)
+        self.auto_start: bool = SERVER_CONFIG["auto_start"]
+        # Every round's seed comes from this, so a room with a seed always plays out
+        # the same with the same inputs
+        self.rng = Random(seed)
+        # Seconds spent in each phase of the ticks (a ``defaultdict(float)``), only
+        # added up if it's set, like for the benchmarks
+        self.phase_times: dict[str, float] | None = None
+        # The phase times of the tick that's going, if they're being timed
+        self.tick_timings: dict[str, float] | None = None
+        # Distance fields to the food for the bots, shared by all of them
+        self.pathfinder = Pathfinder()
+        # When the room gets filled with bots if nobody else joins (time), see
+        # ``check_bot_fill``
+        self.bot_fill_time: float | None = None
+
+        self._reset()
+
+        self.default_positions = (
+            (5, SharedGame.height // 2 - 1),
+            (SharedGame.width - 5, SharedGame.height // 2 - 1),
+        )
+        self.default_directions = ("right", "left")
+
+    def _reset(self):
+        Logger.verbose(f"Resetting game in room {self.room_id}")
+        self.frames: int = 0
+        self.running: bool = False
+        self.food_changed: bool = False  # This tick
+        # The serialized "update"s for the current tick (keyframe -> bytes)
+        self.frame_cache: dict[bool, bytes] = {}
+        self.frame_cache_id: tuple[int, int] | None = None  # Round, tick
+        # IP addresses of the clients that want a keyframe next tick
+        self.keyframe_requests: set[tuple] = set()
+        self.start_time: int = 0  # Unix timestamp
+        # Records this round if replays are on (ended when the round ends)
+        self.replay: ReplayRecorder | None = None
+        # The round's rules and board (made when it starts)
+        self.state: EngineState | None = None
+        for player in self.players_online:
+            player.reset()
+
+    @property
+    def foods(self) -> list[tuple[int, int]]:
+        return self.state.foods if self.state is not None else []
+
+    def get_data(self) -> dict:
+        """Get data for updating the clients"""
+
+        # Get the data
+        return {
+            "players": {
+                player.identifier: player.get_data() for player in self.players_online
+            },
+            "foods": [{"pos": pos} for pos in self.foods],
+            "round": self.round,
+            "uptime": self.uptime,
+            "uptime_changed": self.uptime_changed,
+        }
+
+    def get_keyframe_data(self) -> dict:
+        """Get all of the data, with the tick, for an "update" keyframe"""
+
+        return {"tick": self.frames, "keyframe": True, **self.get_data()}
+
+    def get_delta_data(self) -> dict:
+        """
+        Get what changed this tick for a delta "update", which is the same size no
+        matter how long the snakes are. The clients apply it to the last tick.
+        """
+
+        data = {
+            "tick": self.frames,
+            "keyframe": False,
+            "players": {
+                player.identifier: player.get_delta_data()
+                for player in self.players_online
+            },
+        }
+        if self.food_changed:
+            data["foods"] = [{"pos": pos} for pos in self.foods]
+        if self.uptime_changed:
+            data["uptime"] = self.uptime
+
+        return data
+
+    def get_player_idx(
+        self, identifier: tuple | str, error_on_not_found: bool = False
+    ) -> int:
+        """
+        Gets an index for a player with an identifier.
+        The identifier could be the player's name or IP address.
+        Returns -1 if not found if ``error_on_not_found`` isn't set, otherwise an
+        IndexError will be raised.
+        """
+
+        search_by_ip = isinstance(identifier, tuple)
+
+        for idx, player in enumerate(self.players_online):
+            # Name
+            if not search_by_ip:
+                if player.identifier == identifier:
+                    return idx
+                continue
+
+            # IP
+            if player.ip_address == identifier:
+                return idx
+
+        if not error_on_not_found:
+            return -1
+        raise IndexError
+
+    def get_player(self, identifier: tuple | str) -> "ServerSnakePlayer | None":
+        """Gets a player by their name or IP address, or None if they're not here"""
+
+        player_idx = self.get_player_idx(identifier)
+        if player_idx == -1:
+            return None
+        return self.players_online[player_idx]
+
+    def get_default_pos_dir(self, player_idx: int):
+        default_pos = self.default_positions[player_idx]
+        default_dir = self.default_directions[player_idx]
+        return default_pos, default_dir
+
+    def update_player(self, player_identifier: str, direction: str, seq: int = 0):
+        """Queue a player's input (``seq`` is the input's sequence number)"""
+
+        player = self.get_player(player_identifier)
+        if player is None:
+            return
+        player.queue_input(direction, seq)
+
+    def update(self):
+        """Ticks the game once (must be started first)"""
+
+        original_uptime = self.uptime
+        self.uptime = int(time() - self.start_time)
+        self.uptime_changed = original_uptime != self.uptime
+
+        # Only timed if something's looking
+        timings = self.tick_timings = (
+            defaultdict(float)
+            if self.phase_times is not None or tick_profiler.profiling
+            else None
+        )
+        if timings is not None:
+            phase_start = perf_counter()
+
+        # The bots find their way here
+        inputs = {player.identifier: player.next_input() for player in self.players_online}
+
+        if timings is not None:
+            timings["inputs"] += perf_counter() - phase_start
+
+        advance(self.state, inputs, timings)
+        self.frames = self.state.tick
+        self.food_changed = self.state.food_changed
+
+        for identifier in self.state.eaten:
+            Logger.log(f"{identifier} ate food")
+
+        # Somebody died, which resets the game
+        if self.state.died is not None:
+            identifier, reason = self.state.died
+            # The engine has its own list of the snakes, they could have left
+            player = self.get_player(identifier)
+            if player is not None:
+                player.snake_died(reason)
+            else:
+                self.snake_died(identifier, reason)
+
+        # Update clients
+        # A full keyframe every so often (and at the start of a round), just in case
+        self.update_clients(
+            keyframe=(
+                not SERVER_CONFIG["delta_updates"]
+                or not self.running
+                or self.is_keyframe()
+            )
+        )
+
+        if self.replay is not None:
+            if timings is not None:
+                phase_start = perf_counter()
+            self.record_tick()
+            if timings is not None:
+                timings["replay"] += perf_counter() - phase_start
+
+        if timings is not None:
+            if self.phase_times is not None:
+                for phase, phase_time in timings.items():
+                    self.phase_times[phase] += phase_time
+            tick_profiler.record_room(self.room_id, timings)
+            self.tick_timings = None
+
+    def is_keyframe(self) -> bool:
+        """Whether this tick gets a periodic keyframe (a round's first tick does)"""
+
+        return (self.frames - 1) % SERVER_CONFIG["keyframe_interval"] == 0
+
+    def record_tick(self):
+        """Records this tick in the replay (a keyframe every so often, else a delta)"""
+
+        keyframe = self.is_keyframe()
+        # Same bytes as the clients got if they're packed
+        if SERVER_CONFIG["binary_codec"]:
+            frame = self.get_frame(keyframe)
+        else:
+            frame = pack_update(
+                self.get_keyframe_data() if keyframe else self.get_delta_data()
+            )
+
+        if keyframe:
+            self.replay.record_keyframe(self.frames, frame)
+        else:
+            self.replay.record_delta(self.frames, frame)
+
+    def start_replay(self):
+        """Starts recording this round"""
+
+        # Every worker process numbers its rooms from 0, so the process ID is in there
+        path = Path(SERVER_CONFIG["replay_directory"]) / (
+            f"room{self.room_id}_round{self.round}_{self.start_time}_{getpid()}"
+            ".snakereplay"
+        )
+        self.replay = ReplayRecorder(
+            path,
+            {
+                "room": self.room_id,
+                "round": self.round,
+                "start_time": self.start_time,
+                "seed": self.state.seed,
+                "tick_interval": SERVER_CONFIG["time_until_update"],
+                "width": SharedGame.width,
+                "height": SharedGame.height,
+                "players": [player.identifier for player in self.players_online],
+            },
+        )
+        Logger.verbose(f"Recording room {self.room_id} to {path}")
+
+    def end_replay(self, reason: str):
+        """Stops recording, with the state when it ended as the last keyframe"""
+
+        if self.replay is None:
+            return
+
+        # Packed here instead of with ``get_frame``, as the tick isn't over yet
+        self.replay.record_keyframe(self.frames, pack_update(self.get_keyframe_data()))
+        self.replay.end(self.frames, reason)
+        self.replay = None
+
+    def get_frame(self, keyframe: bool) -> bytes:
+        """
+        Gets the serialized "update" for this tick. It's only made once per tick, and
+        the same bytes are sent to every client that gets it.
+        """
+
+        frame_id = (self.round, self.frames)
+        if frame_id != self.frame_cache_id:
+            self.frame_cache_id = frame_id
+            self.frame_cache = {}
+
+        frame = self.frame_cache.get(keyframe)
+        if frame is None:
+            get_data_start = perf_counter()
+            data = self.get_keyframe_data() if keyframe else self.get_delta_data()
+            serialize_start = perf_counter()
+            if SERVER_CONFIG["binary_codec"]:
+                frame = pack_update(data)
+            else:
+                frame = json.dumps(data).encode()
+            serialize_end = perf_counter()
+            self.frame_cache[keyframe] = frame
+
+            metrics.get_data_time.observe(serialize_start - get_data_start)
+            metrics.serialize_time.observe(serialize_end - serialize_start)
+            if self.tick_timings is not None:
+                self.tick_timings["get_data"] += serialize_start - get_data_start
+                self.tick_timings["serialize"] += serialize_end - serialize_start
+
+        return frame
+
+    def clear_frame_cache(self):
+        """
+        Forgets the frames made for this tick. Needed when the players change
+        outside of a tick, like in the lobby, where the tick stays the same.
+        """
+
+        self.frame_cache_id = None
+        self.frame_cache = {}
+
+    def update_clients(self, keyframe: bool = True):
+        """
+        Send the game data to every client in the room, either everything or just
+        what changed this tick. Clients that asked for a keyframe get one either way.
+        """
+
+        # Take the requests out one by one, so ones made while this is going aren't lost
+        requesters = set()
+        while self.keyframe_requests:
+            requesters.add(self.keyframe_requests.pop())
+
+        # Sent with HiSock directly instead of through ``send``, as its sent cache is
+        # only popped when a client sends something, and that isn't every tick
+        connection = GlobalHiSock.connection
+        clients = [player.ip_address for player in self.humans]
+
+        # The frames are made before sending, so the sending is timed on its own
+        if keyframe or len(requesters) == len(clients):
+            frame = self.get_frame(keyframe=True)
+            send_start = perf_counter()
+            send_clients(connection, clients, "update", frame)
+        else:
+            delta_frame = self.get_frame(keyframe=False)
+            keyframe_frame = self.get_frame(keyframe=True) if requesters else None
+            send_start = perf_counter()
+            delta_clients = [client for client in clients if client not in requesters]
+            if delta_clients:
+                send_clients(connection, delta_clients, "update", delta_frame)
+            keyframe_clients = [client for client in clients if client in requesters]
+            if keyframe_clients:
+                send_clients(connection, keyframe_clients, "update", keyframe_frame)
+
+        send_time = perf_counter() - send_start
+        metrics.send_time.observe(send_time)
+        if self.tick_timings is not None:
+            self.tick_timings["send"] += send_time
+
+    def request_keyframe(self, ip_address: tuple):
+        """
+        The client asked for all of the data ("request_data"). They get a keyframe
+        with the next tick instead of a delta, so asking more than once in a tick
+        doesn't make (or send) any more keyframes.
+        """
+
+        if self.running:
+            self.keyframe_requests.add(ip_address)
+            return
+
+        # There's no next tick
+        send(
+            GlobalHiSock.connection.send_client,
+            ip_address,
+            "update",
+            self.get_frame(keyframe=True),
+        )
+
+    def send_all(self, command: str, content=None):
+        """Send to every player in this room (instead of every client)"""
+
+        # Serialize it once for everybody
+        if isinstance(content, (dict, list)):
+            content = json.dumps(content).encode()
+
+        for player in self.humans:
+            send(
+                GlobalHiSock.connection.send_client,
+                player.ip_address,
+                command,
+                content,
+            )
+
+    @property
+    def humans(self) -> list["ServerSnakePlayer"]:
+        """The players that aren't bots (the ones with clients)"""
+
+        return [player for player in self.players_online if not player.is_bot]
+
+    @property
+    def ready_to_start(self) -> bool:
+        """Whether every player has joined and is ready for events"""
+
+        return len(self.players_online) == self.num_players and all(
+            player.ready_for_events for player in self.players_online
+        )
+
+    def run(self):
+        """Run everything. Should be called every tick (by the tick scheduler)"""
+
+        if not self.running:
+            self.check_bot_fill()
+            if self.auto_start and self.ready_to_start:
+                self.start()
+            return
+
+        self.update()
+
+    def start(self):
+        """Start the game"""
+
+        if self.running:
+            raise GameAlreadyRunningError
+
+        Logger.log(f"Starting game in room {self.room_id}")
+
+        # Paused without being stopped, that round's over
+        self.end_replay("restarted")
+
+        self.round += 1
+        self.running = True
+        self.start_time = int(time())
+
+        # Update player positions
+        for idx, player in enumerate(self.players_online):
+            player.default_pos, player.default_dir = self.get_default_pos_dir(idx)
+            player.reset()
+
+        self.state = self.new_state()
+
+        if SERVER_CONFIG["record_replays"]:
+            self.start_replay()
+
+        # Alert everyone that the game has started with their default positions
+        default_directions = {
+            player.identifier: player.default_dir for player in self.players_online
+        }
+        if SERVER_CONFIG["binary_codec"]:
+            default_directions = pack_game_started(default_directions)
+        self.send_all("game_started", default_directions)
+
+    def new_state(self) -> EngineState:
+        """Makes the engine state for a new round (once the players are reset)"""
+
+        # Its own list of the players, so one leaving mid tick doesn't change it
+        return EngineState(
+            list(self.players_online),
+            seed=self.rng.getrandbits(32),
+            num_foods=self.num_foods,
+        )
+
+    def pause(self):
+        """Pause the game"""
+
+        if not self.running:
+            return
+
+        Logger.log(f"Pausing game in room {self.room_id}")
+        self.running = False
+
+    def stop(self):
+        """Stop the game. Assumes the game has been paused."""
+
+        self.end_replay("stopped")
+        self._reset()
+
+    def add_player(self, ip_address: str, username: str):
+        """
+        Adds a player to the game and returns a ServerSnakePlayer if valid or None
+        Note: I cannot type annotate the return of this due to ServerSnakePlayer
+        not being defined yet
+        """
+
+        # Too many players already
+        if len(self.players_online) >= self.num_players:
+            return None
+
+        # Username isn't good
+        # The username will have a 4 digit discriminator with a hashtag.
+        # Hashtags aren't allowed except for the discriminator.
+        if not check_username(username[:-5]):
+            return None
+
+        # Everything seems fine, add the player
+        default_pos, default_dir = self.get_default_pos_dir(len(self.players_online))
+        snake_object = ServerSnakePlayer(
+            ip_address,
+            game=self,
+            default_pos=default_pos,
+            default_dir=default_dir,
+            default_length=1,
+            identifier=username,
+        )
+        self.players_online.append(snake_object)
+        self.clear_frame_cache()
+
+        Logger.verbose(f"Added player {username} to room {self.room_id}")
+
+        return snake_object
+
+    def add_bot(self):
+        """Adds a bot and returns it, or None if the room is full"""
+
+        if len(self.players_online) >= self.num_players:
+            return None
+
+        default_pos, default_dir = self.get_default_pos_dir(len(self.players_online))
+        bot = BotPlayer(
+            game=self,
+            default_pos=default_pos,
+            default_dir=default_dir,
+            default_length=1,
+            identifier=f"bot#{get_discriminator()}",
+        )
+        self.players_online.append(bot)
+        self.clear_frame_cache()
+
+        Logger.verbose(f"Added bot {bot.identifier} to room {self.room_id}")
+
+        return bot
+
+    def check_bot_fill(self):
+        """
+        Fills the room with bots once the players in it have been ready and waiting
+        for ``bot_fill_delay`` seconds (if it isn't -1)
+        """
+
+        waiting = (
+            SERVER_CONFIG["bot_fill_delay"] >= 0
+            and 0 < len(self.players_online) < self.num_players
+            and all(player.ready_for_events for player in self.players_online)
+        )
+        if not waiting:
+            self.bot_fill_time = None
+            return
+
+        if self.bot_fill_time is None:
+            self.bot_fill_time = time() + SERVER_CONFIG["bot_fill_delay"]
+        if time() < self.bot_fill_time:
+            return
+
+        self.bot_fill_time = None
+        while self.add_bot() is not None:
+            pass
+        Logger.log(f"Filled room {self.room_id} with bots")
+        # So the clients know who they're playing against
+        self.send_all(
+            "player_connect", [player.get_data() for player in self.players_online]
+        )
+
+    def remove_player(self, ip_address: tuple):
+        """Removes a player from the game if they're in it"""
+
+        player_idx = self.get_player_idx(ip_address)
+        if player_idx == -1:
+            return
+
+        self.players_online.pop(player_idx)
+        self.clear_frame_cache()
+
+        # The game can't go on without them
+        if self.running:
+            self.pause()
+            self.stop()
+
+    def snake_died(self, identifier: str, reason: str):
+        Logger.log(f"The game in room {self.room_id} has ended!")
+        self.send_all("game_over", f"{identifier} died because {reason}")
+        self.end_replay(f"{identifier} died because {reason}")
+        self.stop()
+
+
+class ServerSnakePlayer(BaseSnakePlayer):
+    """Server side snake player"""
+
+    is_bot = False
+
+    def __init__(self, ip_address: str, game: SnakeGame, *args, **kwargs):
+        ### Server data ###
+        self.ip_address = ip_address
+        self.game = game
+        # Used for telling the join handlers that the user fixed their username to match
+        self.username_changed_thread_event = Event()
+        # Used for telling the join handlers that the client is ready for events
+        self.ready_thread_event = Event()
+        # Set by the join handlers once both events are set
+        self.joined = False
+        # Set once the join handshake has finished
+        self.ready_for_events = False
+        # Sequence number of the client's last input that was used, sent back so the
+        # client knows which of its predicted inputs the server has seen
+        self.input_seq: int = 0
+        # Inputs (sequence number, direction) that came in from the HiSock thread,
+        # used one per tick by the tick thread. Only appending and popping from the
+        # two ends (which are thread safe) are done, so there's no lock.
+        self.input_queue: deque[tuple[int, str]] = deque()
+
+        super().__init__(*args, **kwargs)
+
+    def _reset(self, *args, **kwargs):
+        super()._reset(*args, **kwargs)
+        # The inputs were for the last round
+        self.input_queue.clear()
+
+    def get_data(self) -> dict:
+        """Get data for updating the client"""
+
+        return {
+            "identifier": self.identifier,
+            "ip_address": self.ip_address,
+            "pos": self.pos,
+            "length": self.length,
+            "direction": self.direction,
+            "input_seq": self.input_seq,
+            "tail": list(self.tail),
+        }
+
+    def get_delta_data(self) -> dict:
+        """Get what changed in the last move, for delta updates"""
+
+        return {
+            "head": self.pos,
+            "popped": self.popped,
+            "direction": self.direction,
+            "input_seq": self.input_seq,
+        }
+
+    def queue_input(self, direction: str, seq: int):
+        """Queue an input from the client, it's used on one of the next ticks"""
+
+        if direction not in DIRECTION_VELOCITIES:
+            Logger.warn(f"{self.identifier} sent an invalid direction: {direction}")
+            return
+
+        if len(self.input_queue) >= SERVER_CONFIG["input_buffer_size"]:
+            Logger.verbose(f"Input buffer for {self.identifier} is full, dropping input")
+            return
+
+        self.input_queue.append((seq, direction))
+
+    def next_input(self) -> str | None:
+        """
+        Gets the direction to turn this tick from the queued inputs. Only one turn is
+        made per tick, so turning twice quickly takes two ticks instead of the second
+        turn replacing the first.
+        Inputs that can't be used (like turning back into the snake) are skipped.
+        """
+
+        while self.input_queue:
+            seq, direction = self.input_queue.popleft()
+            if seq <= self.input_seq:
+                # Old or repeated
+                continue
+            self.input_seq = seq
+
+            if direction != self.direction and self.can_turn(direction):
+                return direction
+
+        return None
+
+    def snake_died(self, reason: str = "unknown"):
+        super().snake_died(reason)
+        self.game.snake_died(identifier=self.identifier, reason=reason)
+
+
+class BotPlayer(ServerSnakePlayer):
+    """
+    A player the server plays for, which goes for the closest food it can get to.
+    It doesn't have a client, so nothing is sent to it.
+    """
+
+    is_bot = True
+
+    def __init__(self, game: SnakeGame, *args, **kwargs):
+        super().__init__(None, game, *args, **kwargs)
+        self.joined = True
+        self.ready_for_events = True
+
+    def next_input(self) -> str | None:
+        pathfinder = self.game.pathfinder
+        pathfinder.sync(self.game.state)
+        return pathfinder.best_direction(self)
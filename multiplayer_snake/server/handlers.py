@@ -0,0 +1,284 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-14
+
+Server HiSock setup and handlers (shared by the GUI and headless servers)
+"""
+
+### Setup ###
+import sys
+from time import monotonic
+from typing import Callable
+from threading import Lock, Timer
+from multiplayer_snake.shared.common import hisock, ClientInfo, Logger
+from multiplayer_snake.shared.config_parser import parse
+from multiplayer_snake.shared.hisock_tools import GlobalHiSock, send
+from multiplayer_snake.shared.tools import get_discriminator
+from multiplayer_snake.shared.codec import CodecError, loads
+from multiplayer_snake.server.rooms import RoomManager, room_manager
+from multiplayer_snake.server.async_server import AsyncHiSockServer
+from multiplayer_snake.server.replay import replay_writer
+from multiplayer_snake.server import metrics
+from multiplayer_snake.server.profiler import tick_profiler
+
+CONFIG = parse()
+SERVER_CONFIG = CONFIG["server"]
+
+### Server ###
+def create_server(
+    rooms: RoomManager = room_manager,
+) -> hisock.server.ThreadedHiSockServer | AsyncHiSockServer:
+    """
+    Creates the HiSock server and registers all of the handlers.
+    The server still has to be started.
+    The ``transport`` config picks HiSock's threaded server or the asyncio one.
+    ``rooms`` can be anything with the same methods as :class:`RoomManager`
+    (like the sharded one).
+    """
+
+    Logger.verbose(f"Setting up HiSock server ({SERVER_CONFIG['transport']} transport)")
+    try:
+        server_class = (
+            AsyncHiSockServer
+            if SERVER_CONFIG["transport"] == "asyncio"
+            else hisock.server.ThreadedHiSockServer
+        )
+        server = server_class(
+            ("127.0.0.1", SERVER_CONFIG["port"]),
+            max_connections=SERVER_CONFIG["max_connections"],
+            cache_size=1,
+        )
+    except Exception as e:
+        Logger.fatal("Failed to start server!")
+        Logger.log_error(e)
+        sys.exit(1)
+
+    GlobalHiSock.connection = server
+    metrics.count_sent_messages(server)
+    register_handlers(server, rooms)
+    register_metrics(server, rooms)
+
+    return server
+
+
+def call_later(delay: float, func: Callable, *args):
+    """Calls ``func`` after ``delay`` seconds without blocking the caller"""
+
+    server = GlobalHiSock.connection
+    if isinstance(server, AsyncHiSockServer):
+        server.call_later(delay, func, *args)
+        return
+
+    timer = Timer(delay, func, args=args)
+    timer.daemon = True
+    timer.start()
+
+
+### Metrics ###
+def register_metrics(
+    server: hisock.server.ThreadedHiSockServer | AsyncHiSockServer, rooms: RoomManager
+):
+    """Adds the gauges, which are read when the metrics are asked for"""
+
+    metrics.registry.add(
+        metrics.Gauge(
+            "players_connected",
+            "Players in a room (including ones still joining)",
+            lambda: len(rooms.players_online),
+        )
+    )
+    metrics.registry.add(
+        metrics.Gauge(
+            "queued_inputs",
+            "Inputs waiting to be used on a tick",
+            lambda: sum(
+                len(getattr(player, "input_queue", ()))
+                for player in rooms.players_online
+            ),
+        )
+    )
+    metrics.registry.add(
+        metrics.Gauge(
+            "replay_write_queue",
+            "Replay writes waiting for the writer thread",
+            replay_writer.queue.qsize,
+        )
+    )
+    if isinstance(server, AsyncHiSockServer):
+        metrics.registry.add(
+            metrics.Gauge(
+                "send_buffer_bytes",
+                "Bytes waiting to be sent to the clients",
+                lambda: sum(
+                    connection.send_buffer_size
+                    for connection in list(server.connections.values())
+                ),
+            )
+        )
+
+
+### Server handlers ###
+def register_handlers(
+    server: hisock.server.ThreadedHiSockServer | AsyncHiSockServer, rooms: RoomManager
+):
+    def on(command: str) -> Callable:
+        """Like ``server.on``, but the handler is timed by the profiler"""
+
+        def decorator(func: Callable) -> Callable:
+            return server.on(command)(tick_profiler.timed(command, func))
+
+        return decorator
+
+    joined_lock = Lock()
+    # When the clients that are joining connected (monotonic)
+    join_start_times: dict[tuple, float] = {}
+
+    def finish_join(client_data: ClientInfo, player):
+        """Lets the player in once they've changed their name and are ready"""
+
+        with joined_lock:
+            if player.joined or not (
+                player.username_changed_thread_event.is_set()
+                and player.ready_thread_event.is_set()
+            ):
+                return
+            player.joined = True
+
+        join_start_time = join_start_times.pop(client_data.ip, None)
+        if join_start_time is not None:
+            metrics.join_handshake_time.observe(monotonic() - join_start_time)
+
+        Logger.verbose("Client's ready!")
+        rooms.player_ready(client_data.ip)
+
+    def check_join_timeout(client_data: ClientInfo, player):
+        """Kicks the player if they're still joining after the timeout"""
+
+        if player.joined or rooms.get_player(client_data.ip) is not player:
+            return
+
+        # The client is required to change their name to the username that we sent
+        if not player.username_changed_thread_event.is_set():
+            Logger.fatal(
+                "Waiting for the player's username to change timed out, kicking them!"
+            )
+        # Then it needs to state that it's ready for events
+        elif not player.ready_thread_event.is_set():
+            Logger.fatal("Waiting for the client to be ready timed out, kicking them!")
+        else:
+            return
+
+        try:
+            server.disconnect_client(client_data, call_func=True)
+        except hisock.utils.ClientNotFound:
+            pass
+
+    # Nothing waits for the client to finish joining, the handlers for its name
+    # change and ``ready_for_events`` finish it and a timer kicks it if it doesn't
+    @on("join")
+    def on_client_join(client_data: ClientInfo):
+        join_start_times[client_data.ip] = monotonic()
+        Logger.log(
+            f"{client_data.name} ({hisock.iptup_to_str(client_data.ip)})"
+            " connected to the server"
+        )
+
+        username = f"{client_data.name}#{get_discriminator()}"
+
+        result = rooms.add_player(client_data.ip, username)
+        if result is None:
+            # Failed to join, disconnect player
+            Logger.log("Disconnecting player...")
+            server.disconnect_client(client_data, call_func=True)
+            return
+
+        send(server.send_client, client_data, "join_response", {"username": username})
+
+        Logger.verbose("Waiting for the client to change its name and be ready")
+        call_later(
+            SERVER_CONFIG["wait_join_timeout"], check_join_timeout, client_data, result
+        )
+
+    @on("leave")
+    def on_client_leave(client_data: ClientInfo):
+        Logger.log(
+            f"{client_data.name} ({hisock.iptup_to_str(client_data.ip)})"
+            " disconnected from the server"
+        )
+
+        # Remove player
+        rooms.remove_player(client_data.ip)
+        join_start_times.pop(client_data.ip, None)
+        metrics.registry.remove_client(client_data.ip)
+
+    @on("ready_for_events")
+    def on_ready_for_events(client_data: ClientInfo):
+        player = rooms.get_player(client_data.ip)
+        if player is None:
+            return
+
+        player.ready_thread_event.set()
+        finish_join(client_data, player)
+
+    @on("request_data")
+    def on_request_data(client_data: ClientInfo):
+        rooms.request_keyframe(client_data.ip)
+
+    @on("input")
+    def on_client_input(client_data: ClientInfo, data: bytes):
+        # Sent as soon as a key is pressed, queued to be used on one of the next ticks
+        # Packed or JSON
+        try:
+            client_input = loads(data)
+            direction = client_input["direction"]
+            seq = client_input["seq"]
+        except (CodecError, ValueError, KeyError, TypeError):
+            Logger.warn(f"Invalid input from {client_data.ip}: {data!r}")
+            return
+
+        # JSON can have anything in it, and it'd only fail on the tick (which
+        # pauses every room)
+        if (
+            not isinstance(client_input, dict)
+            or not isinstance(direction, str)
+            or not isinstance(seq, int)
+            or isinstance(seq, bool)
+            or seq < 0
+        ):
+            Logger.warn(f"Invalid input from {client_data.ip}: {data!r}")
+            return
+
+        rooms.update_player(client_data.ip, direction, seq)
+
+    @on("name_change")
+    def on_name_change(client_data: ClientInfo, old_name: str, new_name: str):
+        Logger.verbose(f"Name change: {old_name} -> {new_name}")
+        # Check if the name change was sane
+        player = rooms.get_player(client_data.ip)
+        if player is None:
+            return
+
+        if player.identifier == new_name:
+            # The name matches
+            player.username_changed_thread_event.set()
+            finish_join(client_data, player)
+            return
+
+        Logger.fatal(
+            f"{old_name} changed their name to {new_name}, "
+            "but that's not a valid player name! Kicking!"
+        )
+        server.disconnect_client(client_data, call_func=True)
+
+    @server.on("message")
+    def on_message(client_data: ClientInfo, command: str, message: bytes):
+        # Called after every command
+        metrics.count_received(client_data, command, message)
+
+    @on("*")
+    def on_wildcard(client_data: ClientInfo, command: str, data: str):
+        Logger.warn(
+            f"Wildcard command received from {client_data.ip}: {command} "
+            f"with data: {data}"
+        )
@@ -0,0 +1,84 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-14
+
+Headless server (no pygame window or widgets)
+Run with ``python -m multiplayer_snake.server.headless``
+"""
+
+### Setup ###
+from os import _exit as force_exit
+from multiplayer_snake.shared.common import Logger
+from multiplayer_snake.shared.config_parser import parse
+from multiplayer_snake.shared.hisock_tools import hisock_callback
+from multiplayer_snake.server.rooms import RoomManager, room_manager
+from multiplayer_snake.server.sharding import ShardedRoomManager
+from multiplayer_snake.server.scheduler import TickScheduler
+from multiplayer_snake.server.handlers import create_server
+from multiplayer_snake.server.async_server import AsyncHiSockServer
+from multiplayer_snake.server.replay import replay_writer
+from multiplayer_snake.server.metrics import start_metrics_server
+from multiplayer_snake.server.profiler import tick_profiler
+
+CONFIG = parse()
+SERVER_CONFIG = CONFIG["server"]
+
+### Main ###
+# Rooms are either run here or in worker processes
+rooms: RoomManager | ShardedRoomManager = room_manager
+
+
+def error_handler(error: Exception):
+    # There's nobody to show a dialog to, so pause the games and keep going
+    Logger.log_error(error)
+    rooms.pause_all()
+
+
+if __name__ == "__main__":
+    if SERVER_CONFIG["worker_processes"] != 0:
+        rooms = ShardedRoomManager()
+        # The workers tick their own rooms, this only logs their stats
+        scheduler = TickScheduler(
+            rooms.run,
+            interval=SERVER_CONFIG["worker_stats_interval"],
+            error_handler=error_handler,
+        )
+    else:
+        # There's no start button, so the games start once the players are ready
+        room_manager.set_auto_start(True)
+        scheduler = TickScheduler(
+            rooms.run, error_handler=error_handler, profiler=tick_profiler
+        )
+
+    server = create_server(rooms)
+    server.start(callback=hisock_callback, error_handler=error_handler)
+    if isinstance(rooms, ShardedRoomManager):
+        rooms.start()
+    metrics_server = start_metrics_server()
+
+    Logger.verbose("Everything ready, running headless loop!")
+    if isinstance(server, AsyncHiSockServer):
+        # Tick on the event loop, between the handlers
+        scheduler.start_async(server.loop)
+    else:
+        scheduler.start()
+    try:
+        scheduler.join()
+    except KeyboardInterrupt:
+        print("\nExiting gracefully...")
+    scheduler.stop()
+
+    try:
+        Logger.verbose("Closing server")
+        if isinstance(rooms, ShardedRoomManager):
+            rooms.close()
+        server.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        # Finish writing the replays
+        replay_writer.close()
+        Logger.verbose("Goodbye!")
+    except KeyboardInterrupt:
+        print("\nForcing!")
+        force_exit(1)
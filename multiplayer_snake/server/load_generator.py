@@ -0,0 +1,290 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-22
+
+Load generator, which connects lots of simulated players to a local server.
+Each one joins like the real client does ("join_response", changing its name and
+"ready_for_events"), unpacks every "update" and sends inputs (random ones, or a
+script that goes around in a square). Nothing is drawn, so no pygame.
+How many joined, how long joining took and how evenly the updates came in are
+reported at the end.
+
+Run with ``python -m multiplayer_snake.server.load_generator`` (``--help`` for
+options) while a server is running
+"""
+
+### Setup ###
+import json
+import random
+import argparse
+from pathlib import Path
+from time import monotonic, sleep
+from collections import Counter
+from multiplayer_snake.shared.common import hisock, Logger
+from multiplayer_snake.shared.config_parser import parse
+from multiplayer_snake.shared.codec import (
+    CodecError,
+    MissingKeyframeError,
+    loads,
+    pack_input,
+)
+from multiplayer_snake.shared.tools import percentile
+
+CONFIG = parse()
+SERVER_CONFIG = CONFIG["server"]
+
+# Only ever the local server
+HOST = "127.0.0.1"
+# Scripted inputs, which go around in a square
+SCRIPT = ("up", "right", "down", "left")
+
+### Classes ###
+class SimulatedClient:
+    """A player without a window. Everything happens in HiSock's handlers."""
+
+    def __init__(self, idx: int, port: int, inputs: str, input_interval: int):
+        self.name = f"load{idx}"
+        self.port = port
+        self.inputs = inputs  # "random" or "scripted"
+        self.input_interval = input_interval  # Updates between inputs
+        self.client: hisock.client.ThreadedHiSockClient | None = None
+        self.username: str | None = None
+
+        ### Stats ###
+        # Monotonic times
+        self.connect_time: float | None = None
+        self.join_response_time: float | None = None
+        self.joined_time: float | None = None
+        # None between rounds, as there's a gap then
+        self.update_times: list[float | None] = []
+        self.error: str | None = None
+        self.kicked = False
+        self.rounds = 0
+        self.missed_updates = 0
+        self.inputs_sent = 0
+
+        ### Updates ###
+        self.update_player_names: list[str] | None = None
+        self.last_tick: int | None = None
+        self.input_seq = 0
+
+    @property
+    def handshake_time(self) -> float | None:
+        """Seconds from connecting to being in a room, or None if it never was"""
+
+        if self.joined_time is None:
+            return None
+        return self.joined_time - self.connect_time
+
+    def connect(self):
+        self.connect_time = monotonic()
+        try:
+            self.client = hisock.client.ThreadedHiSockClient(
+                (HOST, self.port), name=self.name, group=None, cache_size=1
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            self.error = f"Failed to connect ({type(e).__name__})"
+            return
+
+        self.register_handlers()
+        self.client.start()
+
+    def close(self):
+        if self.client is None:
+            return
+
+        try:
+            self.client.close()
+        except Exception:  # pylint: disable=broad-except
+            # Already disconnected
+            pass
+
+    def register_handlers(self):
+        client = self.client
+
+        @client.on("join_response")
+        def _on_join_response(data: dict):
+            self.join_response_time = monotonic()
+            self.username = data["username"]
+            client.change_name(self.username)
+            client.send("ready_for_events")
+
+        @client.on("player_connect")
+        def _on_player_connect(player_data: list):
+            if self.joined_time is None and any(
+                player["identifier"] == self.username for player in player_data
+            ):
+                self.joined_time = monotonic()
+
+        @client.on("game_started")
+        def _on_game_started(_data: bytes):
+            self.rounds += 1
+            self.update_times.append(None)
+
+        @client.on("force_disconnect")
+        def _on_kicked():
+            self.kicked = True
+
+        @client.on("update")
+        def _on_update(data: bytes):
+            self.update_times.append(monotonic())
+            self.on_update(data)
+
+    def on_update(self, data: bytes):
+        try:
+            update_data = loads(data, self.update_player_names)
+        except (MissingKeyframeError, CodecError):
+            update_data = None
+
+        if update_data is not None and update_data["keyframe"]:
+            self.update_player_names = list(update_data["players"])
+        elif (
+            update_data is None
+            or self.last_tick is None
+            or update_data["tick"] != self.last_tick + 1
+        ):
+            # Missed one, so everything has to be sent again like for the real client
+            self.missed_updates += 1
+            self.last_tick = None
+            self.client.send("request_data")
+            return
+        self.last_tick = update_data["tick"]
+
+        if self.inputs == "random":
+            if random.random() < 1 / self.input_interval:
+                self.send_input(random.choice(SCRIPT))
+        elif update_data["tick"] % self.input_interval == 0:
+            self.send_input(SCRIPT[self.inputs_sent % len(SCRIPT)])
+
+    def send_input(self, direction: str):
+        self.input_seq += 1
+        self.client.send(
+            "input", pack_input({"direction": direction, "seq": self.input_seq})
+        )
+        self.inputs_sent += 1
+
+
+### Functions ###
+def summarize(values: list[float], scale: float = 1000) -> dict:
+    """Percentiles of the values (in milliseconds by default)"""
+
+    return {
+        "p50": percentile(values, 50) * scale,
+        "p90": percentile(values, 90) * scale,
+        "p99": percentile(values, 99) * scale,
+        "max": max(values, default=0.0) * scale,
+    }
+
+
+def get_results(clients: list[SimulatedClient], join_timeout: float) -> dict:
+    joined = [
+        client
+        for client in clients
+        if client.handshake_time is not None and client.handshake_time <= join_timeout
+    ]
+
+    # How far apart the updates came in (in the same round), and how far that's off
+    # from the tick rate
+    intervals = []
+    for client in clients:
+        intervals.extend(
+            later - earlier
+            for earlier, later in zip(client.update_times, client.update_times[1:])
+            if earlier is not None and later is not None
+        )
+    jitter = [
+        abs(interval - SERVER_CONFIG["time_until_update"]) for interval in intervals
+    ]
+
+    return {
+        "clients": len(clients),
+        "connected": sum(client.client is not None for client in clients),
+        "joined": len(joined),
+        "success_rate": len(joined) / len(clients) if clients else 0.0,
+        "errors": dict(Counter(client.error for client in clients if client.error)),
+        "kicked": sum(client.kicked for client in clients),
+        "join_response_ms": summarize(
+            [
+                client.join_response_time - client.connect_time
+                for client in clients
+                if client.join_response_time is not None
+            ]
+        ),
+        "handshake_ms": summarize([client.handshake_time for client in joined]),
+        "rounds": sum(client.rounds for client in clients),
+        "updates": sum(
+            time is not None for client in clients for time in client.update_times
+        ),
+        "missed_updates": sum(client.missed_updates for client in clients),
+        "inputs_sent": sum(client.inputs_sent for client in clients),
+        "update_interval_ms": summarize(intervals),
+        "update_jitter_ms": summarize(jitter),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m multiplayer_snake.server.load_generator",
+        description=f"Connects simulated players to the server on {HOST}",
+    )
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--port", type=int, default=SERVER_CONFIG["port"])
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=30.0,
+        help="Seconds to stay connected for (after connecting everyone)",
+    )
+    parser.add_argument(
+        "--connect-rate",
+        type=float,
+        default=50.0,
+        help="Clients connected per second",
+    )
+    parser.add_argument("--inputs", choices=("random", "scripted"), default="random")
+    parser.add_argument(
+        "--input-interval",
+        type=int,
+        default=5,
+        help="Updates between inputs (on average for random ones)",
+    )
+    parser.add_argument(
+        "--join-timeout",
+        type=float,
+        default=SERVER_CONFIG["wait_join_timeout"],
+        help="Seconds joining can take before it counts as failed",
+    )
+    parser.add_argument("--output", type=Path, help="Where to write the results (JSON)")
+
+    return parser.parse_args()
+
+
+### Main ###
+if __name__ == "__main__":
+    args = parse_args()
+
+    clients: list[SimulatedClient] = []
+    Logger.log(f"Connecting {args.clients} clients to {HOST}:{args.port}")
+    start_time = monotonic()
+    try:
+        for idx in range(args.clients):
+            client = SimulatedClient(idx, args.port, args.inputs, args.input_interval)
+            client.connect()
+            clients.append(client)
+
+            # Spread the connections out
+            sleep(max(start_time + (idx + 1) / args.connect_rate - monotonic(), 0.0))
+
+        Logger.log(f"Connected, running for {args.duration} seconds")
+        sleep(args.duration)
+    except KeyboardInterrupt:
+        print("\nStopping early...")
+
+    results = get_results(clients, args.join_timeout)
+    for client in clients:
+        client.close()
+
+    print(json.dumps(results, indent=4))
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=4))
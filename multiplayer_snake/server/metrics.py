@@ -0,0 +1,344 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-24
+
+Metrics for watching a running server, served over HTTP in Prometheus' text
+format (``http://127.0.0.1:<metrics_port>/metrics``). Recording is a dictionary
+lookup and an addition under a lock, so it's always on; the text is only made
+when it's asked for. Other modules can serve JSON reports next to it (see
+``reports``).
+"""
+
+### Setup ###
+import json
+from bisect import bisect_left
+from threading import Lock, Thread
+from typing import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiplayer_snake.shared.common import hisock, ClientInfo, Logger
+from multiplayer_snake.shared.config_parser import parse
+
+CONFIG = parse()
+SERVER_CONFIG = CONFIG["server"]
+
+PREFIX = "snake_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Seconds, for timing things that happen every tick
+TIME_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+# Seconds, for joining
+HANDSHAKE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# HiSock's header and the "$CMD$" and "$MSG$" around the command
+MESSAGE_OVERHEAD = 16 + 10
+
+### Classes ###
+class Metric:
+    """A metric with a value for every combination of its labels"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = PREFIX + name
+        self.description = description
+        self.labels = labels
+        self.lock = Lock()
+        # Label values -> value
+        self.values: dict[tuple, object] = {}
+
+    def remove(self, label: str, value: str):
+        """Forgets every value where ``label`` is ``value`` (like a client that left)"""
+
+        label_idx = self.labels.index(label)
+        with self.lock:
+            for label_values in list(self.values):
+                if label_values[label_idx] == value:
+                    del self.values[label_values]
+
+    def format_labels(self, label_values: tuple, extra: str = "") -> str:
+        labels = [
+            f'{label}="{escape(str(value))}"'
+            for label, value in zip(self.labels, label_values)
+        ]
+        if extra:
+            labels.append(extra)
+        return "{" + ",".join(labels) + "}" if labels else ""
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {escape(self.description)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for label_values, value in self.get_values():
+            lines.extend(self.render_value(label_values, value))
+
+        return lines
+
+    def get_values(self) -> list[tuple[tuple, object]]:
+        with self.lock:
+            return list(self.values.items())
+
+    def render_value(self, label_values: tuple, value) -> list[str]:
+        return [f"{self.name}{self.format_labels(label_values)} {value}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that's gotten from ``callback`` when the metrics are asked for"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, callback: Callable[[], float]):
+        super().__init__(name, description)
+        self.callback = callback
+
+    def get_values(self) -> list[tuple[tuple, object]]:
+        try:
+            return [((), self.callback())]
+        except Exception as e:  # pylint: disable=broad-except
+            Logger.warn(f"Failed to get {self.name}")
+            Logger.log_error(e)
+            return []
+
+
+class Histogram(Metric):
+    """
+    Counts the values in buckets (by their upper bound). Only the bucket a value
+    is in is counted, they're added up when rendering.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = TIME_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *label_values):
+        bucket_idx = bisect_left(self.buckets, value)
+        with self.lock:
+            # [count in each bucket and over the last one, sum]
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bucket_idx] += 1
+            series[1] += value
+
+    def render_value(self, label_values: tuple, value) -> list[str]:
+        counts, total = value[0].copy(), value[1]
+        lines = []
+        count = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            count += bucket_count
+            labels = self.format_labels(label_values, f'le="{bound}"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+        labels = self.format_labels(label_values)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count}")
+
+        return lines
+
+
+class Registry:
+    """Every metric, in the order they were added"""
+
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def add(self, metric: Metric) -> Metric:
+        # Added again when the server is set up again (like the GUI restarting)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def remove_client(self, client: tuple):
+        """Forgets a client's values once they've left"""
+
+        client = client_label(client)
+        for metric in self.metrics.values():
+            if "client" in metric.labels:
+                metric.remove("client", client)
+
+    def render(self) -> bytes:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+
+        return ("\n".join(lines) + "\n").encode()
+
+
+registry = Registry()
+# Path -> function that gets a report, served as JSON
+reports: dict[str, Callable[[], dict]] = {}
+
+### Server metrics ###
+tick_duration = registry.add(
+    Histogram("tick_duration_seconds", "How long ticks took", ("scheduler",))
+)
+tick_jitter = registry.add(
+    Histogram("tick_jitter_seconds", "How late ticks started", ("scheduler",))
+)
+get_data_time = registry.add(
+    Histogram("frame_get_data_seconds", "Time getting the data for an update")
+)
+serialize_time = registry.add(
+    Histogram("frame_serialize_seconds", "Time serializing an update")
+)
+send_time = registry.add(
+    Histogram("frame_send_seconds", "Time sending a room's updates to its players")
+)
+messages_sent = registry.add(
+    Counter("messages_sent_total", "Messages sent to clients", ("client", "command"))
+)
+bytes_sent = registry.add(
+    Counter("bytes_sent_total", "Bytes sent to clients", ("client", "command"))
+)
+messages_received = registry.add(
+    Counter(
+        "messages_received_total", "Messages received from clients", ("client", "command")
+    )
+)
+bytes_received = registry.add(
+    Counter("bytes_received_total", "Bytes received from clients", ("client", "command"))
+)
+handler_time = registry.add(
+    Histogram("handler_seconds", "Time spent in the handlers", ("command",))
+)
+join_handshake_time = registry.add(
+    Histogram(
+        "join_handshake_seconds",
+        "Time from a client connecting to being in a room",
+        buckets=HANDSHAKE_BUCKETS,
+    )
+)
+
+
+### Functions ###
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def client_label(client: tuple | ClientInfo) -> str:
+    if isinstance(client, ClientInfo):
+        client = client.ip
+    if isinstance(client, str):
+        # A client's name
+        return client
+    return hisock.iptup_to_str(client)
+
+
+def message_size(command: str, content) -> int:
+    """Roughly how many bytes a message is, with HiSock's header"""
+
+    if content is None:
+        size = 0
+    elif isinstance(content, bytes):
+        size = len(content)
+    elif isinstance(content, str):
+        size = len(content.encode())
+    elif isinstance(content, (dict, list)):
+        size = len(json.dumps(content).encode())
+    else:
+        size = len(str(content))
+
+    return MESSAGE_OVERHEAD + len(command) + size
+
+
+def count_sent(client, command: str, content):
+    label = client_label(client)
+    messages_sent.inc(label, command)
+    bytes_sent.inc(label, command, amount=message_size(command, content))
+
+
+def count_received(client, command: str, content):
+    label = client_label(client)
+    messages_received.inc(label, command)
+    bytes_received.inc(label, command, amount=message_size(command, content))
+
+
+def count_sent_messages(server):
+    """Counts everything the server sends (by wrapping its send methods)"""
+
+    send_client = server.send_client
+    send_all_clients = server.send_all_clients
+
+    def counted_send_client(client, command: str, content=None):
+        send_client(client, command, content)
+        count_sent(client, command, content)
+
+    def counted_send_all_clients(command: str, content=None):
+        send_all_clients(command, content)
+        count_sent("all", command, content)
+
+    server.send_client = counted_send_client
+    server.send_all_clients = counted_send_all_clients
+
+
+### HTTP ###
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable=invalid-name
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            body = registry.render()
+            content_type = CONTENT_TYPE
+        elif path in reports:
+            body = json.dumps(reports[path]()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        Logger.verbose(f"Metrics request: {format % args}")
+
+
+def start_metrics_server(
+    port: int = SERVER_CONFIG["metrics_port"],
+) -> ThreadingHTTPServer | None:
+    """Serves the metrics on its own thread (if the port isn't -1)"""
+
+    if port < 0:
+        return None
+
+    try:
+        http_server = ThreadingHTTPServer(("127.0.0.1", port), MetricsRequestHandler)
+    except OSError as e:
+        Logger.warn(f"Failed to start the metrics server on port {port}")
+        Logger.log_error(e)
+        return None
+    http_server.daemon_threads = True
+
+    Thread(target=http_server.serve_forever, name="metrics server", daemon=True).start()
+    Logger.log(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+
+    return http_server
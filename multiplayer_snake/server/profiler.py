@@ -0,0 +1,238 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-25
+
+Tick profiler, for finding out why a tick ran long after the fact.
+The rooms time every phase of their ticks (getting the inputs, food, moving,
+collisions, getting the data, serializing, sending and recording) and the
+handlers are timed too. The last ``tick_history_length`` of each are kept.
+A watchdog thread takes a sample of the ticking thread's stack if a tick is still
+going after ``slow_tick_fraction`` of ``time_until_update``, and slow ticks are
+kept (and logged) with the sample and every room's phases.
+Everything that's kept is served as JSON on the metrics server's ``/profile``.
+"""
+
+### Setup ###
+import sys
+from inspect import signature
+from time import monotonic, perf_counter, time
+from threading import Condition, Lock, Thread, get_ident
+from traceback import format_stack
+from collections import defaultdict, deque
+from multiplayer_snake.shared.common import Logger
+from multiplayer_snake.shared.config_parser import parse
+from multiplayer_snake.server import metrics
+
+CONFIG = parse()
+SERVER_CONFIG = CONFIG["server"]
+
+SLOW_TICKS_KEPT = 50
+# Slow ticks in a row are only logged this often, they're all still kept
+SLOW_TICK_LOG_INTERVAL = 1.0  # Seconds
+
+### Classes ###
+class TickWatchdog:
+    """
+    Samples the stack of the thread that's ticking if the tick is still going
+    after ``budget`` seconds
+    """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.condition = Condition()
+        self.tick_id: int = 0
+        self.deadline: float | None = None  # Monotonic, None between ticks
+        self.thread_ident: int | None = None
+        self.stack: str | None = None
+        self.thread: Thread | None = None
+
+    def tick_started(self):
+        if self.thread is None:
+            self.thread = Thread(target=self._run, name="tick watchdog", daemon=True)
+            self.thread.start()
+
+        with self.condition:
+            self.tick_id += 1
+            self.deadline = monotonic() + self.budget
+            self.thread_ident = get_ident()
+            self.stack = None
+            self.condition.notify()
+
+    def tick_finished(self) -> str | None:
+        """Returns the stack sample, if the tick went over"""
+
+        with self.condition:
+            self.deadline = None
+            return self.stack
+
+    def _run(self):
+        with self.condition:
+            while True:
+                if self.deadline is None:
+                    self.condition.wait()
+                    continue
+
+                remaining = self.deadline - monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+
+                frame = sys._current_frames().get(  # pylint: disable=protected-access
+                    self.thread_ident
+                )
+                if frame is not None:
+                    self.stack = "".join(format_stack(frame))
+
+                # Wait for the next tick
+                tick_id = self.tick_id
+                while self.tick_id == tick_id:
+                    self.condition.wait()
+
+
+class TickProfiler:
+    """Keeps the phase times of the last ticks and the handlers' times"""
+
+    def __init__(
+        self,
+        enabled: bool = SERVER_CONFIG["tick_profiler"],
+        history_length: int = SERVER_CONFIG["tick_history_length"],
+        budget: float = (
+            SERVER_CONFIG["slow_tick_fraction"] * SERVER_CONFIG["time_until_update"]
+        ),
+    ):
+        self.enabled = enabled
+        self.budget = budget
+        self.watchdog = TickWatchdog(budget)
+        self.lock = Lock()
+
+        # Newest last
+        self.ticks: deque[dict] = deque(maxlen=history_length)
+        self.handlers: deque[dict] = deque(maxlen=history_length)
+        self.slow_ticks: deque[dict] = deque(maxlen=SLOW_TICKS_KEPT)
+        self.last_slow_tick_log: float = 0.0  # Monotonic
+        self.slow_ticks_not_logged: int = 0
+
+        # Room ID -> phase times of the tick that's going
+        self.rooms: dict[int, dict[str, float]] = {}
+        self.profiling: bool = False
+
+    ### Ticks ###
+    def tick_started(self):
+        if not self.enabled:
+            return
+
+        self.rooms = {}
+        self.profiling = True
+        self.watchdog.tick_started()
+
+    def record_room(self, room_id: int, timings: dict[str, float]):
+        """Called by the rooms with the phase times of their tick"""
+
+        if self.profiling:
+            self.rooms[room_id] = timings
+
+    def tick_finished(self, scheduler_name: str, tick: int, duration: float):
+        if not self.profiling:
+            return
+
+        self.profiling = False
+        stack = self.watchdog.tick_finished()
+
+        phases = defaultdict(float)
+        for timings in self.rooms.values():
+            for phase, phase_time in timings.items():
+                phases[phase] += phase_time
+        record = {
+            "time": time(),
+            "scheduler": scheduler_name,
+            "tick": tick,
+            "duration": duration,
+            "rooms": len(self.rooms),
+            "phases": dict(phases),
+        }
+        with self.lock:
+            self.ticks.append(record)
+
+        if duration > self.budget:
+            self.slow_tick(
+                {
+                    **record,
+                    "rooms": {
+                        room_id: dict(timings) for room_id, timings in self.rooms.items()
+                    },
+                    "stack": stack,
+                }
+            )
+
+    def slow_tick(self, record: dict):
+        with self.lock:
+            self.slow_ticks.append(record)
+
+        if monotonic() - self.last_slow_tick_log < SLOW_TICK_LOG_INTERVAL:
+            self.slow_ticks_not_logged += 1
+            return
+        self.last_slow_tick_log = monotonic()
+
+        phases = ", ".join(
+            f"{phase} {phase_time * 1000:.2f}"
+            for phase, phase_time in sorted(
+                record["phases"].items(), key=lambda item: item[1], reverse=True
+            )
+        )
+        Logger.warn(
+            f"Tick {record['tick']} of the {record['scheduler']} took "
+            f"{record['duration'] * 1000:.2f} ms (over {self.budget * 1000:.2f} ms), "
+            + (
+                f"{len(record['rooms'])} rooms ticked: {phases} ms"
+                if phases
+                else "no rooms ticked"
+            )
+        )
+        if self.slow_ticks_not_logged:
+            Logger.warn(f"{self.slow_ticks_not_logged} more slow ticks weren't logged")
+            self.slow_ticks_not_logged = 0
+        if record["stack"] is not None:
+            Logger.log(f"Stack when it went over:\n{record['stack'].rstrip()}")
+
+    ### Handlers ###
+    def record_handler(self, command: str, duration: float):
+        metrics.handler_time.observe(duration, command)
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.handlers.append({"time": time(), "command": command, "duration": duration})
+
+    def timed(self, command: str, func):
+        """Wraps a handler so its time is recorded (HiSock still sees its arguments)"""
+
+        def timed_handler(*args):
+            handler_start = perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.record_handler(command, perf_counter() - handler_start)
+
+        timed_handler.__name__ = func.__name__
+        timed_handler.__doc__ = func.__doc__
+        # HiSock reads the arguments and their type hints to call the handler
+        timed_handler.__signature__ = signature(func)
+
+        return timed_handler
+
+    ### Report ###
+    def get_report(self) -> dict:
+        """Everything that's kept, newest last"""
+
+        with self.lock:
+            return {
+                "budget": self.budget,
+                "ticks": list(self.ticks),
+                "slow_ticks": list(self.slow_ticks),
+                "handlers": list(self.handlers),
+            }
+
+
+tick_profiler = TickProfiler()
+metrics.reports["/profile"] = tick_profiler.get_report
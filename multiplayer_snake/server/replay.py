@@ -0,0 +1,339 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-20
+
+Replays, so finished games can be looked at again.
+Every round is recorded as a keyframe every so often plus every tick's delta
+(each player's new head, popped tail cells, direction and the input they used),
+so any tick can be rebuilt from the keyframe before it.
+
+The file is only ever appended to (all little endian):
+- ``MAGIC``, the version and the header's length, then the header (JSON with the
+  room, round, players and such)
+- Records: the kind, the tick and the payload's length, then the payload. That's
+  a packed "update" (see :mod:`multiplayer_snake.shared.codec`), or the reason the
+  game ended for the end record.
+A replay that's still being recorded (or was cut off) can be read up to its last
+whole record.
+
+Run with ``python -m multiplayer_snake.server.replay <replay> [tick]``
+"""
+
+### Setup ###
+import sys
+import json
+import mmap
+import struct
+from pathlib import Path
+from queue import SimpleQueue
+from bisect import bisect_right
+from collections import deque
+from threading import Thread, Lock
+from typing import Iterator
+from multiplayer_snake.shared.common import Logger
+from multiplayer_snake.shared.codec import CodecError, loads
+
+MAGIC = b"SNKREPLY"
+VERSION = 1
+
+# Record kinds
+KEYFRAME = 1
+DELTA = 2
+END = 3
+
+FILE_HEADER = struct.Struct("<8sBI")  # Magic, version, header length
+RECORD = struct.Struct("<BII")  # Kind, tick, payload length
+
+# Tells the writer thread to stop
+_STOP = object()
+
+
+### Errors ###
+class ReplayError(Exception):
+    ...
+
+
+### Recording ###
+class ReplayWriter:
+    """
+    Writes every replay that's being recorded to disk on its own thread, so
+    recording is only putting bytes in a queue and never blocks a tick
+    """
+
+    def __init__(self):
+        # (path, bytes to append, or None to close the file) or ``_STOP``
+        self.queue: SimpleQueue = SimpleQueue()
+        self.thread: Thread | None = None
+        self._start_lock = Lock()
+
+    def write(self, path: Path, data: bytes | None):
+        """Appends to the replay at ``path`` (or closes it if ``data`` is None)"""
+
+        if self.thread is None:
+            with self._start_lock:
+                if self.thread is None:
+                    self.thread = Thread(
+                        target=self._run, name="replay writer", daemon=True
+                    )
+                    self.thread.start()
+
+        self.queue.put((path, data))
+
+    def close(self):
+        """Writes everything that's queued and stops the thread"""
+
+        if self.thread is None:
+            return
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        files = {}
+        # Replays that couldn't be opened, the rest of what's written to them is
+        # dropped instead of failing for every record
+        failed = set()
+
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+
+            path, data = item
+            try:
+                if data is None:
+                    if path in files:
+                        files.pop(path).close()
+                    failed.discard(path)
+                    continue
+
+                if path in failed:
+                    continue
+                if path not in files:
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    # Never added on to an existing replay, two rounds in one file
+                    # can't be read
+                    files[path] = open(path, "xb")
+                files[path].write(data)
+            except OSError as e:
+                Logger.warn(f"Failed to write replay {path}")
+                Logger.log_error(e)
+                if path not in files:
+                    failed.add(path)
+
+            # Flush once everything that's queued has been written
+            if self.queue.empty():
+                for file in files.values():
+                    file.flush()
+
+        for file in files.values():
+            file.close()
+
+
+replay_writer = ReplayWriter()
+
+
+class ReplayRecorder:
+    """Records one round to a replay file (through the writer thread)"""
+
+    def __init__(self, path: Path, header: dict, writer: ReplayWriter = replay_writer):
+        self.path = path
+        self.writer = writer
+        self.ended = False
+
+        encoded_header = json.dumps(header).encode()
+        self.writer.write(
+            path, FILE_HEADER.pack(MAGIC, VERSION, len(encoded_header)) + encoded_header
+        )
+
+    def _record(self, kind: int, tick: int, payload: bytes):
+        if self.ended:
+            return
+        self.writer.write(self.path, RECORD.pack(kind, tick, len(payload)) + payload)
+
+    def record_keyframe(self, tick: int, frame: bytes):
+        """Records a packed keyframe "update" """
+
+        self._record(KEYFRAME, tick, frame)
+
+    def record_delta(self, tick: int, frame: bytes):
+        """Records a packed delta "update" """
+
+        self._record(DELTA, tick, frame)
+
+    def end(self, tick: int, reason: str):
+        self._record(END, tick, reason.encode())
+        self.ended = True
+        self.writer.write(self.path, None)
+
+
+### Playback ###
+def apply_delta(state: dict, delta: dict):
+    """Applies a delta "update" to a full state (from a keyframe) in place"""
+
+    for identifier, player_delta in delta["players"].items():
+        player = state["players"][identifier]
+        tail: deque = player["tail"]
+        for _ in range(min(player_delta["popped"], len(tail))):
+            tail.pop()
+        tail.appendleft(player_delta["head"])
+
+        player["pos"] = player_delta["head"]
+        player["direction"] = player_delta["direction"]
+        player["input_seq"] = player_delta["input_seq"]
+        # The tail catches up with the length on the move after eating
+        player["length"] = len(tail)
+
+    state["tick"] = delta["tick"]
+    if "foods" in delta:
+        state["foods"] = delta["foods"]
+    if "uptime" in delta:
+        state["uptime"] = delta["uptime"]
+
+
+class ReplayReader:
+    """
+    Reads a replay by memory mapping it. Only the record headers are read when
+    it's opened, to index the keyframes, so seeking to a tick only unpacks the
+    keyframe before it and the deltas after that.
+    """
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        try:
+            self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            self._file.close()
+            raise ReplayError(f"{self.path} is empty") from e
+
+        try:
+            magic, version, header_length = FILE_HEADER.unpack_from(self.data)
+        except struct.error as e:
+            self.close()
+            raise ReplayError(f"{self.path} is too short to be a replay") from e
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ReplayError(f"{self.path} isn't a version {VERSION} replay")
+
+        records_offset = FILE_HEADER.size + header_length
+        self.header: dict = json.loads(self.data[FILE_HEADER.size : records_offset])
+
+        # Keyframe ticks (in order) and where their records start
+        self.keyframe_ticks: list[int] = []
+        self.keyframe_offsets: list[int] = []
+        self.first_tick: int | None = None
+        self.last_tick: int | None = None
+        self.end_reason: str | None = None
+        self._index(records_offset)
+
+    def _records(self, offset: int) -> Iterator[tuple[int, int, int, slice]]:
+        """
+        Yields (offset, kind, tick, where the payload is) for every whole record
+        from ``offset``, without reading the payloads
+        """
+
+        while offset + RECORD.size <= len(self.data):
+            kind, tick, length = RECORD.unpack_from(self.data, offset)
+            payload_offset = offset + RECORD.size
+            if payload_offset + length > len(self.data):
+                # Cut off while it was being written
+                break
+            yield offset, kind, tick, slice(payload_offset, payload_offset + length)
+            offset = payload_offset + length
+
+    def _index(self, offset: int):
+        for record_offset, kind, tick, payload in self._records(offset):
+            if self.first_tick is None:
+                self.first_tick = tick
+            self.last_tick = tick
+
+            if kind == KEYFRAME:
+                self.keyframe_ticks.append(tick)
+                self.keyframe_offsets.append(record_offset)
+            elif kind == END:
+                self.end_reason = self.data[payload].decode()
+
+    def _unpack(self, payload: slice, player_names: list[str] | None) -> dict:
+        try:
+            return loads(self.data[payload], player_names)
+        except CodecError as e:
+            raise ReplayError(f"{self.path} has an invalid record: {e}") from e
+
+    def frames(self, start_tick: int | None = None) -> Iterator[dict]:
+        """
+        Yields the full state of every tick from ``start_tick`` (the first tick by
+        default). The same dictionary is changed and yielded every tick.
+        """
+
+        if start_tick is None:
+            start_tick = self.first_tick
+        keyframe_idx = bisect_right(self.keyframe_ticks, start_tick) - 1
+        if keyframe_idx < 0:
+            raise ReplayError(f"There's no keyframe at or before tick {start_tick}")
+
+        state = None
+        player_names = None
+        for _, kind, tick, payload in self._records(
+            self.keyframe_offsets[keyframe_idx]
+        ):
+            if kind == END:
+                return
+
+            if kind == KEYFRAME:
+                state = self._unpack(payload, None)
+                for player in state["players"].values():
+                    player["tail"] = deque(player["tail"])
+                player_names = list(state["players"])
+            else:
+                apply_delta(state, self._unpack(payload, player_names))
+
+            if tick >= start_tick:
+                yield state
+
+    def seek(self, tick: int) -> dict:
+        """Gets the full state at a tick"""
+
+        for state in self.frames(tick):
+            if state["tick"] == tick:
+                return state
+            break
+
+        raise ReplayError(f"Tick {tick} isn't in the replay")
+
+    def close(self):
+        if not self.data.closed:
+            self.data.close()
+        self._file.close()
+
+    def __enter__(self) -> "ReplayReader":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+### Main ###
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m multiplayer_snake.server.replay <replay> [tick]")
+        sys.exit(1)
+
+    with ReplayReader(sys.argv[1]) as replay:
+        print(json.dumps(replay.header, indent=4))
+        print(
+            f"Ticks {replay.first_tick} to {replay.last_tick}, "
+            f"{len(replay.keyframe_ticks)} keyframes"
+        )
+        print(f"Ended: {replay.end_reason or 'no (still recording or cut off)'}")
+
+        if len(sys.argv) > 2:
+            state = replay.seek(int(sys.argv[2]))
+            print(f"Tick {state['tick']}:")
+            for identifier, player in state["players"].items():
+                print(
+                    f"  {identifier}: head {player['pos']}, length {player['length']}, "
+                    f"going {player['direction']} (input {player['input_seq']})"
+                )
+            print(f"  Foods: {[food['pos'] for food in state['foods']]}")
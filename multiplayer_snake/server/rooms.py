@@ -0,0 +1,227 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-15
+
+Room manager, so one server can host many games at once
+"""
+
+### Setup ###
+from time import time
+from itertools import count
+from threading import RLock
+from multiplayer_snake.shared.common import Logger
+from multiplayer_snake.shared.config_parser import parse
+from multiplayer_snake.shared.hisock_tools import HiSockCache, hisock_callback
+from multiplayer_snake.server.game import SnakeGame, ServerSnakePlayer
+
+CONFIG = parse()
+SERVER_CONFIG = CONFIG["server"]
+
+### Classes ###
+class RoomManager:
+    """
+    Creates, runs and tears down rooms (each one is a :class:`SnakeGame`).
+    Every client is put in a room that hasn't started yet, and a new room is made
+    if they're all full.
+    Players joining and leaving (on the HiSock threads) wait for the tick that's
+    going to finish, so a room is never changed in the middle of one.
+    """
+
+    def __init__(self, max_rooms: int = SERVER_CONFIG["max_rooms"]):
+        self.max_rooms = max_rooms  # 0 for no limit
+        self.rooms: dict[int, SnakeGame] = {}
+        # Client IP address -> their room
+        self.player_rooms: dict[tuple, SnakeGame] = {}
+        self._room_ids = count()
+        # Held while ticking and while changing the rooms or who's in them
+        self.lock = RLock()
+
+        self.auto_start: bool = SERVER_CONFIG["auto_start"]
+        self.start_time: float = time()
+
+    ### Rooms ###
+    def create_room(self) -> SnakeGame | None:
+        """Creates an empty room, returns None if there are too many rooms"""
+
+        if self.max_rooms and len(self.rooms) >= self.max_rooms:
+            return None
+
+        room = SnakeGame(room_id=next(self._room_ids))
+        room.auto_start = self.auto_start
+        self.rooms[room.room_id] = room
+
+        Logger.verbose(f"Created room {room.room_id}")
+
+        return room
+
+    def remove_room(self, room: SnakeGame):
+        room.pause()
+        del self.rooms[room.room_id]
+
+        Logger.verbose(f"Removed room {room.room_id}")
+
+    def find_open_room(self) -> SnakeGame | None:
+        """Finds a room that hasn't started and has space, or creates one"""
+
+        for room in self.rooms.values():
+            if not room.running and len(room.players_online) < room.num_players:
+                return room
+
+        return self.create_room()
+
+    def get_room(self, ip_address: tuple) -> SnakeGame | None:
+        return self.player_rooms.get(ip_address)
+
+    ### Players ###
+    def add_player(self, ip_address: tuple, username: str) -> ServerSnakePlayer | None:
+        """Puts a player in a room. Returns None if they couldn't be added."""
+
+        with self.lock:
+            room = self.find_open_room()
+            if room is None:
+                Logger.warn("Every room is full")
+                return None
+
+            player = room.add_player(ip_address, username)
+            if player is None:
+                # Don't leave an empty room behind
+                if len(room.players_online) == 0:
+                    self.remove_room(room)
+                return None
+
+            self.player_rooms[ip_address] = room
+            return player
+
+    def remove_player(self, ip_address: tuple):
+        """Removes a player from their room, and tears the room down if it's empty"""
+
+        with self.lock:
+            room = self.player_rooms.pop(ip_address, None)
+            if room is None:
+                return
+
+            room.remove_player(ip_address)
+            # The bots don't keep it around
+            if len(room.humans) == 0:
+                self.remove_room(room)
+
+    def get_player(self, ip_address: tuple) -> ServerSnakePlayer | None:
+        room = self.get_room(ip_address)
+        if room is None:
+            return None
+
+        return room.get_player(ip_address)
+
+    def player_ready(self, ip_address: tuple):
+        """The player finished joining, so tell everyone in their room"""
+
+        player = self.get_player(ip_address)
+        if player is None:
+            return
+
+        with self.lock:
+            player.ready_for_events = True
+            room = player.game
+            room.send_all(
+                "player_connect", [player.get_data() for player in room.players_online]
+            )
+
+    def update_player(self, ip_address: tuple, direction: str, seq: int = 0):
+        player = self.get_player(ip_address)
+        if player is None:
+            return
+
+        player.queue_input(direction, seq)
+
+    def request_keyframe(self, ip_address: tuple):
+        """Sends the game data to the player (with the next tick)"""
+
+        room = self.get_room(ip_address)
+        if room is None:
+            return
+
+        with self.lock:
+            room.request_keyframe(ip_address)
+
+    @property
+    def players_online(self) -> list[ServerSnakePlayer]:
+        # Rooms can be added and removed by the HiSock threads while this is going
+        return [
+            player
+            for room in list(self.rooms.values())
+            for player in list(room.players_online)
+        ]
+
+    ### Running ###
+    def run(self):
+        """Runs every room. Should be called every tick (by the tick scheduler)"""
+
+        with self.lock:
+            for room in list(self.rooms.values()):
+                room.run()
+
+        # Only a message from a client pops the sent cache, and the rounds starting
+        # and ending send things without one
+        if HiSockCache.cache["sent"]:
+            hisock_callback()
+
+    def start_all(self):
+        """Starts every room that has everybody ready"""
+
+        with self.lock:
+            for room in list(self.rooms.values()):
+                if not room.running and room.ready_to_start:
+                    room.start()
+
+    def pause_all(self):
+        with self.lock:
+            for room in list(self.rooms.values()):
+                room.pause()
+
+    def stop_all(self):
+        """Stops every room. Assumes the rooms have been paused."""
+
+        with self.lock:
+            for room in list(self.rooms.values()):
+                room.stop()
+
+    def set_auto_start(self, auto_start: bool):
+        self.auto_start = auto_start
+        for room in list(self.rooms.values()):
+            room.auto_start = auto_start
+
+    @property
+    def running(self) -> bool:
+        """Whether any room is running"""
+
+        return any(room.running for room in list(self.rooms.values()))
+
+    @property
+    def running_rooms(self) -> list[SnakeGame]:
+        return [room for room in list(self.rooms.values()) if room.running]
+
+    @property
+    def open_slots(self) -> int:
+        """How many more players can join rooms that haven't started"""
+
+        return sum(
+            room.num_players - len(room.players_online)
+            for room in list(self.rooms.values())
+            if not room.running
+        )
+
+    @property
+    def uptime(self) -> int:
+        """Seconds since the server started"""
+
+        return int(time() - self.start_time)
+
+    @property
+    def frames(self) -> int:
+        """Frames of every room added together"""
+
+        return sum(room.frames for room in list(self.rooms.values()))
+
+
+room_manager = RoomManager()
@@ -0,0 +1,189 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-17
+
+Tick scheduler, which ticks the games on its own thread so they don't depend on
+how long a GUI frame takes (and nothing has to spin while waiting)
+"""
+
+### Setup ###
+import asyncio
+from concurrent.futures import Future
+from typing import Callable
+from collections import deque
+from time import monotonic, perf_counter, sleep
+from threading import Thread, Event
+from multiplayer_snake.shared.common import Logger
+from multiplayer_snake.shared.config_parser import parse
+from multiplayer_snake.shared.tools import percentile
+from multiplayer_snake.server import metrics
+from multiplayer_snake.server.profiler import TickProfiler
+
+CONFIG = parse()
+SERVER_CONFIG = CONFIG["server"]
+
+# Sleeping can oversleep by around a millisecond, so the end is waited out by
+# yielding instead
+SPIN_TIME = 0.001  # Seconds
+
+### Classes ###
+class TickScheduler:
+    """
+    Calls ``tick`` every ``interval`` seconds on its own thread.
+
+    Deadlines are kept on the monotonic clock and moved forward by exactly
+    ``interval`` every tick, so a late tick doesn't push back the ones after it.
+    If the ticks fall more than ``max_catch_up_ticks`` behind (like after a long
+    stall), the missed ticks are skipped instead of being run all at once.
+    How late every tick started (the jitter) and how long it took are kept for
+    the last ``history_length`` ticks. With a ``profiler``, the ticks are profiled
+    (see :mod:`multiplayer_snake.server.profiler`).
+
+    It can also run as a timer on an asyncio event loop (:meth:`start_async`), so
+    the ticks happen on the same thread as an asyncio server's handlers.
+    """
+
+    def __init__(
+        self,
+        tick: Callable[[], None],
+        interval: float = SERVER_CONFIG["time_until_update"],
+        max_catch_up_ticks: int = SERVER_CONFIG["max_catch_up_ticks"],
+        history_length: int = SERVER_CONFIG["tick_history_length"],
+        error_handler: Callable[[Exception], None] | None = None,
+        name: str = "tick scheduler",
+        profiler: TickProfiler | None = None,
+    ):
+        self.tick = tick
+        self.name = name
+        self.interval = interval
+        self.max_catch_up_ticks = max_catch_up_ticks
+        self.error_handler = error_handler
+        self.profiler = profiler
+
+        self.ticks: int = 0
+        self.skipped_ticks: int = 0
+        self.next_tick_time: float = 0.0  # Monotonic
+        # Seconds, newest last
+        self.jitter: deque[float] = deque(maxlen=history_length)
+        self.durations: deque[float] = deque(maxlen=history_length)
+
+        self._stop_event = Event()
+        self.thread = Thread(target=self._run, name=name, daemon=True)
+        # When running on an event loop instead
+        self._future: Future | None = None
+
+    ### Thread ###
+    def start(self):
+        self.next_tick_time = monotonic() + self.interval
+        self.thread.start()
+
+    def start_async(self, loop: asyncio.AbstractEventLoop):
+        """Runs the ticks on ``loop`` (which can be running in another thread)"""
+
+        self.next_tick_time = monotonic() + self.interval
+        self._future = asyncio.run_coroutine_threadsafe(self._run_async(), loop)
+
+    def stop(self):
+        self._stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout=self.interval * 2)
+        if self._future is not None:
+            self._future.cancel()
+
+    def join(self):
+        """Waits for the scheduler to stop (a timeout is used so ^C still works)"""
+
+        while self.alive:
+            self._stop_event.wait(timeout=0.5)
+
+    @property
+    def alive(self) -> bool:
+        if self._future is not None:
+            return not self._future.done()
+        return self.thread.is_alive()
+
+    @property
+    def running(self) -> bool:
+        return self.alive and not self._stop_event.is_set()
+
+    def _sleep_until(self, deadline: float) -> bool:
+        """Sleeps until ``deadline``. Returns False if stopped in the meantime."""
+
+        while (remaining := deadline - monotonic()) > 0:
+            if remaining > SPIN_TIME:
+                if self._stop_event.wait(remaining - SPIN_TIME):
+                    return False
+            else:
+                sleep(0)
+
+        return not self._stop_event.is_set()
+
+    def _run(self):
+        while self._sleep_until(self.next_tick_time):
+            self._run_tick()
+
+    async def _run_async(self):
+        while not self._stop_event.is_set():
+            await asyncio.sleep(max(self.next_tick_time - monotonic(), 0.0))
+            self._run_tick()
+
+    def _run_tick(self):
+        """Runs a tick that's due and schedules the next one"""
+
+        jitter = monotonic() - self.next_tick_time
+        self.jitter.append(jitter)
+        metrics.tick_jitter.observe(jitter, self.name)
+
+        if self.profiler is not None:
+            self.profiler.tick_started()
+        tick_start = perf_counter()
+        try:
+            self.tick()
+        except Exception as e:  # pylint: disable=broad-except
+            if self.error_handler is None:
+                Logger.log_error(e)
+            else:
+                self.error_handler(e)
+        duration = perf_counter() - tick_start
+        self.durations.append(duration)
+        metrics.tick_duration.observe(duration, self.name)
+        if self.profiler is not None:
+            self.profiler.tick_finished(self.name, self.ticks, duration)
+
+        self.ticks += 1
+        self.next_tick_time += self.interval
+
+        # Too far behind to catch up, skip the ticks that were missed
+        ticks_behind = int((monotonic() - self.next_tick_time) // self.interval)
+        if ticks_behind > self.max_catch_up_ticks:
+            Logger.warn(f"Ticks are {ticks_behind} ticks behind, skipping them")
+            self.skipped_ticks += ticks_behind
+            self.next_tick_time += ticks_behind * self.interval
+
+    ### Stats ###
+    @property
+    def time_until_next_tick(self) -> float:
+        """Seconds until the next tick"""
+
+        return max(self.next_tick_time - monotonic(), 0.0)
+
+    @property
+    def tick_load(self) -> float:
+        """How much of the tick interval is spent ticking (0 to 1, or more if late)"""
+
+        if not self.durations:
+            return 0.0
+        return sum(self.durations) / len(self.durations) / self.interval
+
+    def get_stats(self) -> dict:
+        """Tick counts, load and jitter (in milliseconds) for logging"""
+
+        return {
+            "ticks": self.ticks,
+            "skipped_ticks": self.skipped_ticks,
+            "tick_load": self.tick_load,
+            "jitter_p50": percentile(self.jitter, 50) * 1000,
+            "jitter_p99": percentile(self.jitter, 99) * 1000,
+            "jitter_max": max(self.jitter, default=0.0) * 1000,
+        }
@@ -7,479 +7,55 @@ Server side code!
 """
 
 ### Setup ###
+import re
 from typing import Callable
-from time import time
 from datetime import timedelta
+from collections import deque
 from os import _exit as force_exit
 from io import TextIOWrapper
-from random import randint
-from threading import Thread, Event
 import sys
 from multiplayer_snake import constants
 from multiplayer_snake.shared.pygame_tools import DialogWidget
-from multiplayer_snake.shared.hisock_tools import GlobalHiSock, send, hisock_callback
+from multiplayer_snake.shared.hisock_tools import hisock_callback
 from multiplayer_snake.shared.common import (
     hisock,
-    ClientInfo,
     pygame,
     Logger,
 )  # pylint: disable=no-name-in-module
-from multiplayer_snake.shared.tools import (
-    get_public_ip,
-    get_discriminator,
-    check_username,
-)
+from multiplayer_snake.shared.tools import get_public_ip, percentile
 from multiplayer_snake.shared.pygame_tools import (
     GlobalPygame,
     Text,
-    WrappedText,
+    wrap_lines,
     Widget,
     Button,
 )
 from multiplayer_snake.shared.config_parser import parse
-from multiplayer_snake.shared.shared_game import BaseSnakePlayer, SharedGame
+from multiplayer_snake.server.rooms import room_manager
+from multiplayer_snake.server.handlers import create_server
+from multiplayer_snake.server.scheduler import TickScheduler
+from multiplayer_snake.server.replay import replay_writer
+from multiplayer_snake.server.metrics import start_metrics_server
+from multiplayer_snake.server.profiler import tick_profiler
 
 CONFIG = parse()
 GUI_CONFIG = CONFIG["gui"]
 SERVER_CONFIG = CONFIG["server"]
 
+# Colors in the logs, which the log widget can't show
+ANSI_ESCAPE = re.compile(r"\033\[[0-9;]*m")
+
 # Setup pygame
 pygame.init()
 GlobalPygame.window = pygame.display.set_mode(GUI_CONFIG["window_size"])
 pygame.display.set_caption(f"{constants.__name__} Server (GUI)")
+GlobalPygame.clock = pygame.time.Clock()
 
 # Setup hisock
-Logger.verbose("Setting up HiSock server")
-try:
-    GlobalHiSock.connection = hisock.server.ThreadedHiSockServer(
-        ("127.0.0.1", CONFIG["server"]["port"]),
-        max_connections=2,
-        cache_size=1,
-    )
-except Exception as e:
-    Logger.fatal("Failed to start server!")
-    Logger.log_error(e)
-    sys.exit(1)
-
-server = GlobalHiSock.connection
-
-### Classes ###
-class GameAlreadyRunningError(Exception):
-    ...
-
-
-class SnakeGame:
-    """Handles everything that will be sent to the clients"""
-
-    def __init__(self):
-        self.num_players = 2
-        self.players_online: list[ServerSnakePlayer] = []
-
-        self.round = 0
-        self.uptime: int = 0  # Seconds
-        self.uptime_changed: bool = False  # For the GUI
-
-        self._reset()
-
-        self.default_positions = (
-            (5, round(((SharedGame.height / 2) - 1), ndigits=1)),
-            (SharedGame.width - 5, round(((SharedGame.height / 2) - 1), ndigits=1)),
-        )
-        self.default_directions = ("right", "left")
-
-    def _reset(self):
-        Logger.log("Resetting game")
-        self.frames: int = 0
-        self.running: bool = False
-        self.start_time: int = 0  # Unix timestamp
-        self.last_update_time: float = 0.0  # Unix timestamp
-        self.time_next_tick: float = 0.0  # Milliseconds
-        self.food = []
-        for player in self.players_online:
-            player.reset()
-
-    def get_data(self) -> dict:
-        """Get data for updating the clients"""
-
-        # Get the data
-        return {
-            "players": {
-                player.identifier: player.get_data() for player in self.players_online
-            },
-            "foods": [food.get_data() for food in self.food],
-            "round": self.round,
-            "uptime": self.uptime,
-            "uptime_changed": self.uptime_changed,
-        }
-
-    def get_player_idx(
-        self, identifier: tuple | str, error_on_not_found: bool = False
-    ) -> int:
-        """
-        Gets an index for a player with an identifier.
-        The identifier could be the player's name or IP address.
-        Returns -1 if not found if ``error_on_not_found`` isn't set, otherwise an
-        IndexError will be raised.
-        """
-
-        search_by_ip = isinstance(identifier, tuple)
-
-        for idx, player in enumerate(self.players_online):
-            # Name
-            if not search_by_ip:
-                if player.identifier == identifier:
-                    return idx
-                continue
-
-            # IP
-            if player.ip_address == identifier:
-                return idx
-
-        if not error_on_not_found:
-            return -1
-        raise IndexError
-
-    def get_default_pos_dir(self, player_idx: int):
-        default_pos = self.default_positions[player_idx]
-        default_dir = self.default_directions[player_idx]
-        return default_pos, default_dir
-
-    def update_player(self, player_identifier: str, direction: str):
-        """Update a player"""
-
-        player_idx = self.get_player_idx(player_identifier)
-        self.players_online[player_idx].direction = direction
-
-    def update(self):
-        """Updates the game (must be started first)"""
-
-        original_uptime = self.uptime
-        self.uptime = int(time() - self.start_time)
-        self.uptime_changed = original_uptime == self.uptime
-
-        # Is it time for the next tick?
-        time_next_tick = SERVER_CONFIG["time_until_update"] - (
-            time() - self.last_update_time
-        )
-        self.time_next_tick = time_next_tick
-        if time_next_tick >= 0:
-            return
-
-        self.frames += 1
-
-        self.last_update_time += SERVER_CONFIG["time_until_update"]
-
-        # Update players
-        for player_idx, player in enumerate(self.players_online):
-            # Update food
-            for food in self.food:
-                if food.update(player):
-                    player.touched_food()
-
-            player.update(self.players_online[player_idx - 1])
-
-        # Update clients
-        update_clients_with_data()
-
-    def run(self):
-        """Run everything. Should be called every frame"""
-
-        if not self.running:
-            return
-
-        self.update()
-
-    def start(self):
-        """Start the game"""
-
-        if self.running:
-            raise GameAlreadyRunningError
-
-        Logger.log("Starting game")
-
-        self.food = [ServerFood(), ServerFood()]
-        self.running = True
-        self.start_time = int(time())
-        self.last_update_time = time()
-
-        # Update player positions
-        for idx, player in enumerate(self.players_online):
-            player.default_pos, player.default_dir = self.get_default_pos_dir(idx)
-
-        # Alert everyone that the game has started with their default positions
-        send(
-            server.send_all_clients,
-            "game_started",
-            {
-                player.identifier: player.default_dir
-                for player in snake_game.players_online
-            },
-        )
-
-    def pause(self):
-        """Pause the game"""
-
-        if not self.running:
-            return
-
-        Logger.log("Pausing game")
-        self.running = False
-
-    def stop(self):
-        """Stop the game. Assumes the game has been paused."""
-
-        self._reset()
-
-    def add_player(self, ip_address: str, username: str):
-        """
-        Adds a player to the game and returns a ServerSnakePlayer if valid or None
-        Note: I cannot type annotate the return of this due to ServerSnakePlayer
-        not being defined yet
-        """
-
-        # Too many players already
-        if len(self.players_online) > self.num_players:
-            return None
-
-        # Username isn't good
-        # The username will have a 4 digit discriminator with a hashtag.
-        # Hashtags aren't allowed except for the discriminator.
-        if not check_username(username[:-5]):
-            return None
-
-        # Everything seems fine, add the player
-        default_pos, default_dir = self.get_default_pos_dir(len(self.players_online))
-        snake_object = ServerSnakePlayer(
-            ip_address,
-            default_pos=default_pos,
-            default_dir=default_dir,
-            default_length=1,
-            identifier=username,
-        )
-        self.players_online.append(snake_object)
-
-        Logger.verbose(f"Added player {username}")
-
-        return snake_object
-
-    def snake_died(self, identifier: str, reason: str):
-        Logger.log("The game has ended!")
-        send(
-            server.send_all_clients, "game_over", f"{identifier} died because {reason}"
-        )
-        self.stop()
-
-
-snake_game = SnakeGame()
-
-
-class ServerSnakePlayer(BaseSnakePlayer):
-    """Server side snake player"""
-
-    def __init__(self, ip_address: str, *args, **kwargs):
-        ### Server data ###
-        self.ip_address = ip_address
-        # Used for telling the join handler that the user fixed their username to match
-        self.username_changed_thread_event = Event()
-
-        ### Directions ###
-        self.direction_velocity_enum = {
-            "up": (0, -1),
-            "down": (0, 1),
-            "left": (-1, 0),
-            "right": (1, 0),
-        }
-
-        super().__init__(*args, **kwargs)
-
-    def move(self):
-        # Update position
-        new_pos = [
-            self.pos[dimension]
-            + self.direction_velocity_enum[self.direction][dimension]
-            for dimension in range(2)
-        ]
-        self.pos = new_pos
-
-        self.tail.insert(0, self.pos)
-        if len(self.tail) > self.length:
-            self.tail.pop()
-
-    def collision_checking(self, other_snake_object: "BaseSnakePlayer"):
-        # Check if the snake is out of bounds
-        if (self.pos[0] < 0 or self.pos[0] >= SharedGame.width) or (
-            self.pos[1] < 0 or self.pos[1] >= SharedGame.height
-        ):
-            self.snake_died(reason="out of bounds")
-
-        # Check if the snake is colliding with itself
-        for pos in self.tail[1:]:
-            if pos == self.pos:
-                self.snake_died(reason="collided with self")
-
-        # Check if the snake is colliding with the other snake
-        for pos in other_snake_object.tail:
-            if pos == self.pos:
-                self.snake_died(reason="collided with other snake")
-
-    def get_data(self) -> dict:
-        """Get data for updating the client"""
-
-        return {
-            "identifier": self.identifier,
-            "ip_address": self.ip_address,
-            "pos": self.pos,
-            "length": self.length,
-            "direction": self.direction,
-            "tail": self.tail,
-        }
-
-    def update(self, other_snake_player: BaseSnakePlayer):
-        """Update the player"""
-        self.move()
-        self.collision_checking(other_snake_player)
-
-    def snake_died(self, reason: str = "unknown"):
-        super().snake_died(reason)
-        snake_game.snake_died(identifier=self.identifier, reason=reason)
-
-
-class ServerFood:
-    """Server side food"""
-
-    def __init__(self):
-        self.respawn()
-
-    def respawn(self):
-        """Respawn the food"""
-
-        self.pos = (
-            randint(0, SharedGame.width - 1),
-            randint(0, SharedGame.height - 1),
-        )
-
-    def get_data(self) -> dict:
-        """Get data for updating the clients"""
-
-        return {"pos": self.pos}
-
-    def update(self, player: ServerSnakePlayer):
-        """Update the food. Returns if the player ate the food"""
-
-        # If the food is touched by a snake, respawn it
-        if tuple(map(int, player.pos)) == tuple(map(int, self.pos)):
-            Logger.log(f"{player.identifier} ate food")
-            self.respawn()
-            return True
-
-        return False
-
-
-### Server handlers ###
-@server.on("join", threaded=True)
-def on_client_join(client_data: ClientInfo):
-    Logger.log(
-        f"{client_data.name} ({hisock.iptup_to_str(client_data.ip)})"
-        " connected to the server"
-    )
-
-    username = f"{client_data.name}#{get_discriminator()}"
-
-    result: ServerSnakePlayer | None = snake_game.add_player(client_data.ip, username)
-    if result is None:
-        # Failed to join, disconnect player
-        Logger.log("Disconnecting player...")
-        server.disconnect_client(client_data, call_func=True)
-        return
-
-    send(server.send_client, client_data, "join_response", {"username": username})
-
-    # The client is required to change their name to the username that we sent
-    # Wait for them to change it before allowing them to join
-    if not result.username_changed_thread_event.wait(
-        timeout=SERVER_CONFIG["wait_join_timeout"]
-    ):
-        Logger.fatal(
-            "Waiting for the player's username to change timed out, kicking them!"
-        )
-        server.disconnect_client(client_data, call_func=True)
-        return
-
-    # Wait for the client to be ready for events (with a timeout)
-    wait_client_ready_event = Event()
-
-    def wait_client_ready():
-        Logger.verbose("Waiting for the client to state they're ready for events")
-        # The other client could have sent this! Oh well...
-        server.recv(recv_on="ready_for_events")
-        wait_client_ready_event.set()
-        Logger.verbose("Client's ready!")
-
-    wait_client_ready_thread = Thread(target=wait_client_ready)
-    wait_client_ready_thread.start()
-    if not wait_client_ready_event.wait(timeout=SERVER_CONFIG["wait_join_timeout"]):
-        Logger.verbose("Client's not ready within the timeout! Killing the thread...")
-        wait_client_ready_thread.join(timeout=0.25)
-        Logger.fatal("Waiting for the client to be ready timed out, kicking them!")
-        server.disconnect_client(client_data, call_func=True)
-        return
-
-    send(
-        server.send_all_clients,
-        "player_connect",
-        [player.get_data() for player in snake_game.players_online],
-    )
-
-
-@server.on("leave")
-def on_client_leave(client_data: ClientInfo):
-    Logger.log(
-        f"{client_data.name} ({hisock.iptup_to_str(client_data.ip)})"
-        " disconnected from the server"
-    )
-
-    # Remove player
-    del snake_game.players_online[snake_game.get_player_idx(client_data.ip)]
-
-
-@server.on("request_data")
-def update_clients_with_data():
-    send(server.send_all_clients, "update", snake_game.get_data())
-
-
-@server.on("update")
-def on_client_update(client_data: ClientInfo, data: dict):
-    player_identifier = client_data["name"]
-    new_direction = data["direction"]
-    snake_game.update_player(player_identifier, new_direction)
-
-
-@server.on("name_change")
-def on_name_change(client_data: ClientInfo, old_name: str, new_name: str):
-    Logger.verbose(f"Name change: {old_name} -> {new_name}")
-    # Check if the name change was sane
-    for player in snake_game.players_online:
-        if player.ip_address != client_data.ip:
-            continue
-        if player.identifier == new_name:
-            # The name matches, set the thread event so the join handler knows to
-            # finish the connection
-            player.username_changed_thread_event.set()
-            break
-        Logger.fatal(
-            f"{old_name} changed their name to {new_name}, "
-            "but that's not a valid player name! Kicking!"
-        )
-        server.disconnect_client(client_data, call_func=True)
-        break
-
-
-@server.on("*", threaded=True)
-def on_wildcard(client_data: ClientInfo, command: str, data: str):
-    Logger.warn(
-        f"Wildcard command received from {client_data.ip}: {command} with data: {data}"
-    )
+server = create_server()
 
+# The games are ticked on their own thread, so a slow frame doesn't delay them
+scheduler = TickScheduler(room_manager.run, profiler=tick_profiler)
 
 ### Widgets / GUI ###
 class ServerWindow:
@@ -490,6 +66,10 @@ class ServerWindow:
 
         self.widgets = self.create_widgets()
         self.dialogs = {"error": None}
+        # Only what changed is drawn, unless everything has to be (like when a
+        # dialog opens, closes or moves)
+        self.redraw_all = True
+        self.shown_dialogs: list[DialogWidget] = []
 
         Logger.verbose("Server window created")
 
@@ -522,8 +102,8 @@ class ServerWindow:
             message, text_size=12, identifier="error dialog", close=close_dialog
         )
 
-        # Pause the game
-        snake_game.pause()
+        # Pause the games
+        room_manager.pause_all()
 
     def display_dialog(
         self,
@@ -562,21 +142,49 @@ class ServerWindow:
                 continue
             dialog.update()
 
-    def draw(self):
-        """Draws all the widgets and the main window"""
+    def draw(self) -> list[pygame.Rect]:
+        """
+        Draws the widgets that changed (and the dialogs over them).
+        Returns the parts of the window that were drawn.
+        """
+
+        window = GlobalPygame.window
+        background = GUI_CONFIG["colors"]["background"]
 
-        # Draw background
-        GlobalPygame.window.fill(GUI_CONFIG["colors"]["background"])
+        dialogs = [dialog for dialog in self.dialogs.values() if dialog is not None]
+        if dialogs != self.shown_dialogs or any(dialog.dirty for dialog in dialogs):
+            self.redraw_all = True
+        self.shown_dialogs = dialogs
+
+        if self.redraw_all:
+            window.fill(background)
+        rects = [window.get_rect()] if self.redraw_all else []
 
         # Draw widgets
         for widget in self.widgets:
+            if not (self.redraw_all or widget.dirty):
+                continue
+            widget.dirty = False
+
+            # With the gap around it, as text can go a little past the border
+            rect = widget.rect.inflate(widget.padding, widget.padding)
+            if not self.redraw_all:
+                # Behind the rounded corners
+                window.fill(background, rect)
+                rects.append(rect)
+            window.set_clip(rect)
             widget.draw()
+            window.set_clip(None)
 
-        # Draw dialogs
-        for dialog in self.dialogs.values():
-            if dialog is None:
-                continue
-            dialog.draw()
+        # Draw dialogs (over the widgets that were drawn)
+        for dialog in dialogs:
+            dialog.dirty = False
+            if self.redraw_all or dialog.rect.collidelist(rects) != -1:
+                dialog.draw()
+                rects.append(dialog.rect)
+
+        self.redraw_all = False
+        return rects
 
 
 ### Widgets ###
@@ -627,18 +235,19 @@ class PlayersListWidget(ServerWidget):
         self.update(do_check=False)
 
     def update(self, do_check: bool = True):
+        players_online = room_manager.players_online
         if do_check and (
-            len(self.text_widgets["mutable"]) == len(snake_game.players_online) * 2
+            len(self.text_widgets["mutable"]) == len(players_online) * 2
         ):
             return
 
         Logger.verbose(
-            f"Updating players (players online: {len(snake_game.players_online)}, "
+            f"Updating players (players online: {len(players_online)}, "
             f"players shown: {len(self.text_widgets['mutable']) // 2})"
         )
 
         mutable_text_widgets: list[Text] = []
-        for num, player in enumerate(snake_game.players_online):
+        for num, player in enumerate(players_online):
             mutable_text_widgets.append(
                 self.create_text(
                     str(player.identifier),
@@ -647,7 +256,9 @@ class PlayersListWidget(ServerWidget):
             )
             mutable_text_widgets.append(
                 self.create_text(
-                    hisock.utils.iptup_to_str(player.ip_address),
+                    "bot"
+                    if player.is_bot
+                    else hisock.utils.iptup_to_str(player.ip_address),
                     offset=(num * 2 + 2 + 1),  # 2 because of the title
                 ),
             )
@@ -655,6 +266,7 @@ class PlayersListWidget(ServerWidget):
             Logger.verbose(f"Created text widget for player snake {player.identifier}")
 
         self.text_widgets["mutable"] = mutable_text_widgets
+        self.dirty = True
 
     def draw(self):
         super().draw()
@@ -704,8 +316,9 @@ class ServerInfoWidget(ServerWidget):
                     center=True,
                 ),
             ],
-            "mutable": [self.create_text("")] * 3,
+            "mutable": [self.create_text("")] * 4,
         }
+        self.uptime_shown: int = -1
 
         self.start_stop_button = Button(
             pos=(
@@ -727,51 +340,56 @@ class ServerInfoWidget(ServerWidget):
         self.update(do_check=False)
 
     def update(self, do_check: bool = True):
-        if (not do_check) or snake_game.uptime_changed:
+        uptime = room_manager.uptime
+        if (not do_check) or uptime != self.uptime_shown:
+            self.uptime_shown = uptime
             uptime_text_widget = self.create_text(
-                f"Uptime: {str(timedelta(seconds=snake_game.uptime))!s}", offset=5
+                f"Uptime: {str(timedelta(seconds=uptime))!s}", offset=5
             )
             self.text_widgets["mutable"][0] = uptime_text_widget
 
+            running_rooms = room_manager.running_rooms
             frame_count_widget = self.create_text(
-                f"Frames: {snake_game.frames}/"
-                + str(
-                    int(
-                        (
-                            snake_game.uptime
-                            * (1 // (CONFIG["server"]["time_until_update"] * 0.95))
-                        )
-                    )
-                )
-                + " (estimate)",
+                f"Frames: {room_manager.frames} "
+                f"({len(running_rooms)}/{len(room_manager.rooms)} rooms running)",
                 offset=6,
             )
             self.text_widgets["mutable"][1] = frame_count_widget
 
-        if snake_game.running:
+            jitter_text_widget = self.create_text(
+                f"Tick jitter (p99): {percentile(scheduler.jitter, 99) * 1000:.2f} ms",
+                offset=8,
+            )
+            self.text_widgets["mutable"][3] = jitter_text_widget
+            self.dirty = True
+
+        running_rooms = room_manager.running_rooms
+        if running_rooms:
+            time_next_tick = scheduler.time_until_next_tick * 1000
             time_next_tick_text = self.create_text(
-                f"Next frame in: {str(round(snake_game.time_next_tick, 4)).zfill(6)} ms",
+                f"Next frame in: {str(round(time_next_tick, 4)).zfill(6)} ms",
                 offset=7,
             )
             self.text_widgets["mutable"][2] = time_next_tick_text
+            self.dirty = True
 
         if self.start_stop_button.check_pressed():
-            if not snake_game.running:
-                snake_game.start()
+            if not running_rooms:
+                room_manager.start_all()
             else:
-                snake_game.pause()
+                room_manager.pause_all()
 
         if self.reset_button.check_pressed():
             # Don't allow reset if not stopped
-            if snake_game.running:
+            if running_rooms:
                 server_win.display_dialog(
                     identifier="reset_error",
-                    message="The game must be paused first!",
+                    message="The games must be paused first!",
                     center=True,
                     text_size=32,
                 )
             else:
-                snake_game._reset()
+                room_manager.stop_all()
 
     def draw(self):
         super().draw()
@@ -808,9 +426,19 @@ class ServerStatusMessagesWidget(ServerWidget):
         self.max_chars = (self.size[0] - (self.padding * 2)) // self.text_size * 2
         Logger.verbose(f"Max characters for logging: {self.max_chars}")
 
+        # The lines go under the title, and only as many as fit are kept (the
+        # oldest are dropped)
+        self.lines_top = self.pos[1] + self.text_size + self.padding
+        self.max_lines = max(
+            (self.pos[1] + self.size[1] - self.padding - self.lines_top)
+            // self.text_size,
+            1,
+        )
+        Logger.verbose(f"Max lines for logging: {self.max_lines}")
+
         self.text_widgets: dict = {
             "immutable": [self.create_text("Server logs", offset=0, text_size=16)],
-            "mutable": [],
+            "mutable": deque(maxlen=self.max_lines),
         }
         self.update()
 
@@ -818,30 +446,23 @@ class ServerStatusMessagesWidget(ServerWidget):
         sys.stdout.clear_buffer()
 
     def add_text(self, text: str):
-        # Add wrapping text
-        if len(self.text_widgets["mutable"]) == 0:
-            y_offset = self.padding
-        else:
-            y_offset = (
-                self.text_widgets["mutable"][-1].ending_y_pos
-                - (self.padding * 2)
-                - len(self.text_widgets["mutable"])
+        # Only the lines that will be shown are rendered
+        lines: deque[Text] = self.text_widgets["mutable"]
+        for line in wrap_lines(text, self.max_chars)[-self.max_lines :]:
+            lines.append(
+                Text(
+                    line,
+                    pos=(self.pos[0] + self.padding, 0),
+                    size=self.text_size,
+                    color=self.text_color,
+                    center=False,
+                )
             )
 
-        text_wrapped = WrappedText(
-            text=text,
-            max_chars=self.max_chars,
-            pos=(
-                self.pos[0] + self.padding,
-                self.pos[1] + (len(self.text_widgets["mutable"]) + self.text_size),
-            ),
-            y_offset=y_offset,
-            text_size=self.text_size,
-            text_color=self.text_color,
-            center=False,
-        )
-
-        self.text_widgets["mutable"].append(text_wrapped)
+        # Newest at the bottom
+        for idx, line_text in enumerate(lines):
+            line_text.text_rect.y = self.lines_top + (idx * self.text_size)
+        self.dirty = True
 
     def draw(self):
         super().draw()
@@ -850,29 +471,6 @@ class ServerStatusMessagesWidget(ServerWidget):
             for text in text_list:
                 text.draw()
 
-    def scroll(self, scroll_by: int):
-        for text in self.text_widgets["mutable"]:
-            text.scroll(
-                min_y=self.text_widgets["immutable"][0].text_rect.bottom,
-                scroll_by=scroll_by,
-            )
-
-    @property
-    def needs_scroll(self):
-        """Assumes there is already a message"""
-
-        return self.text_widgets["mutable"][-1].ending_y_pos >= (
-            self.size[1] + self.pos[1]
-        )
-
-    @property
-    def scroll_by(self):
-        """Assumes there is already a message"""
-
-        return self.text_widgets["mutable"][-1].ending_y_pos - (
-            self.size[1] + self.pos[1]
-        )
-
 
 ### Override stdout ###
 class StdOutOverride:
@@ -881,22 +479,20 @@ class StdOutOverride:
         # Sometimes, what will happen is a message will be logged before the server
         # window is fully initialized
         # In that case, we need to put it in a buffer and output them later
-        self.buffer = []
+        # The logger's thread writes here, and the buffer is emptied by the widget
+        self.buffer: deque[str] = deque()
 
     def write(self, text: str):
         self.file.write(text)
 
-        if text != "\n":
+        text = text.rstrip("\n")
+        if text:
             # Strip color
-            for ansi_color in Logger.colors.values():
-                text = text.replace(ansi_color, "")
-
-            self.buffer.append(text)
+            self.buffer.append(ANSI_ESCAPE.sub("", text))
 
     def flush(self):
-        """Rarely used, but keep it"""
+        """The widget empties the buffer itself (from the main thread)"""
 
-        self.clear_buffer()
         self.file.flush()
 
     def log_to_widget(self, text: str) -> bool:
@@ -904,24 +500,19 @@ class StdOutOverride:
 
         try:
             server_win.widgets[2].add_text(text)
-
-            # Scrolling
-            if server_win.widgets[2].needs_scroll:
-                server_win.widgets[2].scroll(scroll_by=server_win.widgets[2].scroll_by)
-
             return True
 
         # Sometimes, messages are logged before the logging widget is set up
-        # If this happens, just add them to the cache. It'll be flushed soon
+        # If this happens, just leave them in the buffer. It'll be emptied soon
         # enough
         except NameError:
-            self.buffer.append(text)
             return False
 
     def clear_buffer(self):
-        while len(self.buffer) > 0:
-            if not self.log_to_widget(self.buffer.pop(0)):
+        while self.buffer:
+            if not self.log_to_widget(self.buffer[0]):
                 break
+            self.buffer.popleft()
 
 
 sys.stdout = StdOutOverride(sys.stdout)
@@ -936,6 +527,10 @@ def error_handler(error: Exception):
 
 server.start(callback=hisock_callback, error_handler=error_handler)
 
+scheduler.error_handler = error_handler
+scheduler.start()
+metrics_server = start_metrics_server()
+
 
 def run_pygame_loop():
     # Handle events
@@ -946,9 +541,8 @@ def run_pygame_loop():
     # Update
     server_win.update()
 
-    # Draw
-    server_win.draw()
-    pygame.display.flip()
+    # Draw (only what changed), then wait for the next frame
+    GlobalPygame.update(server_win.draw())
 
     return True
 
@@ -960,7 +554,6 @@ def run():
                 # Request to exit
                 pygame.quit()
                 return
-            snake_game.run()
         except KeyboardInterrupt:
             print("\nExiting gracefully...")
             pygame.quit()
@@ -982,7 +575,12 @@ sys.stdout = sys.__stdout__
 
 try:
     Logger.verbose("Closing server")
+    scheduler.stop()
     server.close()
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    # Finish writing the replays
+    replay_writer.close()
     Logger.verbose("Goodbye!")
 except KeyboardInterrupt:
     print("\nForcing!")
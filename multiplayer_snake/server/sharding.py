@@ -0,0 +1,360 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-16
+
+Sharded rooms, where the rooms are spread across worker processes (so more than
+one core can tick games). The front process still accepts every HiSock
+connection and does the join handshake, then forwards everything to the worker
+that has the player's room over a pipe.
+
+Each tick, a worker sends a room's frame over the pipe once with the clients
+it's for (see ``SnakeGame.update_clients``), so it's pickled once per room
+instead of once per player. The front process then sends the same bytes to each
+of those clients. That sending is still done by one thread in the front process
+for every worker, so it's what runs out first with a lot of players (the async
+server's writes are cheaper there, as they're only buffered).
+"""
+
+### Setup ###
+from os import cpu_count
+from time import time
+from threading import Thread, Lock, Event
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+from multiplayer_snake.shared.common import hisock, Logger
+from multiplayer_snake.shared.config_parser import parse
+from multiplayer_snake.shared.hisock_tools import GlobalHiSock, hisock_callback
+from multiplayer_snake.shared.tools import check_username
+from multiplayer_snake.server.rooms import room_manager
+from multiplayer_snake.server.scheduler import TickScheduler
+from multiplayer_snake.server.replay import replay_writer
+from multiplayer_snake.server.profiler import tick_profiler
+
+CONFIG = parse()
+SERVER_CONFIG = CONFIG["server"]
+
+# Messages from the front process that the worker's room manager handles
+WORKER_COMMANDS = (
+    "add_player",
+    "remove_player",
+    "player_ready",
+    "update_player",
+    "request_keyframe",
+    "pause_all",
+    "stop_all",
+)
+
+### Worker process ###
+class PipeConnection:
+    """
+    Stands in for the HiSock server inside of a worker process (as
+    ``GlobalHiSock.connection``), passing everything that's sent to the front
+    process so it can send it to the client
+    """
+
+    def __init__(self, pipe: Connection):
+        self.pipe = pipe
+        self.cache = []  # For ``HiSockReceivedCache.auto``
+        # Written to by the tick scheduler and the worker's main thread
+        self.lock = Lock()
+
+    def send(self, *message):
+        with self.lock:
+            self.pipe.send(message)
+
+    def send_client(self, client: tuple, command: str, content=None):
+        self.send("send", [client], command, content)
+
+    def send_clients(self, clients: list, command: str, content=None):
+        # One message for the whole room
+        self.send("send", clients, command, content)
+
+
+def run_worker(worker_idx: int, pipe: Connection):
+    """
+    Main loop of a worker process, handles messages from the front process while
+    the tick scheduler ticks the rooms
+    """
+
+    connection = PipeConnection(pipe)
+    GlobalHiSock.connection = connection
+    room_manager.set_auto_start(True)
+
+    # Slow ticks are logged by the worker
+    scheduler = TickScheduler(
+        room_manager.run,
+        name=f"worker {worker_idx} tick scheduler",
+        profiler=tick_profiler,
+    )
+    scheduler.start()
+
+    stats_interval = SERVER_CONFIG["worker_stats_interval"]
+    stats_time = time()
+
+    try:
+        while True:
+            # Wait for messages until it's time to send the stats
+            if pipe.poll(max(stats_time + stats_interval - time(), 0.0)):
+                command, *args = pipe.recv()
+                if command == "close":
+                    return
+
+                if command not in WORKER_COMMANDS:
+                    Logger.warn(f"Worker {worker_idx} got unknown command {command}")
+                    continue
+
+                # Handled between ticks, never during one (see ``RoomManager.lock``)
+                with room_manager.lock:
+                    result = getattr(room_manager, command)(*args)
+                    hisock_callback()
+                if command == "add_player" and result is None:
+                    connection.send("kick", args[0])
+
+            # Stats
+            if time() - stats_time >= stats_interval:
+                connection.send(
+                    "stats",
+                    {
+                        "rooms": len(room_manager.rooms),
+                        "running_rooms": len(room_manager.running_rooms),
+                        "players": len(room_manager.players_online),
+                        "open_slots": room_manager.open_slots,
+                        "frames": room_manager.frames,
+                        **scheduler.get_stats(),
+                    },
+                )
+                stats_time = time()
+    except (KeyboardInterrupt, EOFError, BrokenPipeError):
+        # The front process is going away too
+        return
+    finally:
+        scheduler.stop()
+        replay_writer.close()
+
+
+### Front process ###
+class ShardedPlayer:
+    """What the front process knows about a player, enough for the join handshake"""
+
+    def __init__(self, ip_address: tuple, identifier: str, worker: "Worker"):
+        self.ip_address = ip_address
+        self.identifier = identifier
+        self.worker = worker
+
+        # Same as ``ServerSnakePlayer``, used by the join handler
+        self.username_changed_thread_event = Event()
+        self.ready_thread_event = Event()
+        self.joined = False
+
+
+class Worker:
+    """The front process's end of a worker process"""
+
+    def __init__(self, worker_idx: int, context: multiprocessing.context.BaseContext):
+        self.worker_idx = worker_idx
+        self.pipe, worker_pipe = context.Pipe()
+        self.process = context.Process(
+            target=run_worker,
+            args=(worker_idx, worker_pipe),
+            name=f"snake worker {worker_idx}",
+            daemon=True,
+        )
+        # The pipe is written to by the HiSock threads
+        self.lock = Lock()
+
+        # Last stats sent by the worker
+        self.stats: dict = {
+            "rooms": 0,
+            "running_rooms": 0,
+            "players": 0,
+            "open_slots": 0,
+            "frames": 0,
+            "tick_load": 0.0,
+            "jitter_p99": 0.0,
+        }
+        # Players that can still join rooms waiting to start (guessed between stats)
+        self.open_slots = 0
+        self.rooms = 0
+
+    def send(self, *message):
+        with self.lock:
+            self.pipe.send(message)
+
+    def __repr__(self):
+        return (
+            f"<Worker {self.worker_idx}: {self.stats['rooms']} rooms "
+            f"({self.stats['running_rooms']} running), {self.stats['players']} players, "
+            f"{self.stats['tick_load']:.0%} tick load, "
+            f"{self.stats['jitter_p99']:.2f} ms p99 jitter>"
+        )
+
+
+class ShardedRoomManager:
+    """
+    Has the same methods as :class:`RoomManager` that the handlers use, but the
+    rooms live in worker processes (one per core by default).
+    Players are put in a worker that has a room waiting for players, otherwise
+    the least loaded worker makes a new room.
+    """
+
+    players_per_room = 2  # Same as ``SnakeGame.num_players``
+
+    def __init__(self, num_workers: int = SERVER_CONFIG["worker_processes"]):
+        if num_workers == -1:
+            num_workers = cpu_count() or 1
+
+        # Spawn, since the HiSock threads shouldn't be forked
+        context = multiprocessing.get_context("spawn")
+        self.workers = [Worker(worker_idx, context) for worker_idx in range(num_workers)]
+        self.players: dict[tuple, ShardedPlayer] = {}
+        self.lock = Lock()
+
+        self.start_time: float = time()
+        self.closed = False
+
+        # Start the workers before there are any threads
+        for worker in self.workers:
+            worker.process.start()
+        Logger.log(f"Started {num_workers} worker processes")
+
+    def start(self):
+        """Starts passing the workers' messages to the clients (needs the server)"""
+
+        Thread(target=self._receive_loop, name="worker receiver", daemon=True).start()
+
+    def _receive_loop(self):
+        pipes = {worker.pipe: worker for worker in self.workers}
+
+        while not self.closed and pipes:
+            for pipe in wait(list(pipes), timeout=0.5):
+                worker = pipes[pipe]
+                try:
+                    message = pipe.recv()
+                except EOFError:
+                    Logger.fatal(f"Worker {worker.worker_idx} died!")
+                    del pipes[pipe]
+                    continue
+
+                self._handle_worker_message(worker, message)
+
+    def _handle_worker_message(self, worker: Worker, message: tuple):
+        server = GlobalHiSock.connection
+
+        command, *args = message
+        if command == "send":
+            clients, command, content = args
+            for client in clients:
+                try:
+                    # The worker already went through ``send``, so it's not cached
+                    # twice
+                    server.send_client(client, command, content)
+                except (hisock.utils.ClientNotFound, OSError):
+                    # They left while the message was on its way
+                    pass
+        elif command == "kick":
+            Logger.log("Disconnecting player...")
+            try:
+                server.disconnect_client(args[0], call_func=True)
+            except hisock.utils.ClientNotFound:
+                pass
+        elif command == "stats":
+            stats = args[0]
+            with self.lock:
+                worker.stats = stats
+                worker.open_slots = stats["open_slots"]
+                worker.rooms = stats["rooms"]
+
+    def _pick_worker(self) -> Worker:
+        with self.lock:
+            # Fill up rooms that are waiting for players first
+            for worker in self.workers:
+                if worker.open_slots > 0:
+                    worker.open_slots -= 1
+                    return worker
+
+            # Otherwise the least loaded worker makes a new room
+            worker = min(
+                self.workers,
+                key=lambda worker: (worker.stats["tick_load"], worker.rooms),
+            )
+            worker.open_slots += self.players_per_room - 1
+            worker.rooms += 1
+            return worker
+
+    ### Same as RoomManager ###
+    def add_player(self, ip_address: tuple, username: str) -> ShardedPlayer | None:
+        # Check here so the worker doesn't have to tell us it failed
+        if not check_username(username[:-5]):
+            return None
+
+        worker = self._pick_worker()
+        player = ShardedPlayer(ip_address, username, worker)
+        self.players[ip_address] = player
+        worker.send("add_player", ip_address, username)
+
+        return player
+
+    def remove_player(self, ip_address: tuple):
+        player = self.players.pop(ip_address, None)
+        if player is None:
+            return
+
+        player.worker.send("remove_player", ip_address)
+
+    def get_player(self, ip_address: tuple) -> ShardedPlayer | None:
+        return self.players.get(ip_address)
+
+    def _send_to_players_worker(self, ip_address: tuple, command: str, *args):
+        player = self.players.get(ip_address)
+        if player is None:
+            return
+
+        player.worker.send(command, ip_address, *args)
+
+    def player_ready(self, ip_address: tuple):
+        self._send_to_players_worker(ip_address, "player_ready")
+
+    def update_player(self, ip_address: tuple, direction: str, seq: int = 0):
+        self._send_to_players_worker(ip_address, "update_player", direction, seq)
+
+    def request_keyframe(self, ip_address: tuple):
+        self._send_to_players_worker(ip_address, "request_keyframe")
+
+    @property
+    def players_online(self) -> list[ShardedPlayer]:
+        return list(self.players.values())
+
+    def pause_all(self):
+        for worker in self.workers:
+            worker.send("pause_all")
+
+    def stop_all(self):
+        for worker in self.workers:
+            worker.send("stop_all")
+
+    ### Running ###
+    def run(self):
+        """
+        The rooms run in the workers, so just log how they're doing.
+        Should be called every ``worker_stats_interval`` seconds.
+        """
+
+        for worker in self.workers:
+            Logger.log(repr(worker))
+
+    @property
+    def worker_stats(self) -> list[dict]:
+        """The last stats from every worker (rooms, players, tick load, etc.)"""
+
+        return [dict(worker.stats, worker=worker.worker_idx) for worker in self.workers]
+
+    def close(self):
+        self.closed = True
+        for worker in self.workers:
+            try:
+                worker.send("close")
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout=1.0)
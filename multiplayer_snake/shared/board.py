@@ -0,0 +1,104 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-14
+
+Board occupancy index
+"""
+
+### Setup ###
+import random
+from multiplayer_snake.shared.shared_game import SharedGame
+
+### Classes ###
+class Board:
+    """
+    Keeps track of which cells are taken up by a snake, so collision checks are
+    single lookups instead of walking every tail.
+    The engine adds and removes the snakes' cells as they move.
+
+    The free cells are kept too (in a list, with each cell's index in a dictionary)
+    so a random free cell can be picked without looking at the whole board.
+    Removing a cell from the list swaps the last cell into its place.
+    """
+
+    def __init__(self, width: int = SharedGame.width, height: int = SharedGame.height):
+        self.width = width
+        self.height = height
+        # Cell -> identifier of the snake in it
+        self.occupied: dict[tuple[int, int], str] = {}
+        self.free_cells: list[tuple[int, int]] = []
+        self._free_cell_idxs: dict[tuple[int, int], int] = {}
+
+        self.clear()
+
+    def in_bounds(self, pos: tuple) -> bool:
+        return 0 <= pos[0] < self.width and 0 <= pos[1] < self.height
+
+    def occupant(self, pos: tuple) -> str | None:
+        """Returns the identifier of the snake in the cell, or None if it's empty"""
+
+        return self.occupied.get(pos)
+
+    def is_free(self, pos: tuple) -> bool:
+        return self.in_bounds(pos) and pos not in self.occupied
+
+    def add(self, pos: tuple, identifier: str):
+        self.occupied[pos] = identifier
+
+        # Take it out of the free cells
+        idx = self._free_cell_idxs.pop(pos, None)
+        if idx is None:
+            return
+        last_cell = self.free_cells.pop()
+        if idx < len(self.free_cells):
+            self.free_cells[idx] = last_cell
+            self._free_cell_idxs[last_cell] = idx
+
+    def remove(self, pos: tuple):
+        if self.occupied.pop(pos, None) is None:
+            return
+
+        self._free_cell_idxs[pos] = len(self.free_cells)
+        self.free_cells.append(pos)
+
+    def random_free_cell(
+        self, exclude=(), tries: int = 8, rng: random.Random = random
+    ) -> tuple[int, int] | None:
+        """
+        Picks a random free cell that isn't in ``exclude`` (like the food).
+        Returns None if there isn't one.
+        ``rng`` is what picks it (the random module by default), so it's the same
+        every time for a seeded one.
+        """
+
+        if not self.free_cells:
+            return None
+
+        for _ in range(tries):
+            pos = self.free_cells[rng.randrange(len(self.free_cells))]
+            if pos not in exclude:
+                return pos
+
+        # Almost everything left is excluded
+        choices = [pos for pos in self.free_cells if pos not in exclude]
+        if not choices:
+            return None
+        return choices[rng.randrange(len(choices))]
+
+    def copy(self) -> "Board":
+        board = Board.__new__(Board)
+        board.width = self.width
+        board.height = self.height
+        board.occupied = self.occupied.copy()
+        board.free_cells = self.free_cells.copy()
+        board._free_cell_idxs = self._free_cell_idxs.copy()
+
+        return board
+
+    def clear(self):
+        self.occupied.clear()
+        self.free_cells = [
+            (x, y) for y in range(self.height) for x in range(self.width)
+        ]
+        self._free_cell_idxs = {pos: idx for idx, pos in enumerate(self.free_cells)}
@@ -0,0 +1,279 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-18
+
+Binary codec for the messages sent every tick ("update", "game_started" and the
+client's "input"), so they don't go through JSON with string keys.
+The dictionaries are still used everywhere else, the codec only packs and
+unpacks them. :func:`loads` also takes JSON, so the dictionary path can still be
+turned on for debugging.
+"""
+
+### Setup ###
+import json
+import struct
+from itertools import chain
+
+# Every binary message starts with this, which JSON never does
+MAGIC = 0xB5
+
+# Message kinds
+KEYFRAME = 1
+DELTA = 2
+GAME_STARTED = 3
+INPUT = 4
+
+# Directions are 2 bits
+DIRECTIONS = ("up", "down", "left", "right")
+DIRECTION_IDXS = {direction: idx for idx, direction in enumerate(DIRECTIONS)}
+MAX_POPPED = 0b111111  # The other 6 bits of the delta's direction byte
+
+# Delta flags
+HAS_FOODS = 0b01
+HAS_UPTIME = 0b10
+
+### Structs ###
+# All little endian, coordinates are signed as a dead head can be off the board
+HEADER = struct.Struct("<BB")  # Magic, kind
+KEYFRAME_HEADER = struct.Struct("<IHIB")  # Tick, round, uptime, players
+# Position, length, direction, input sequence number, tail length
+KEYFRAME_PLAYER = struct.Struct("<hhHBIH")
+DELTA_HEADER = struct.Struct("<IBB")  # Tick, flags, players
+DELTA_PLAYER = struct.Struct("<hhBI")  # Head, direction | popped << 2, input seq
+COUNT = struct.Struct("<B")
+UPTIME = struct.Struct("<I")
+POSITION = struct.Struct("<hh")
+DIRECTION = struct.Struct("<B")
+DIRECTION_SEQ = struct.Struct("<BI")  # Direction, sequence number
+
+
+### Errors ###
+class CodecError(Exception):
+    ...
+
+
+class MissingKeyframeError(CodecError):
+    """A delta was received for players that aren't known from a keyframe"""
+
+
+### Helpers ###
+def _pack_name(name: str) -> bytes:
+    encoded_name = name.encode()
+    return COUNT.pack(len(encoded_name)) + encoded_name
+
+
+def _unpack_name(data: bytes, offset: int) -> tuple[str, int]:
+    (name_length,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+    return data[offset : offset + name_length].decode(), offset + name_length
+
+
+def _pack_positions(positions) -> bytes:
+    positions = tuple(positions)
+    return struct.pack(f"<{len(positions) * 2}h", *chain.from_iterable(positions))
+
+
+def _unpack_positions(data: bytes, offset: int, count: int) -> tuple[list, int]:
+    flat = struct.unpack_from(f"<{count * 2}h", data, offset)
+    return list(zip(flat[::2], flat[1::2])), offset + count * POSITION.size
+
+
+### Update ###
+def pack_update(data: dict) -> bytes:
+    """Packs a keyframe or delta "update" (from :class:`SnakeGame`)"""
+
+    if data["keyframe"]:
+        return _pack_keyframe(data)
+    return _pack_delta(data)
+
+
+def _pack_keyframe(data: dict) -> bytes:
+    players = data["players"].values()
+    parts = [
+        HEADER.pack(MAGIC, KEYFRAME),
+        KEYFRAME_HEADER.pack(data["tick"], data["round"], data["uptime"], len(players)),
+    ]
+
+    for player in players:
+        parts.append(_pack_name(player["identifier"]))
+        parts.append(
+            KEYFRAME_PLAYER.pack(
+                *player["pos"],
+                player["length"],
+                DIRECTION_IDXS[player["direction"]],
+                player["input_seq"],
+                len(player["tail"]),
+            )
+        )
+        parts.append(_pack_positions(player["tail"]))
+
+    parts.append(COUNT.pack(len(data["foods"])))
+    parts.append(_pack_positions(food["pos"] for food in data["foods"]))
+
+    return b"".join(parts)
+
+
+def _pack_delta(data: dict) -> bytes:
+    players = data["players"].values()
+    flags = (HAS_FOODS if "foods" in data else 0) | (
+        HAS_UPTIME if "uptime" in data else 0
+    )
+    parts = [
+        HEADER.pack(MAGIC, DELTA),
+        DELTA_HEADER.pack(data["tick"], flags, len(players)),
+    ]
+
+    for player in players:
+        parts.append(
+            DELTA_PLAYER.pack(
+                *player["head"],
+                DIRECTION_IDXS[player["direction"]]
+                | (min(player["popped"], MAX_POPPED) << 2),
+                player["input_seq"],
+            )
+        )
+
+    if flags & HAS_FOODS:
+        parts.append(COUNT.pack(len(data["foods"])))
+        parts.append(_pack_positions(food["pos"] for food in data["foods"]))
+    if flags & HAS_UPTIME:
+        parts.append(UPTIME.pack(data["uptime"]))
+
+    return b"".join(parts)
+
+
+def _unpack_keyframe(data: bytes, offset: int) -> dict:
+    tick, round_, uptime, num_players = KEYFRAME_HEADER.unpack_from(data, offset)
+    offset += KEYFRAME_HEADER.size
+
+    players = {}
+    for _ in range(num_players):
+        identifier, offset = _unpack_name(data, offset)
+        x, y, length, direction, input_seq, tail_length = KEYFRAME_PLAYER.unpack_from(
+            data, offset
+        )
+        offset += KEYFRAME_PLAYER.size
+        tail, offset = _unpack_positions(data, offset, tail_length)
+        players[identifier] = {
+            "identifier": identifier,
+            "pos": (x, y),
+            "length": length,
+            "direction": DIRECTIONS[direction],
+            "input_seq": input_seq,
+            "tail": tail,
+        }
+
+    (num_foods,) = COUNT.unpack_from(data, offset)
+    foods, offset = _unpack_positions(data, offset + COUNT.size, num_foods)
+
+    return {
+        "tick": tick,
+        "keyframe": True,
+        "players": players,
+        "foods": [{"pos": pos} for pos in foods],
+        "round": round_,
+        "uptime": uptime,
+    }
+
+
+def _unpack_delta(data: bytes, offset: int, player_names: list[str] | None) -> dict:
+    tick, flags, num_players = DELTA_HEADER.unpack_from(data, offset)
+    offset += DELTA_HEADER.size
+
+    # Deltas have the players in the same order as the last keyframe
+    if player_names is None or len(player_names) != num_players:
+        raise MissingKeyframeError(f"Can't unpack the delta for tick {tick}")
+
+    players = {}
+    for identifier in player_names:
+        x, y, direction_popped, input_seq = DELTA_PLAYER.unpack_from(data, offset)
+        offset += DELTA_PLAYER.size
+        players[identifier] = {
+            "head": (x, y),
+            "popped": direction_popped >> 2,
+            "direction": DIRECTIONS[direction_popped & 0b11],
+            "input_seq": input_seq,
+        }
+
+    unpacked = {"tick": tick, "keyframe": False, "players": players}
+    if flags & HAS_FOODS:
+        (num_foods,) = COUNT.unpack_from(data, offset)
+        foods, offset = _unpack_positions(data, offset + COUNT.size, num_foods)
+        unpacked["foods"] = [{"pos": pos} for pos in foods]
+    if flags & HAS_UPTIME:
+        (unpacked["uptime"],) = UPTIME.unpack_from(data, offset)
+
+    return unpacked
+
+
+### Game started ###
+def pack_game_started(default_directions: dict) -> bytes:
+    """Packs "game_started" (identifier -> default direction)"""
+
+    parts = [HEADER.pack(MAGIC, GAME_STARTED), COUNT.pack(len(default_directions))]
+    for identifier, direction in default_directions.items():
+        parts.append(_pack_name(identifier))
+        parts.append(DIRECTION.pack(DIRECTION_IDXS[direction]))
+
+    return b"".join(parts)
+
+
+def _unpack_game_started(data: bytes, offset: int) -> dict:
+    (num_players,) = COUNT.unpack_from(data, offset)
+    offset += COUNT.size
+
+    default_directions = {}
+    for _ in range(num_players):
+        identifier, offset = _unpack_name(data, offset)
+        (direction,) = DIRECTION.unpack_from(data, offset)
+        offset += DIRECTION.size
+        default_directions[identifier] = DIRECTIONS[direction]
+
+    return default_directions
+
+
+### Input ###
+def pack_input(data: dict) -> bytes:
+    """Packs the client's "input" ({"direction": ..., "seq": ...})"""
+
+    return HEADER.pack(MAGIC, INPUT) + DIRECTION_SEQ.pack(
+        DIRECTION_IDXS[data["direction"]], data["seq"]
+    )
+
+
+def _unpack_input(data: bytes, offset: int) -> dict:
+    direction, seq = DIRECTION_SEQ.unpack_from(data, offset)
+    return {"direction": DIRECTIONS[direction], "seq": seq}
+
+
+### Unpacking ###
+def is_packed(data: bytes) -> bool:
+    return len(data) >= HEADER.size and data[0] == MAGIC
+
+
+def loads(data: bytes, player_names: list[str] | None = None) -> dict:
+    """
+    Unpacks any of the messages, or parses it as JSON if it wasn't packed.
+    ``player_names`` are the identifiers in the order of the last keyframe, which
+    are needed to unpack deltas.
+    """
+
+    if not is_packed(data):
+        return json.loads(data)
+
+    try:
+        _, kind = HEADER.unpack_from(data)
+        offset = HEADER.size
+        if kind == KEYFRAME:
+            return _unpack_keyframe(data, offset)
+        if kind == DELTA:
+            return _unpack_delta(data, offset, player_names)
+        if kind == GAME_STARTED:
+            return _unpack_game_started(data, offset)
+        if kind == INPUT:
+            return _unpack_input(data, offset)
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise CodecError(f"Invalid packed message: {e}") from e
+
+    raise CodecError(f"Unknown packed message kind {kind}")
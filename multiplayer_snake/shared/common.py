@@ -12,12 +12,17 @@ Common (shared) code!
 # Global imports
 from pathlib import Path
 import hisock
-import pygame
-import pygame_gui
 from multiplayer_snake.shared.tools import Logger
 
 ClientInfo = hisock.utils.ClientInfo
 
+# The headless server doesn't need pygame, so don't require it
+try:
+    import pygame
+    import pygame_gui
+except ImportError:
+    pygame = pygame_gui = None
+
 # Other imports (must be deleted later)
 from multiplayer_snake import constants
 from os import environ
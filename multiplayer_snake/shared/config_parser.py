@@ -40,6 +40,7 @@ def parse(config_path: Path | str | None = None) -> dict:
     except ParserError:
         Logger.fatal("Config file isn't a valid JSONC file")
     else:
+        Logger.verbose_enabled = config["verbose"]
         if config["verbose"]:
             Logger.verbose(
                 f"Loaded {len(config['server'].keys())} keys for server config and "
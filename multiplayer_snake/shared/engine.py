@@ -0,0 +1,202 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-21
+
+The rules of the game as a deterministic engine: a tick is only a function of the
+state and everyone's inputs, and anything random comes from the state's own seeded
+random number generator. The same seed and inputs always play out the same, so the
+server and offline simulations (like the benchmark) run the same rules, and the
+client's prediction turns like the server does. Nothing waits on a clock, so
+simulations go as fast as the engine does.
+Replays record what happened instead of the inputs, so they're played back
+without the engine (see :mod:`multiplayer_snake.server.replay`).
+"""
+
+### Setup ###
+from time import perf_counter
+from random import Random, getrandbits
+from multiplayer_snake.shared.board import Board
+from multiplayer_snake.shared.shared_game import BaseSnakePlayer, SharedGame
+
+### Classes ###
+class EngineState:
+    """
+    Everything the rules look at in a round.
+
+    The snakes are :class:`BaseSnakePlayer`s (the server's players, or plain ones for
+    simulating) and are ticked in order. They're changed by :func:`advance` like the
+    rest of the state.
+    """
+
+    def __init__(
+        self,
+        snakes: list[BaseSnakePlayer],
+        seed: int | None = None,
+        num_foods: int = 2,
+        width: int = SharedGame.width,
+        height: int = SharedGame.height,
+    ):
+        self.seed = seed if seed is not None else getrandbits(32)
+        self.rng = Random(self.seed)
+        self.tick: int = 0
+        self.snakes = snakes
+
+        self.board = Board(width, height)
+        for snake in snakes:
+            for pos in snake.tail:
+                self.board.add(pos, snake.identifier)
+
+        # In order, with each one's index for checking if a head is on food (and
+        # which one it is)
+        self.foods: list[tuple[int, int]] = []
+        self.food_positions: dict[tuple[int, int], int] = {}
+        # After the snakes, so the food isn't put on them
+        for _ in range(num_foods):
+            pos = self.board.random_free_cell(exclude=self.food_positions, rng=self.rng)
+            if pos is not None:
+                self.food_positions[pos] = len(self.foods)
+                self.foods.append(pos)
+
+        # What happened in the last tick
+        self.food_changed: bool = False
+        self.eaten: list[str] = []  # Identifiers of the snakes that ate
+        # Cells the snakes left or went in, with whether it was taken, in order
+        self.changed_cells: list[tuple[tuple[int, int], bool]] = []
+        # Identifier of the snake that died and why, which ends the round
+        self.died: tuple[str, str] | None = None
+
+    @property
+    def game_over(self) -> bool:
+        return self.died is not None
+
+    def respawn_food(self, pos: tuple[int, int]):
+        """Respawn the food at ``pos`` on a cell without a snake or other food"""
+
+        new_pos = self.board.random_free_cell(exclude=self.food_positions, rng=self.rng)
+        if new_pos is None:
+            # The board is full, leave it where it is
+            return
+
+        food_idx = self.food_positions.pop(pos)
+        self.foods[food_idx] = new_pos
+        self.food_positions[new_pos] = food_idx
+
+    def copy(self) -> "EngineState":
+        """Copies the state, so ticking the copy doesn't change this one"""
+
+        state = EngineState.__new__(EngineState)
+        state.__dict__.update(self.__dict__)
+        state.rng = Random()
+        state.rng.setstate(self.rng.getstate())
+        state.snakes = [snake.copy() for snake in self.snakes]
+        state.board = self.board.copy()
+        state.foods = self.foods.copy()
+        state.food_positions = self.food_positions.copy()
+        state.eaten = self.eaten.copy()
+        state.changed_cells = self.changed_cells.copy()
+
+        return state
+
+
+### Rules ###
+def turn(snake: BaseSnakePlayer, direction: str | None) -> bool:
+    """
+    Turns the snake if it can (not back into itself). Returns if it turned.
+    The client's prediction uses this too.
+    """
+
+    if (
+        direction is None
+        or direction == snake.direction
+        or not snake.can_turn(direction)
+    ):
+        return False
+
+    snake.direction = direction
+    return True
+
+
+def collision(board: Board, snake: BaseSnakePlayer) -> str | None:
+    """
+    Checks the head against the board (before the head is added to it). Returns
+    why the snake died, or None if it didn't.
+    """
+
+    if not board.in_bounds(snake.pos):
+        return "out of bounds"
+
+    occupant = board.occupant(snake.pos)
+    if occupant is None:
+        return None
+    if occupant == snake.identifier:
+        return "collided with self"
+    return "collided with other snake"
+
+
+def advance(
+    state: EngineState,
+    inputs: dict[str, str | None],
+    timings: dict[str, float] | None = None,
+) -> EngineState:
+    """
+    Ticks the state once in place, which is faster than :func:`step` as nothing is
+    copied. ``inputs`` is the direction each snake turns (by identifier), snakes
+    without one keep going. Once a snake has died the state doesn't change.
+    If ``timings`` is given (a ``defaultdict(float)``), the seconds spent in the
+    food, move and collision phases are added to it.
+    """
+
+    if state.died is not None:
+        return state
+
+    state.tick += 1
+    state.food_changed = False
+    state.eaten = []
+    state.changed_cells = []
+
+    for snake in state.snakes:
+        if timings is not None:
+            phase_start = perf_counter()
+
+        # The tail grows on the move after eating
+        if snake.pos in state.food_positions:
+            state.respawn_food(snake.pos)
+            snake.touched_food()
+            state.eaten.append(snake.identifier)
+            state.food_changed = True
+
+        if timings is not None:
+            timings["food"] += (now := perf_counter()) - phase_start
+            phase_start = now
+
+        turn(snake, inputs.get(snake.identifier))
+        for pos in snake.move():
+            state.board.remove(pos)
+            state.changed_cells.append((pos, False))
+
+        if timings is not None:
+            timings["move"] += (now := perf_counter()) - phase_start
+            phase_start = now
+
+        reason = collision(state.board, snake)
+        if reason is None:
+            state.board.add(snake.pos, snake.identifier)
+            state.changed_cells.append((snake.pos, True))
+
+        if timings is not None:
+            timings["collision"] += perf_counter() - phase_start
+
+        if reason is not None:
+            snake.alive = False
+            state.died = (snake.identifier, reason)
+            # The round is over, so the snakes after it don't move
+            break
+
+    return state
+
+
+def step(state: EngineState, inputs: dict[str, str | None]) -> EngineState:
+    """Gets the state after a tick, without changing ``state``"""
+
+    return advance(state.copy(), inputs)
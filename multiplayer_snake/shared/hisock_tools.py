@@ -164,6 +164,20 @@ def send(method: Callable, *args, **kwargs):
     method(*args, **kwargs)
 
 
+def send_clients(connection, clients: list, command: str, content=None):
+    """
+    Send the same thing to a few clients, all at once if the connection can (the
+    sharded workers' pipe, so it's only pickled once), otherwise one by one
+    """
+
+    if hasattr(connection, "send_clients"):
+        connection.send_clients(clients, command, content)
+        return
+
+    for client in clients:
+        connection.send_client(client, command, content)
+
+
 def hisock_callback():
     # Get received caches
     HiSockCache(HiSockReceivedCache.auto())
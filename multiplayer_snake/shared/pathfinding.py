@@ -0,0 +1,228 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-23
+
+Distance fields for the bots. Every food has a field with how many moves each
+cell is from it going around the snakes, which is kept up to date as the snakes
+move instead of searching the whole board again every tick:
+- A cell that was left can only make the cells around it closer, so the shorter
+  distances are spread out from it.
+- A cell that was taken can only make cells further away, and only the ones whose
+  shortest way went through it. Those are found and filled back in from the cells
+  around them that still have a way.
+Both only touch the cells that change, and the fields are shared by every bot in
+the room.
+"""
+
+### Setup ###
+from heapq import heapify, heappop, heappush
+from collections import deque
+from multiplayer_snake.shared.shared_game import DIRECTION_VELOCITIES, BaseSnakePlayer
+from multiplayer_snake.shared.engine import EngineState
+
+# Distance of cells that can't get to the food (and of the snakes' cells)
+UNREACHABLE = 1 << 30
+
+### Classes ###
+class DistanceField:
+    """How many moves every cell (by index) is from a food"""
+
+    def __init__(self, pathfinder: "Pathfinder", target: int):
+        self.pathfinder = pathfinder
+        self.target = target
+        self.dist: list[int] = [UNREACHABLE] * pathfinder.size
+
+        if pathfinder.walls[target]:
+            return
+        self.dist[target] = 0
+        self._lower([(0, target)])
+
+    def _lower(self, seeds: list[tuple[int, int]]):
+        """Spreads shorter distances out from the seeds (distance, cell)"""
+
+        dist = self.dist
+        walls = self.pathfinder.walls
+        neighbors = self.pathfinder.neighbors
+
+        heapify(seeds)
+        while seeds:
+            cell_dist, cell = heappop(seeds)
+            if cell_dist > dist[cell]:
+                # Got closer since it was pushed
+                continue
+
+            next_dist = cell_dist + 1
+            for neighbor in neighbors[cell]:
+                if dist[neighbor] > next_dist and not walls[neighbor]:
+                    dist[neighbor] = next_dist
+                    heappush(seeds, (next_dist, neighbor))
+
+    def freed(self, cell: int):
+        """A snake left the cell (the walls must already be updated)"""
+
+        dist = self.dist
+        if cell == self.target:
+            cell_dist = 0
+        else:
+            cell_dist = UNREACHABLE
+            for neighbor in self.pathfinder.neighbors[cell]:
+                if dist[neighbor] < cell_dist:
+                    cell_dist = dist[neighbor]
+            cell_dist += 1
+
+        if cell_dist < dist[cell]:
+            dist[cell] = cell_dist
+            self._lower([(cell_dist, cell)])
+
+    def taken(self, cell: int):
+        """A snake went in the cell (the walls must already be updated)"""
+
+        dist = self.dist
+        neighbors = self.pathfinder.neighbors
+
+        old_dist = dist[cell]
+        if old_dist >= UNREACHABLE:
+            return
+        dist[cell] = UNREACHABLE
+
+        # Find the cells that got to the food through a lost cell (starting with this
+        # one) and don't have another neighbor that's as close. Cells are decided in
+        # order of distance, so the closer ones are all decided first.
+        # Plain loops, as this is where the bots spend their time
+        lost = []
+        queue = deque(((cell, old_dist),))  # Lost cells and their old distance
+        while queue:
+            lost_cell, lost_dist = queue.popleft()
+            further = lost_dist + 1
+            for neighbor in neighbors[lost_cell]:
+                if dist[neighbor] != further:
+                    continue
+                for other in neighbors[neighbor]:
+                    if dist[other] == lost_dist:
+                        break
+                else:
+                    dist[neighbor] = UNREACHABLE
+                    lost.append(neighbor)
+                    queue.append((neighbor, further))
+
+        # Fill them back in from the cells around them
+        seeds = []
+        for lost_cell in lost:
+            cell_dist = UNREACHABLE
+            for neighbor in neighbors[lost_cell]:
+                if dist[neighbor] < cell_dist:
+                    cell_dist = dist[neighbor]
+            if cell_dist < UNREACHABLE:
+                dist[lost_cell] = cell_dist + 1
+                seeds.append((cell_dist + 1, lost_cell))
+        self._lower(seeds)
+
+
+class Pathfinder:
+    """
+    Keeps a distance field for every food in a round's state. Call :meth:`sync`
+    every tick (it only does anything once per tick).
+    """
+
+    def __init__(self):
+        self.state: EngineState | None = None
+        self.tick: int = 0
+        self.width: int = 0
+        self.height: int = 0
+        self.size: int = 0
+        # Cells are indexes (``y * width + x``)
+        self.walls = bytearray()
+        self.neighbors: list[tuple[int, ...]] = []
+        # Food position -> its field
+        self.fields: dict[tuple[int, int], DistanceField] = {}
+
+    def index(self, pos: tuple[int, int]) -> int:
+        return pos[1] * self.width + pos[0]
+
+    def sync(self, state: EngineState):
+        """Updates the fields with what changed in the last tick"""
+
+        if state is self.state and state.tick == self.tick:
+            return
+        if state is not self.state or state.tick != self.tick + 1:
+            # A new round (or a tick was missed)
+            self._rebuild(state)
+            return
+        self.tick = state.tick
+
+        # Eaten food
+        for pos in list(self.fields):
+            if pos not in state.food_positions:
+                del self.fields[pos]
+
+        for pos, taken in state.changed_cells:
+            cell = self.index(pos)
+            self.walls[cell] = taken
+            for field in self.fields.values():
+                if taken:
+                    field.taken(cell)
+                else:
+                    field.freed(cell)
+
+        # Food that was put down this tick
+        for pos in state.foods:
+            if pos not in self.fields:
+                self.fields[pos] = DistanceField(self, self.index(pos))
+
+    def _rebuild(self, state: EngineState):
+        self.state = state
+        self.tick = state.tick
+
+        board = state.board
+        if (board.width, board.height) != (self.width, self.height):
+            self.width = board.width
+            self.height = board.height
+            self.size = board.width * board.height
+            self.neighbors = [
+                tuple(
+                    self.index((x + velocity[0], y + velocity[1]))
+                    for velocity in DIRECTION_VELOCITIES.values()
+                    if board.in_bounds((x + velocity[0], y + velocity[1]))
+                )
+                for y in range(board.height)
+                for x in range(board.width)
+            ]
+
+        self.walls = bytearray(self.size)
+        for pos in board.occupied:
+            self.walls[self.index(pos)] = True
+
+        self.fields = {pos: DistanceField(self, self.index(pos)) for pos in state.foods}
+
+    def distance(self, pos: tuple[int, int]) -> int:
+        """Moves from the cell to the closest food (``UNREACHABLE`` if there's none)"""
+
+        cell = self.index(pos)
+        return min(
+            (field.dist[cell] for field in self.fields.values()), default=UNREACHABLE
+        )
+
+    def best_direction(self, snake: BaseSnakePlayer) -> str:
+        """
+        The direction that gets the snake closest to food without running into
+        anything. Going straight wins ties, and it keeps going if every way is
+        blocked.
+        """
+
+        best_direction = snake.direction
+        best_dist = UNREACHABLE + 1
+        for direction, velocity in DIRECTION_VELOCITIES.items():
+            if not snake.can_turn(direction):
+                continue
+
+            pos = (snake.pos[0] + velocity[0], snake.pos[1] + velocity[1])
+            if not self.state.board.in_bounds(pos) or self.walls[self.index(pos)]:
+                continue
+
+            dist = self.distance(pos)
+            if dist < best_dist or (dist == best_dist and direction == snake.direction):
+                best_direction = direction
+                best_dist = dist
+
+        return best_direction
@@ -8,6 +8,7 @@ Pygame tools!
 
 ### Setup ###
 from typing import Callable
+from functools import lru_cache
 from multiplayer_snake.shared.common import pygame, Logger, ROOT_PATH
 from multiplayer_snake.shared.config_parser import parse
 
@@ -16,6 +17,27 @@ FONT_PATH = ROOT_PATH / CONFIG["font_path"]
 
 pygame.font.init()
 
+# Rendered texts kept, the least recently used are dropped
+TEXT_CACHE_SIZE = 512
+
+### Fonts ###
+@lru_cache(maxsize=16)
+def get_font(size: int) -> pygame.font.Font:
+    """Loads the font once per size"""
+
+    return pygame.font.Font(FONT_PATH, size)
+
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def render_text(text: str, size: int, color: tuple | str) -> pygame.Surface:
+    """
+    Renders text, keeping the most recently used. The surfaces are shared, so they
+    mustn't be drawn on.
+    """
+
+    return get_font(size).render(text, True, color)
+
+
 ### Classes ###
 class GlobalPygame:
     """Window surface object but it's global now!"""
@@ -23,11 +45,16 @@ class GlobalPygame:
     window: pygame.Surface | None = None
     clock: pygame.time.Clock = None
     delta_time: float = 0.0
-    fps: int = 30
+    fps: int = CONFIG["gui"]["fps"]
 
     @staticmethod
-    def update():
-        pygame.display.update()
+    def update(rects: list[pygame.Rect] | None = None):
+        """Updates the window (only ``rects`` if given) and waits for the next frame"""
+
+        if rects is None:
+            pygame.display.update()
+        elif rects:
+            pygame.display.update(rects)
         GlobalPygame.delta_time = GlobalPygame.clock.tick(GlobalPygame.fps)
 
 
@@ -48,9 +75,9 @@ class Text:
         self.color = color
         self.center = center
 
-        # Create text
-        self.text_surf = pygame.font.Font(FONT_PATH, size).render(
-            text_to_display, True, color
+        # Create text (the same text is only rendered once)
+        self.text_surf = render_text(
+            text_to_display, size, tuple(color) if isinstance(color, list) else color
         )
         if center:
             self.text_rect = self.text_surf.get_rect(center=pos)
@@ -85,15 +112,7 @@ class WrappedText:
         self.center = center
 
         # Split text into lines
-        self.lines = self.text.split("\n")
-        new_lines = []
-        for line in self.lines:
-            line = [
-                line[i : i + self.max_chars]
-                for i in range(0, len(line), self.max_chars)
-            ]
-            new_lines += line
-        self.lines = new_lines
+        self.lines = wrap_lines(self.text, self.max_chars)
 
         # Create texts
         self.texts = []
@@ -130,6 +149,15 @@ class WrappedText:
             text.draw()
 
 
+def wrap_lines(text: str, max_chars: int) -> list[str]:
+    """Splits text into lines of at most ``max_chars`` characters"""
+
+    lines = []
+    for line in text.split("\n"):
+        lines += [line[i : i + max_chars] for i in range(0, len(line), max_chars)]
+    return lines
+
+
 class Button:
     """Display a button for Pygame"""
 
@@ -228,6 +256,10 @@ class Widget:
         self.border_color = border_color
         self.padding = padding
 
+        # Whether it changed since it was last drawn, set it when it does so it
+        # gets drawn again
+        self.dirty = True
+
     def create_text(self, text: str, offset: int = 0, text_size: int = 0) -> Text:
         if text_size == 0:
             text_size = self.text_size
@@ -349,6 +381,7 @@ class DialogWidget(Widget):
             (current_mouse_pos[i] - self.last_mouse_pos[i] for i in range(2))
         )
         self.rect.move_ip(*mouse_delta)
+        self.dirty = True
 
         # Drag texts
         for text in self.wrapped_text.texts:
@@ -7,6 +7,8 @@ Shared game code
 """
 
 ### Setup ###
+from copy import copy
+from collections import deque
 from multiplayer_snake.shared.common import Logger
 from multiplayer_snake.shared.config_parser import parse
 
@@ -36,6 +38,21 @@ class SharedGame:
     height = window_height // grid_snap
 
 
+# Movement rules, the same for the server and the client's prediction
+DIRECTION_VELOCITIES = {
+    "up": (0, -1),
+    "down": (0, 1),
+    "left": (-1, 0),
+    "right": (1, 0),
+}
+OPPOSITE_DIRECTIONS = {
+    "up": "down",
+    "down": "up",
+    "left": "right",
+    "right": "left",
+}
+
+
 class BaseSnakePlayer:
     """
     Since each the server and the client will have a snake player, we will
@@ -63,18 +80,50 @@ class BaseSnakePlayer:
     ):
         self.identifier = identifier
         self.alive = True
-        self.tail: list[tuple] = [self.default_pos]  # List of positions
+        # Positions from the head to the end of the tail. A deque so the head can be
+        # pushed and the tail popped in O(1) however long the snake is
+        self.tail: deque[tuple] = deque((tuple(self.default_pos),))
         self.length = default_length
-        self.pos = list(self.default_pos)
+        self.pos = tuple(self.default_pos)
         self.direction = self.default_dir
+        self.popped: int = 0  # Tail cells removed in the last move
 
         Logger.verbose(f"Snake {self.identifier} reset / created")
 
     def reset(self):
         self._reset(*self._init_args, **self._init_kwargs)
 
+    def copy(self) -> "BaseSnakePlayer":
+        """Copies the snake, with its own tail"""
+
+        snake = copy(self)
+        snake.tail = deque(self.tail)
+        return snake
+
+    def can_turn(self, direction: str) -> bool:
+        """Whether turning won't make the snake go inside itself"""
+
+        # We can move freely if we are just a head
+        return len(self.tail) == 1 or OPPOSITE_DIRECTIONS[direction] != self.direction
+
+    def move(self) -> list[tuple]:
+        """Moves the snake one cell forward. Returns the tail cells it left."""
+
+        velocity = DIRECTION_VELOCITIES[self.direction]
+        self.pos = (self.pos[0] + velocity[0], self.pos[1] + velocity[1])
+
+        # Free the end of the tail first, as the head is allowed to move into it
+        popped = []
+        while len(self.tail) >= self.length:
+            popped.append(self.tail.pop())
+        self.tail.appendleft(self.pos)
+        self.popped = len(popped)
+
+        return popped
+
     def touched_food(self):
-        self.tail.append(self.pos)
+        # The tail will grow on the next move
+        self.length += 1
 
     def snake_died(self, reason: str = "unknown"):
         Logger.log(f"Snake {self.identifier} died because {reason = }")
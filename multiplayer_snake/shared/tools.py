@@ -10,7 +10,11 @@ Tools
 
 ### Setup ###
 import os  # Platform checking for ANSI colors
-from time import strftime
+import sys
+import atexit
+from time import strftime, localtime, time
+from queue import SimpleQueue
+from threading import Thread, Lock, Event
 from urllib import request
 from random import randint
 from traceback import format_exc
@@ -18,7 +22,13 @@ from multiplayer_snake.constants import DISALLOWED_CHARS_FOR_USERNAME
 
 ### Logger ###
 class Logger:
-    """Log messages with ease"""
+    """
+    Log messages with ease.
+    Logging only puts a record (level, time and message) in a queue, and they're
+    formatted and written to stdout on their own thread, so logging never waits on
+    the terminal (or the server's log widget). Verbose messages are dropped right
+    away unless the config turns them on.
+    """
 
     colors: dict = {
         "log": "\033[92m",
@@ -26,49 +36,106 @@ class Logger:
         "fatal": "\033[91m",
         "normal": "\033[0m",
     }
+    # Level -> (color, tag), the color only goes up to the tag for verbose
+    levels: dict = {
+        "log": (colors["log"], "[INFO]"),
+        "verbose": (colors["warn"], "[VERB]"),
+        "warn": (colors["warn"], "[WARN]"),
+        "fatal": (colors["fatal"], "[FAIL]"),
+    }
+
+    # Set by the config parser once the config is loaded
+    verbose_enabled: bool = False
+
+    # (level, time, message) records, or an event to set once everything before it
+    # has been written
+    queue: SimpleQueue = SimpleQueue()
+    thread: Thread | None = None
+    _start_lock = Lock()
 
     # If the user isn't on POSIX, allow colors
     if os.name != "posix":
         os.system("color")
 
     @staticmethod
-    def time() -> str:
-        """Format current time"""
-        return f"{strftime('[%b/%d/%y %I:%M:%S %p]')}"
+    def time(timestamp: float | None = None) -> str:
+        """Format current time (or ``timestamp``)"""
+        return f"{strftime('[%b/%d/%y %I:%M:%S %p]', localtime(timestamp))}"
 
     @staticmethod
-    def log(message: str):
-        print(
-            f"{Logger.time()} {Logger.colors['log']}[INFO] {message!s}"
-            f"{Logger.colors['normal']}"
-        )
+    def format_record(level: str, timestamp: float, message: str) -> str:
+        color, tag = Logger.levels[level]
+        normal = Logger.colors["normal"]
+        if level == "verbose":
+            return f"{Logger.time(timestamp)} {color}{tag}{normal} {message}"
+        return f"{Logger.time(timestamp)} {color}{tag} {message}{normal}"
 
     @staticmethod
-    def verbose(message: str, check: bool = True):
-        if check:
-            from multiplayer_snake.shared.config_parser import parse
+    def _enqueue(level: str, message: str):
+        if Logger.thread is None:
+            with Logger._start_lock:
+                if Logger.thread is None:
+                    Logger.thread = Thread(
+                        target=Logger._write_records, name="logger", daemon=True
+                    )
+                    Logger.thread.start()
 
-            if not parse()["verbose"]:
-                return
+        Logger.queue.put((level, time(), str(message)))
 
-        print(
-            f"{Logger.time()} {Logger.colors['warn']}[VERB]{Logger.colors['normal']} "
-            f"{message!s}"
-        )
+    @staticmethod
+    def _write_records():
+        while True:
+            records = [Logger.queue.get()]
+            # Write everything that's queued before flushing
+            while not Logger.queue.empty():
+                records.append(Logger.queue.get())
+
+            # Looked up every time, as the server's GUI replaces it
+            stdout = sys.stdout
+            for record in records:
+                if isinstance(record, Event):
+                    stdout.flush()
+                    record.set()
+                    continue
+
+                try:
+                    stdout.write(Logger.format_record(*record) + "\n")
+                except Exception:  # pylint: disable=broad-except
+                    # Nowhere left to log it to
+                    pass
+            try:
+                stdout.flush()
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+    @staticmethod
+    def flush(timeout: float = 1.0):
+        """Waits for everything that's been logged to be written"""
+
+        if Logger.thread is None or not Logger.thread.is_alive():
+            return
+
+        written = Event()
+        Logger.queue.put(written)
+        written.wait(timeout)
+
+    @staticmethod
+    def log(message: str):
+        Logger._enqueue("log", message)
+
+    @staticmethod
+    def verbose(message: str, check: bool = True):
+        if check and not Logger.verbose_enabled:
+            return
+        Logger._enqueue("verbose", message)
 
     @staticmethod
     def warn(message: str):
-        print(
-            f"{Logger.time()} {Logger.colors['warn']}[WARN] {message!s}"
-            f"{Logger.colors['normal']}"
-        )
+        Logger._enqueue("warn", message)
 
     @staticmethod
     def fatal(message: str):
-        print(
-            f"{Logger.time()} {Logger.colors['fatal']}[FAIL] {message!s}"
-            f"{Logger.colors['normal']}"
-        )
+        Logger._enqueue("fatal", message)
 
     @staticmethod
     def log_error(error: Exception) -> str:
@@ -80,6 +147,10 @@ class Logger:
         return error_message
 
 
+# Don't lose what's still queued when exiting
+atexit.register(Logger.flush)
+
+
 ### Get public IP ###
 def get_public_ip() -> str:
     """Get the public IP address"""
@@ -115,3 +186,14 @@ def check_username(username: str) -> bool:
         and username.isidentifier()
         and not any(char in DISALLOWED_CHARS_FOR_USERNAME for char in username)
     )
+
+
+### Percentiles ###
+def percentile(values, percent: float) -> float:
+    """Gets a percentile (0 to 100) of the values, or 0 if there aren't any"""
+
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[round(percent / 100 * (len(values) - 1))]
@@ -0,0 +1,50 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+What the tests share: running games without a server
+"""
+
+### Setup ###
+import pytest
+from multiplayer_snake.shared.hisock_tools import GlobalHiSock
+from multiplayer_snake.shared.shared_game import DIRECTION_VELOCITIES
+from multiplayer_snake.server import game as game_module
+
+DIRECTIONS = tuple(DIRECTION_VELOCITIES)
+
+### Helpers ###
+class FakeConnection:
+    """Stands in for the HiSock server, keeping what's sent"""
+
+    cache = []
+
+    def __init__(self):
+        self.sent: list[tuple] = []
+
+    def send_client(self, client, command: str, content=None):
+        self.sent.append((client, command, content))
+
+    def send_all_clients(self, command: str, content=None):
+        self.sent.append(("all", command, content))
+
+
+### Fixtures ###
+@pytest.fixture(name="connection")
+def fixture_connection(monkeypatch) -> FakeConnection:
+    """Games send to a fake connection, and don't record replays"""
+
+    connection = FakeConnection()
+    monkeypatch.setattr(GlobalHiSock, "connection", connection)
+    monkeypatch.setitem(game_module.SERVER_CONFIG, "record_replays", False)
+    return connection
+
+
+@pytest.fixture(name="recording")
+def fixture_recording(connection, tmp_path, monkeypatch) -> FakeConnection:
+    """Games record their rounds to ``tmp_path``"""
+
+    monkeypatch.setitem(game_module.SERVER_CONFIG, "record_replays", True)
+    monkeypatch.setitem(game_module.SERVER_CONFIG, "replay_directory", str(tmp_path))
+    return connection
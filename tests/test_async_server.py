@@ -0,0 +1,105 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+One misbehaving client only ever gets its own connection closed
+"""
+
+### Setup ###
+import json
+import socket
+from time import monotonic, sleep
+import pytest
+from multiplayer_snake.server.async_server import AsyncHiSockServer, make_message
+
+TIMEOUT = 5.0  # Seconds
+
+### Helpers ###
+def wait_for(condition, timeout: float = TIMEOUT) -> bool:
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        if condition():
+            return True
+        sleep(0.01)
+    return condition()
+
+
+def connect(server: AsyncHiSockServer, name: str) -> socket.socket:
+    """Connects a client that says hello like HiSock's client"""
+
+    client = socket.create_connection(server._server.sockets[0].getsockname()[:2])
+    client.sendall(
+        make_message(b"$CLTHELLO$" + json.dumps({"name": name, "group": None}).encode())
+    )
+    return client
+
+
+def send_command(client: socket.socket, command: str, content: bytes = b""):
+    client.sendall(make_message(b"$CMD$" + command.encode() + b"$MSG$" + content))
+
+
+### Fixtures ###
+@pytest.fixture(name="server")
+def fixture_server():
+    """A started server with handlers that record what happened"""
+
+    server = AsyncHiSockServer(("127.0.0.1", 0), max_send_buffer=64 * 1024)
+    server.joined = []
+    server.left = []
+    server.errors = []
+
+    @server.on("join")
+    def on_join(client_data):
+        server.joined.append(client_data.name)
+
+    @server.on("leave")
+    def on_leave(client_data):
+        server.left.append(client_data.name)
+
+    @server.on("fail")
+    def on_fail(_client_data, _data: bytes):
+        raise RuntimeError("Handler failed")
+
+    server.start(error_handler=server.errors.append)
+    yield server
+    server.close()
+
+
+### Tests ###
+def test_handler_error_closes_only_its_connection(server):
+    failing = connect(server, "failing")
+    other = connect(server, "other")
+    assert wait_for(lambda: len(server.joined) == 2)
+
+    send_command(failing, "fail", b"data")
+    assert wait_for(lambda: server.left == ["failing"])
+    assert server.errors == []
+    assert [connection.name for connection in server.connections.values()] == [
+        "other"
+    ]
+
+    failing.close()
+    other.close()
+
+
+def test_client_not_reading_is_disconnected(server):
+    stuck = connect(server, "stuck")
+    other = connect(server, "other")
+    assert wait_for(lambda: len(server.joined) == 2)
+
+    # Neither of them read, but only one is sent enough to fill its buffers up
+    frame = b"x" * (256 * 1024)
+    for _ in range(64):
+        if "stuck" in server.left:
+            break
+        server.send_client("stuck", "update", frame)
+        server.send_client("other", "update", b"small")
+        sleep(0.01)
+
+    assert wait_for(lambda: server.left == ["stuck"])
+    assert "other" in [connection.name for connection in server.connections.values()]
+    assert server.errors == []
+
+    stuck.close()
+    other.close()
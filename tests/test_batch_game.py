@@ -0,0 +1,150 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+The batched simulation plays by the engine's rules
+"""
+
+### Setup ###
+import random
+import numpy as np
+import pytest
+from multiplayer_snake.shared.shared_game import BaseSnakePlayer, DIRECTION_VELOCITIES
+from multiplayer_snake.shared.engine import EngineState, advance
+from multiplayer_snake.server.batch_game import (
+    BatchedSnakeGames,
+    DIRECTIONS,
+    NO_INPUT,
+)
+
+NUM_ROOMS = 16
+TICKS = 600
+
+### Helpers ###
+def new_state(games: BatchedSnakeGames, room: int) -> EngineState:
+    """An engine state for a room that was just reset, with the same food"""
+
+    snakes = [
+        BaseSnakePlayer(
+            tuple(int(value) for value in games.default_heads[player]),
+            DIRECTIONS[games.default_directions[player]],
+            identifier=str(player),
+        )
+        for player in range(games.num_players)
+    ]
+    state = EngineState(snakes, num_foods=0, width=games.width, height=games.height)
+    copy_foods(games, room, state)
+    return state
+
+
+def copy_foods(games: BatchedSnakeGames, room: int, state: EngineState):
+    """The food is random in both, so the engine gets the batched food"""
+
+    state.foods = [tuple(int(value) for value in pos) for pos in games.foods[room]]
+    state.food_positions = {pos: idx for idx, pos in enumerate(state.foods)}
+
+
+def pick_inputs(states: list[EngineState], rng: random.Random) -> np.ndarray:
+    """Turns at random, mostly into free cells so the snakes get long"""
+
+    inputs = np.full((len(states), len(states[0].snakes)), NO_INPUT, dtype=np.int8)
+    for room, state in enumerate(states):
+        for player, snake in enumerate(state.snakes):
+            safe = [
+                idx
+                for idx, direction in enumerate(DIRECTIONS)
+                if state.board.is_free(
+                    (
+                        snake.pos[0] + DIRECTION_VELOCITIES[direction][0],
+                        snake.pos[1] + DIRECTION_VELOCITIES[direction][1],
+                    )
+                )
+            ]
+            if not safe or rng.random() < 0.05:
+                inputs[room, player] = rng.randrange(len(DIRECTIONS))
+            elif rng.random() < 0.2 or DIRECTIONS.index(snake.direction) not in safe:
+                inputs[room, player] = rng.choice(safe)
+
+    return inputs
+
+
+### Tests ###
+@pytest.mark.parametrize(
+    "width, height, num_players, num_foods",
+    [(12, 10, 2, 2), (12, 10, 3, 6), (6, 5, 2, 10)],
+)
+def test_matches_engine(width, height, num_players, num_foods):
+    games = BatchedSnakeGames(
+        NUM_ROOMS, num_players, num_foods, width, height, seed=width + num_foods
+    )
+    states = [new_state(games, room) for room in range(NUM_ROOMS)]
+    rng = random.Random(0)
+    rounds_over = 0
+
+    for _ in range(TICKS):
+        inputs = pick_inputs(states, rng)
+        result = games.tick(inputs)
+
+        for room, state in enumerate(states):
+            advance(
+                state,
+                {
+                    str(player): (
+                        DIRECTIONS[direction] if direction != NO_INPUT else None
+                    )
+                    for player, direction in enumerate(inputs[room])
+                },
+            )
+            ate = [str(player) for player in np.nonzero(result["food_eaten"][room])[0]]
+            assert ate == state.eaten
+
+            if state.died is not None:
+                assert result["game_over"][room]
+                assert list(np.nonzero(result["died"][room])[0]) == [
+                    int(state.died[0])
+                ]
+                states[room] = new_state(games, room)
+                rounds_over += 1
+                continue
+
+            assert not result["game_over"][room]
+            for player, snake in enumerate(state.snakes):
+                assert tuple(games.heads[room, player]) == snake.pos
+                assert games.get_body(room, player) == list(snake.tail)
+            copy_foods(games, room, state)
+
+    assert rounds_over > 0
+
+
+def test_food_is_on_free_cells():
+    # Big enough that the board never fills up (then the food would stay put)
+    games = BatchedSnakeGames(NUM_ROOMS, 2, 12, 12, 10, seed=1)
+    states = [new_state(games, room) for room in range(NUM_ROOMS)]
+    rng = random.Random(1)
+
+    for _ in range(TICKS):
+        inputs = pick_inputs(states, rng)
+        result = games.tick(inputs)
+
+        for room, state in enumerate(states):
+            advance(
+                state,
+                {
+                    str(player): (
+                        DIRECTIONS[direction] if direction != NO_INPUT else None
+                    )
+                    for player, direction in enumerate(inputs[room])
+                },
+            )
+            if result["game_over"][room]:
+                states[room] = new_state(games, room)
+                state = states[room]
+
+            foods = [tuple(int(value) for value in pos) for pos in games.foods[room]]
+            assert len(set(foods)) == games.num_foods
+            heads = {snake.pos for snake in state.snakes}
+            for pos in foods:
+                # A head can be on a food until it's eaten next tick
+                assert state.board.is_free(pos) or pos in heads
+            copy_foods(games, room, state)
@@ -0,0 +1,115 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+The board knows which cells are taken and only hands out free ones
+"""
+
+### Setup ###
+import random
+from multiplayer_snake.shared.board import Board
+
+### Helpers ###
+def check_free_cells(board: Board):
+    """The free cells are every cell that isn't taken, each once"""
+
+    cells = {(x, y) for y in range(board.height) for x in range(board.width)}
+    assert sorted(board.free_cells) == sorted(cells - board.occupied.keys())
+    free_cell_idxs = board._free_cell_idxs  # pylint: disable=protected-access
+    assert free_cell_idxs == {pos: idx for idx, pos in enumerate(board.free_cells)}
+
+
+### Tests ###
+def test_add_remove_occupant():
+    board = Board(4, 3)
+    assert board.occupant((1, 1)) is None
+    assert board.is_free((1, 1))
+
+    board.add((1, 1), "a")
+    board.add((2, 1), "b")
+    assert board.occupant((1, 1)) == "a"
+    assert board.occupant((2, 1)) == "b"
+    assert not board.is_free((1, 1))
+    check_free_cells(board)
+
+    board.remove((1, 1))
+    assert board.occupant((1, 1)) is None
+    assert board.is_free((1, 1))
+    check_free_cells(board)
+
+    # Removing a free cell doesn't add it to the free cells again
+    board.remove((1, 1))
+    check_free_cells(board)
+
+
+def test_in_bounds():
+    board = Board(4, 3)
+    assert board.in_bounds((0, 0)) and board.in_bounds((3, 2))
+    for pos in ((-1, 0), (0, -1), (4, 0), (0, 3)):
+        assert not board.in_bounds(pos)
+        assert not board.is_free(pos)
+
+
+def test_free_cells_stay_right():
+    rng = random.Random(0)
+    board = Board(8, 6)
+    cells = [(x, y) for y in range(board.height) for x in range(board.width)]
+
+    for _ in range(2000):
+        pos = rng.choice(cells)
+        if rng.random() < 0.5:
+            board.add(pos, "a")
+        else:
+            board.remove(pos)
+    check_free_cells(board)
+
+
+def test_random_free_cell_is_free_and_not_excluded():
+    rng = random.Random(0)
+    board = Board(8, 6)
+    cells = [(x, y) for y in range(board.height) for x in range(board.width)]
+
+    for _ in range(500):
+        taken = rng.sample(cells, rng.randrange(len(cells)))
+        board.clear()
+        for pos in taken:
+            board.add(pos, "a")
+        free = [pos for pos in cells if pos not in taken]
+        exclude = set(rng.sample(free, rng.randrange(len(free) + 1)))
+
+        pos = board.random_free_cell(exclude=exclude, rng=rng)
+        if len(exclude) == len(free):
+            assert pos is None
+        else:
+            assert board.is_free(pos)
+            assert pos not in exclude
+
+
+def test_random_free_cell_full_board():
+    board = Board(2, 2)
+    for pos in ((0, 0), (1, 0), (0, 1), (1, 1)):
+        board.add(pos, "a")
+    assert board.random_free_cell() is None
+
+
+def test_random_free_cell_is_seeded():
+    board = Board(8, 6)
+    picks = [
+        [board.random_free_cell(rng=rng) for _ in range(20)]
+        for rng in (random.Random(1), random.Random(1))
+    ]
+    assert picks[0] == picks[1]
+
+
+def test_copy_is_separate():
+    board = Board(4, 3)
+    board.add((1, 1), "a")
+    copied = board.copy()
+    copied.add((2, 2), "b")
+    copied.remove((1, 1))
+
+    assert board.occupant((1, 1)) == "a"
+    assert board.occupant((2, 2)) is None
+    check_free_cells(board)
+    check_free_cells(copied)
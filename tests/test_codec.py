@@ -0,0 +1,217 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+The packed messages unpack to what was packed, and a client that applies the
+delta updates to the keyframes has the same snakes as the server
+"""
+
+### Setup ###
+import json
+import random
+import pytest
+from multiplayer_snake.shared import codec
+from multiplayer_snake.shared.hisock_tools import HiSockCache
+from multiplayer_snake.server import game as game_module
+from multiplayer_snake.server.game import SnakeGame
+from multiplayer_snake.client.snake import ClientSnakePlayer
+from conftest import DIRECTIONS
+
+TICKS = 3000
+CLIENT = ("127.0.0.1", 1)
+
+### Helpers ###
+def as_json(data: dict) -> dict:
+    """What the data is once it's been through JSON (tuples become lists)"""
+
+    return json.loads(json.dumps(data))
+
+
+def without_server_only(keyframe: dict) -> dict:
+    """A keyframe without what isn't packed as the clients don't need it"""
+
+    keyframe = {
+        key: value for key, value in keyframe.items() if key != "uptime_changed"
+    }
+    keyframe["players"] = {
+        identifier: {key: value for key, value in player.items() if key != "ip_address"}
+        for identifier, player in keyframe["players"].items()
+    }
+    return keyframe
+
+
+def play(game: SnakeGame, ticks: int, rng: random.Random):
+    """
+    Ticks the game with the players turning at random, starting it again when a
+    round ends. Yields after every tick.
+    """
+
+    seq = 0
+    for _ in range(ticks):
+        if not game.running:
+            game.start()
+        for player in game.players_online:
+            if rng.random() < 0.2:
+                seq += 1
+                game.update_player(player.identifier, rng.choice(DIRECTIONS), seq)
+
+        game.update()
+        HiSockCache.cache["sent"].clear()
+        yield
+
+
+### Fixtures ###
+@pytest.fixture(name="game")
+def fixture_game(connection) -> SnakeGame:  # pylint: disable=unused-argument
+    game = SnakeGame(seed=0)
+    game.add_player(CLIENT, "alice#1234")
+    game.add_player(("127.0.0.1", 2), "bobby#1234")
+    return game
+
+
+### Tests ###
+def test_update_round_trip(game):
+    player_names = None
+    keyframes = deltas = 0
+
+    for _ in play(game, TICKS, random.Random(0)):
+        if not game.running:
+            continue
+
+        keyframe = game.get_keyframe_data()
+        unpacked = codec.loads(codec.pack_update(keyframe))
+        assert unpacked["tick"] == keyframe["tick"]
+        assert as_json(unpacked) == as_json(without_server_only(keyframe))
+        player_names = list(unpacked["players"])
+        keyframes += 1
+
+        delta = game.get_delta_data()
+        unpacked = codec.loads(codec.pack_update(delta), player_names)
+        assert as_json(unpacked) == as_json(delta)
+        deltas += 1
+
+    assert keyframes > 0 and deltas > 0
+
+
+def test_delta_needs_keyframe(game):
+    game.start()
+    game.update()
+    packed = codec.pack_update(game.get_delta_data())
+
+    with pytest.raises(codec.MissingKeyframeError):
+        codec.loads(packed)
+    with pytest.raises(codec.MissingKeyframeError):
+        codec.loads(packed, ["alice#1234"])
+
+
+@pytest.mark.parametrize("binary_codec", [True, False])
+def test_client_follows_server(game, connection, monkeypatch, binary_codec):
+    monkeypatch.setitem(game_module.SERVER_CONFIG, "binary_codec", binary_codec)
+    snakes = {
+        player.identifier: ClientSnakePlayer(head_color="red", tail_color="red")
+        for player in game.players_online
+    }
+    player_names = None
+    last_tick = None
+    deltas = 0
+
+    for _ in play(game, TICKS, random.Random(1)):
+        for client, command, content in connection.sent:
+            if client != CLIENT or command != "update":
+                continue
+
+            data = codec.loads(content, player_names)
+            if data["keyframe"]:
+                player_names = list(data["players"])
+                for identifier, player in data["players"].items():
+                    snakes[identifier].update(
+                        tuple(player["pos"]), player["direction"], player["tail"]
+                    )
+            else:
+                # Deltas only ever come right after the tick the client has
+                assert data["tick"] == last_tick + 1
+                deltas += 1
+                for identifier, player in data["players"].items():
+                    snakes[identifier].apply_delta(
+                        tuple(player["head"]), player["popped"], player["direction"]
+                    )
+            last_tick = data["tick"]
+        connection.sent.clear()
+
+        if game.running:
+            for player in game.players_online:
+                snake = snakes[player.identifier]
+                assert [tuple(pos) for pos in snake.tail] == list(player.tail)
+                assert snake.direction == player.direction
+
+    assert deltas > 0
+
+
+@pytest.mark.parametrize("keyframe_interval", [1, 3, 50])
+def test_keyframe_interval(game, connection, monkeypatch, keyframe_interval):
+    monkeypatch.setitem(
+        game_module.SERVER_CONFIG, "keyframe_interval", keyframe_interval
+    )
+    player_names = None
+    keyframes = deltas = 0
+
+    for _ in play(game, 200, random.Random(2)):
+        for client, command, content in connection.sent:
+            if client != CLIENT or command != "update":
+                continue
+
+            data = codec.loads(content, player_names)
+            if not data["keyframe"]:
+                deltas += 1
+                continue
+            player_names = list(data["players"])
+            # The last tick of a round is a keyframe too
+            if game.running:
+                assert (data["tick"] - 1) % keyframe_interval == 0
+                keyframes += 1
+        connection.sent.clear()
+
+    assert keyframes > 0
+    assert (deltas == 0) == (keyframe_interval == 1)
+
+
+def test_lobby_keyframe_has_the_players(connection):
+    game = SnakeGame(seed=0)
+    game.add_player(CLIENT, "alice#1234")
+
+    def lobby_keyframe() -> dict:
+        connection.sent.clear()
+        game.request_keyframe(CLIENT)
+        ((_, _, content),) = connection.sent
+        return codec.loads(content)
+
+    assert list(lobby_keyframe()["players"]) == ["alice#1234"]
+    game.add_player(("127.0.0.1", 2), "bobby#1234")
+    assert list(lobby_keyframe()["players"]) == ["alice#1234", "bobby#1234"]
+    game.remove_player(("127.0.0.1", 2))
+    assert list(lobby_keyframe()["players"]) == ["alice#1234"]
+    game.add_bot()
+    assert len(lobby_keyframe()["players"]) == 2
+
+
+def test_game_started_round_trip():
+    default_directions = {"alice#1234": "right", "bobby#1234": "left"}
+    assert codec.loads(codec.pack_game_started(default_directions)) == (
+        default_directions
+    )
+
+
+def test_input_round_trip():
+    for seq, direction in enumerate(DIRECTIONS):
+        data = {"direction": direction, "seq": seq * 100_000}
+        packed = codec.pack_input(data)
+        assert codec.is_packed(packed)
+        assert codec.loads(packed) == data
+
+
+def test_json_is_not_packed():
+    data = {"direction": "up", "seq": 1}
+    encoded = json.dumps(data).encode()
+    assert not codec.is_packed(encoded)
+    assert codec.loads(encoded) == data
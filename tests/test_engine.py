@@ -0,0 +1,119 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+The engine plays out the same with the same seed and inputs
+"""
+
+### Setup ###
+import random
+from multiplayer_snake.shared.shared_game import BaseSnakePlayer
+from multiplayer_snake.shared.engine import EngineState, advance, step
+from conftest import DIRECTIONS
+
+NUM_GAMES = 20
+MAX_TICKS = 500
+
+### Helpers ###
+def new_state(seed: int) -> EngineState:
+    snakes = [
+        BaseSnakePlayer((5, 14), "right", identifier="a"),
+        BaseSnakePlayer((34, 14), "left", identifier="b"),
+        BaseSnakePlayer((20, 3), "down", identifier="c"),
+    ]
+    return EngineState(snakes, seed=seed, num_foods=3)
+
+
+def random_inputs(rng: random.Random) -> dict[str, str | None]:
+    return {
+        identifier: rng.choice(DIRECTIONS) if rng.random() < 0.3 else None
+        for identifier in "abc"
+    }
+
+
+def snapshot(state: EngineState) -> tuple:
+    """Everything the rules look at, to compare states"""
+
+    return (
+        state.tick,
+        [
+            (
+                snake.identifier,
+                snake.pos,
+                snake.direction,
+                snake.length,
+                list(snake.tail),
+                snake.alive,
+            )
+            for snake in state.snakes
+        ],
+        list(state.foods),
+        dict(state.food_positions),
+        dict(state.board.occupied),
+        sorted(state.board.free_cells),
+        state.died,
+        state.rng.getstate(),
+    )
+
+
+### Tests ###
+def test_same_seed_and_inputs_play_out_the_same():
+    rounds_over = 0
+
+    for game in range(NUM_GAMES):
+        inputs_rng = random.Random(game)
+        states = [new_state(game), new_state(game)]
+        assert snapshot(states[0]) == snapshot(states[1])
+
+        for _ in range(MAX_TICKS):
+            inputs = random_inputs(inputs_rng)
+            for state in states:
+                advance(state, inputs)
+            assert snapshot(states[0]) == snapshot(states[1])
+            if states[0].died is not None:
+                rounds_over += 1
+                break
+
+    assert rounds_over > 0
+
+
+def test_different_seeds_place_food_differently():
+    assert new_state(1).foods != new_state(2).foods
+
+
+def test_step_leaves_the_state_alone():
+    inputs_rng = random.Random(0)
+    state = new_state(0)
+
+    for _ in range(MAX_TICKS):
+        inputs = random_inputs(inputs_rng)
+        before = snapshot(state)
+        stepped = step(state, inputs)
+        assert snapshot(state) == before
+        assert stepped is not state
+
+        advance(state, inputs)
+        assert snapshot(stepped) == snapshot(state)
+        if state.died is not None:
+            break
+
+
+def test_food_is_on_free_cells():
+    for game in range(NUM_GAMES):
+        inputs_rng = random.Random(game)
+        state = new_state(game)
+
+        for _ in range(MAX_TICKS):
+            advance(state, random_inputs(inputs_rng))
+            if state.died is not None:
+                break
+
+            assert len(state.food_positions) == len(state.foods) == 3
+            assert state.food_positions == {
+                pos: idx for idx, pos in enumerate(state.foods)
+            }
+            heads = {snake.pos for snake in state.snakes}
+            for pos in state.foods:
+                # A head can be on a food until it's eaten next tick
+                assert state.board.is_free(pos) or pos in heads
@@ -0,0 +1,47 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+A room only changes the players it's asked about
+"""
+
+### Setup ###
+from multiplayer_snake.shared.hisock_tools import HiSockCache
+from multiplayer_snake.server.game import SnakeGame
+
+### Helpers ###
+def new_game() -> SnakeGame:
+    game = SnakeGame(seed=0)
+    game.add_player(("127.0.0.1", 1), "alice#1234")
+    game.add_player(("127.0.0.1", 2), "bobby#1234")
+    return game
+
+
+### Tests ###
+def test_input_for_nobody_is_dropped(connection):  # pylint: disable=unused-argument
+    game = new_game()
+    game.update_player("nobody#1234", "up", 1)
+    game.update_player(("127.0.0.1", 3), "up", 1)
+
+    assert all(not player.input_queue for player in game.players_online)
+
+
+def test_snake_that_left_dying(connection):
+    game = new_game()
+    game.start()
+    state = game.state
+    _, bobby = game.players_online
+    # Gone without the round being stopped, the engine still has their snake
+    game.players_online.remove(bobby)
+
+    # They're going at each other
+    while game.running:
+        game.update()
+        HiSockCache.cache["sent"].clear()
+
+    identifier, reason = state.died
+    game_overs = [
+        content for _, command, content in connection.sent if command == "game_over"
+    ]
+    assert game_overs == [f"{identifier} died because {reason}"]
@@ -0,0 +1,96 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+The server's handlers don't let what a client sends break the rooms
+"""
+
+### Setup ###
+import json
+import pytest
+from multiplayer_snake.shared.common import ClientInfo
+from multiplayer_snake.shared.codec import pack_input
+from multiplayer_snake.server.handlers import register_handlers
+from multiplayer_snake.server.rooms import RoomManager
+
+CLIENTS = [
+    ClientInfo(("127.0.0.1", 1), "alice#1234", None),
+    ClientInfo(("127.0.0.1", 2), "bobby#1234", None),
+]
+MALFORMED_INPUTS = [
+    b'{"direction": "up", "seq": "x"}',
+    b'{"direction": "up", "seq": true}',
+    b'{"direction": "up", "seq": -1}',
+    b'{"direction": "up", "seq": 1.5}',
+    b'{"direction": ["up"], "seq": 1}',
+    b'{"direction": "up"}',
+    b"[1]",
+    b'"up"',
+    b"null",
+    b"not json",
+]
+
+### Helpers ###
+class FakeServer:
+    """Keeps the handlers so they can be called like HiSock would"""
+
+    def __init__(self):
+        self.handlers: dict = {}
+        self.disconnected: list = []
+
+    def on(self, command: str, *_):
+        def decorator(func):
+            self.handlers[command] = func
+            return func
+
+        return decorator
+
+    def send_client(self, *_):
+        pass
+
+    def disconnect_client(self, client_data, *_, **__):
+        self.disconnected.append(client_data)
+
+
+### Fixtures ###
+@pytest.fixture(name="rooms")
+def fixture_rooms(connection) -> RoomManager:  # pylint: disable=unused-argument
+    """A room manager with one room that's running"""
+
+    rooms = RoomManager()
+    for client in CLIENTS:
+        rooms.add_player(client.ip, client.name)
+        rooms.player_ready(client.ip)
+    rooms.start_all()
+    assert len(rooms.running_rooms) == 1
+
+    return rooms
+
+
+### Tests ###
+@pytest.mark.parametrize("data", MALFORMED_INPUTS)
+def test_malformed_input_is_dropped(rooms, data):
+    server = FakeServer()
+    register_handlers(server, rooms)
+    room = rooms.running_rooms[0]
+
+    server.handlers["input"](CLIENTS[0], data)
+    assert not room.players_online[0].input_queue
+    for _ in range(3):
+        rooms.run()
+    assert room.running
+    assert room.frames == 3
+
+
+def test_input_is_queued(rooms):
+    server = FakeServer()
+    register_handlers(server, rooms)
+    room = rooms.running_rooms[0]
+
+    server.handlers["input"](CLIENTS[0], pack_input({"direction": "up", "seq": 1}))
+    server.handlers["input"](
+        CLIENTS[1], json.dumps({"direction": "down", "seq": 1}).encode()
+    )
+    rooms.run()
+    assert [player.direction for player in room.players_online] == ["up", "down"]
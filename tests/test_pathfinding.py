@@ -0,0 +1,64 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+The bots' distance fields stay the same as searching the board again
+"""
+
+### Setup ###
+import random
+from multiplayer_snake.shared.shared_game import BaseSnakePlayer
+from multiplayer_snake.shared.engine import EngineState, advance
+from multiplayer_snake.shared.pathfinding import DistanceField, Pathfinder
+from conftest import DIRECTIONS
+
+NUM_GAMES = 20
+
+### Helpers ###
+def new_state(seed: int) -> EngineState:
+    snakes = [
+        BaseSnakePlayer((5, 14), "right", identifier="a"),
+        BaseSnakePlayer((34, 14), "left", identifier="b"),
+        BaseSnakePlayer((20, 3), "down", identifier="c"),
+    ]
+    return EngineState(snakes, seed=seed, num_foods=3)
+
+
+def check_fields(pathfinder: Pathfinder) -> int:
+    """Compares every field against a new one, returns how many were checked"""
+
+    for pos, field in pathfinder.fields.items():
+        assert field.dist == DistanceField(pathfinder, pathfinder.index(pos)).dist
+    return len(pathfinder.fields)
+
+
+### Tests ###
+def test_fields_match_new_fields():
+    rng = random.Random(1)
+    checks = 0
+
+    for game in range(NUM_GAMES):
+        state = new_state(game)
+        pathfinder = Pathfinder()
+        while state.died is None:
+            pathfinder.sync(state)
+            # Mostly going for the food, so the snakes get long
+            advance(
+                state,
+                {
+                    snake.identifier: (
+                        pathfinder.best_direction(snake)
+                        if rng.random() < 0.9
+                        else rng.choice(DIRECTIONS)
+                    )
+                    for snake in state.snakes
+                },
+            )
+            if state.died is not None:
+                break
+
+            pathfinder.sync(state)
+            checks += check_fields(pathfinder)
+
+    assert checks > 0
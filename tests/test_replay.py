@@ -0,0 +1,144 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+Replays play back the same states the server had
+"""
+
+### Setup ###
+import json
+import random
+import pytest
+from multiplayer_snake.shared.hisock_tools import HiSockCache
+from multiplayer_snake.server.game import SnakeGame
+from multiplayer_snake.server.replay import ReplayReader, replay_writer
+from conftest import DIRECTIONS
+
+TICKS = 3000
+SEEKS_PER_REPLAY = 20
+
+### Helpers ###
+def comparable(state: dict) -> dict:
+    """The parts of an "update" that are kept, as JSON would have them"""
+
+    return json.loads(
+        json.dumps(
+            {
+                "players": {
+                    identifier: (
+                        player["pos"],
+                        player["length"],
+                        player["direction"],
+                        list(player["tail"]),
+                    )
+                    for identifier, player in state["players"].items()
+                },
+                "foods": [food["pos"] for food in state["foods"]],
+            }
+        )
+    )
+
+
+### Fixtures ###
+@pytest.fixture(name="recorded")
+def fixture_recorded(recording) -> dict:  # pylint: disable=unused-argument
+    """
+    Plays rounds with two players that mostly go for the food, recording them.
+    Returns round -> tick -> the state the server had.
+    """
+
+    rng = random.Random(0)
+    game = SnakeGame(seed=0)
+    players = [
+        game.add_player(("127.0.0.1", 1), "alice#1234"),
+        game.add_player(("127.0.0.1", 2), "bobby#1234"),
+    ]
+    truth = {}
+    seq = 0
+
+    for _ in range(TICKS):
+        if not game.running:
+            game.start()
+
+        for player in players:
+            seq += 1
+            if rng.random() < 0.1:
+                game.update_player(player.identifier, rng.choice(DIRECTIONS), seq)
+                continue
+            (food_x, food_y), (x, y) = game.foods[0], player.pos
+            if food_x != x:
+                direction = "right" if food_x > x else "left"
+            else:
+                direction = "down" if food_y > y else "up"
+            game.update_player(player.identifier, direction, seq)
+
+        round_ = game.round
+        game.update()
+        HiSockCache.cache["sent"].clear()
+        if game.running:
+            data = game.get_keyframe_data()
+            truth.setdefault(round_, {})[data["tick"]] = comparable(data)
+
+    game.stop()
+    replay_writer.close()
+
+    return truth
+
+
+### Tests ###
+def test_seek_and_playback(recorded, tmp_path):
+    paths = sorted(tmp_path.glob("*.snakereplay"))
+    assert len(paths) == len(recorded)
+    rng = random.Random(0)
+
+    for path in paths:
+        round_ = int(path.name.split("_round")[1].split("_")[0])
+        ticks = recorded[round_]
+
+        with ReplayReader(path) as reader:
+            assert reader.end_reason is not None
+            for tick in rng.sample(list(ticks), min(SEEKS_PER_REPLAY, len(ticks))):
+                assert comparable(reader.seek(tick)) == ticks[tick]
+
+            played = [state["tick"] for state in reader.frames()]
+            assert set(ticks) <= set(played)
+            assert played == sorted(played)
+
+
+def test_cut_off_replay(recorded, tmp_path):
+    path = max(tmp_path.glob("*.snakereplay"), key=lambda path: path.stat().st_size)
+    cut_path = tmp_path / "cut_off.replay"
+    data = path.read_bytes()
+    # Partway through some record near the end
+    cut_path.write_bytes(data[: len(data) - 7])
+
+    with ReplayReader(cut_path) as reader:
+        assert reader.end_reason is None
+        assert reader.last_tick is not None
+        with ReplayReader(path) as whole:
+            assert reader.last_tick <= whole.last_tick
+            assert comparable(reader.seek(reader.last_tick)) == comparable(
+                whole.seek(reader.last_tick)
+            )
+
+
+def test_paused_round_ends(recording, tmp_path):  # pylint: disable=unused-argument
+    game = SnakeGame(seed=0)
+    game.add_player(("127.0.0.1", 1), "alice#1234")
+    game.add_player(("127.0.0.1", 2), "bobby#1234")
+
+    # Started again after being paused (like everyone leaving), then stopped
+    for _ in range(2):
+        game.start()
+        game.update()
+        HiSockCache.cache["sent"].clear()
+        game.pause()
+    game.stop()
+    replay_writer.close()
+
+    end_reasons = []
+    for path in sorted(tmp_path.glob("*.snakereplay")):
+        with ReplayReader(path) as reader:
+            end_reasons.append((reader.header["round"], reader.end_reason))
+    assert sorted(end_reasons) == [(1, "restarted"), (2, "stopped")]
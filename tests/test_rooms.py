@@ -0,0 +1,171 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+Players are put in rooms, and the rooms are torn down once they're empty
+"""
+
+### Setup ###
+import sys
+from threading import Event, Thread
+from multiplayer_snake.server.rooms import RoomManager
+
+RACE_TRIALS = 100
+
+### Helpers ###
+def client(number: int) -> tuple:
+    return ("127.0.0.1", number)
+
+
+def add_ready_player(rooms: RoomManager, number: int):
+    player = rooms.add_player(client(number), f"player{number}#{number:04}")
+    rooms.player_ready(client(number))
+    return player
+
+
+### Tests ###
+def test_players_fill_rooms(connection):  # pylint: disable=unused-argument
+    rooms = RoomManager()
+    players = [add_ready_player(rooms, number) for number in range(5)]
+
+    assert len(rooms.rooms) == 3
+    assert [player.game.room_id for player in players] == [0, 0, 1, 1, 2]
+    assert rooms.players_online == players
+    assert rooms.open_slots == 1
+    for number, player in enumerate(players):
+        assert rooms.get_player(client(number)) is player
+        assert rooms.get_room(client(number)) is player.game
+
+
+def test_started_rooms_are_skipped(connection):  # pylint: disable=unused-argument
+    rooms = RoomManager()
+    add_ready_player(rooms, 0)
+    add_ready_player(rooms, 1)
+    rooms.start_all()
+    assert rooms.running
+
+    player = add_ready_player(rooms, 2)
+    assert player.game.room_id == 1
+    assert not player.game.running
+
+
+def test_max_rooms(connection):  # pylint: disable=unused-argument
+    rooms = RoomManager(max_rooms=1)
+    add_ready_player(rooms, 0)
+    add_ready_player(rooms, 1)
+
+    assert rooms.add_player(client(2), "player2#0002") is None
+    assert rooms.get_player(client(2)) is None
+
+
+def test_leaving(connection):  # pylint: disable=unused-argument
+    rooms = RoomManager()
+    for number in range(4):
+        add_ready_player(rooms, number)
+    rooms.start_all()
+    assert len(rooms.running_rooms) == 2
+
+    # The round can't go on with one player
+    rooms.remove_player(client(0))
+    assert len(rooms.rooms) == 2
+    assert rooms.get_player(client(0)) is None
+    assert len(rooms.running_rooms) == 1
+
+    # Empty rooms are torn down
+    rooms.remove_player(client(1))
+    assert list(rooms.rooms) == [1]
+    assert rooms.players_online == [
+        rooms.get_player(client(2)),
+        rooms.get_player(client(3)),
+    ]
+
+    # Leaving twice or without joining does nothing
+    rooms.remove_player(client(1))
+    rooms.remove_player(client(9))
+    assert list(rooms.rooms) == [1]
+
+
+def test_inputs_go_to_the_player(connection):  # pylint: disable=unused-argument
+    rooms = RoomManager()
+    first = add_ready_player(rooms, 0)
+    second = add_ready_player(rooms, 1)
+
+    rooms.update_player(client(1), "up", 1)
+    rooms.update_player(client(9), "up", 1)
+    assert not first.input_queue
+    assert list(second.input_queue) == [(1, "up")]
+
+
+def test_joining_and_leaving_wait_for_the_tick(connection):
+    # pylint: disable=unused-argument
+    rooms = RoomManager()
+    add_ready_player(rooms, 0)
+    add_ready_player(rooms, 1)
+    rooms.start_all()
+    room = rooms.rooms[0]
+
+    ticking = Event()
+    finish_tick = Event()
+    room_run = room.run
+
+    def slow_run():
+        ticking.set()
+        finish_tick.wait()
+        room_run()
+
+    room.run = slow_run
+    ticker = Thread(target=rooms.run, daemon=True)
+    joiner = Thread(target=add_ready_player, args=(rooms, 2), daemon=True)
+    leaver = Thread(target=rooms.remove_player, args=(client(0),), daemon=True)
+    try:
+        ticker.start()
+        assert ticking.wait(timeout=5.0)
+
+        joiner.start()
+        leaver.start()
+        joiner.join(timeout=0.2)
+        leaver.join(timeout=0.2)
+        assert joiner.is_alive() and leaver.is_alive()
+        assert len(room.players_online) == 2
+        assert len(rooms.rooms) == 1
+    finally:
+        finish_tick.set()
+
+    for thread in (ticker, joiner, leaver):
+        thread.join(timeout=5.0)
+        assert not thread.is_alive()
+    assert rooms.get_player(client(0)) is None
+    assert rooms.get_player(client(2)) is not None
+
+
+def test_leaving_while_ticking(connection):  # pylint: disable=unused-argument
+    # Switch threads as often as possible, so a leave lands mid tick
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    errors = []
+
+    try:
+        for _ in range(RACE_TRIALS):
+            rooms = RoomManager()
+            add_ready_player(rooms, 0)
+            add_ready_player(rooms, 1)
+            rooms.start_all()
+            stop = Event()
+
+            def tick_until_stopped(rooms=rooms, stop=stop):
+                try:
+                    while not stop.is_set():
+                        rooms.run()
+                except Exception as e:  # pylint: disable=broad-except
+                    errors.append(e)
+
+            ticker = Thread(target=tick_until_stopped, daemon=True)
+            ticker.start()
+            rooms.remove_player(client(0))
+            stop.set()
+            ticker.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert errors == []
@@ -0,0 +1,106 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+The tick scheduler keeps to its deadlines and skips ticks it can't catch up on
+"""
+
+### Setup ###
+from time import monotonic, sleep
+from multiplayer_snake.server.scheduler import TickScheduler
+
+### Helpers ###
+class FakeTick:
+    """Counts the ticks, and can take a while or fail"""
+
+    def __init__(self, duration: float = 0.0, fail: bool = False):
+        self.duration = duration
+        self.fail = fail
+        self.ticks = 0
+
+    def __call__(self):
+        self.ticks += 1
+        if self.duration:
+            sleep(self.duration)
+        if self.fail:
+            raise RuntimeError("Tick failed")
+
+
+### Tests ###
+def test_deadline_moves_by_the_interval():
+    # Long enough that the test taking a little while doesn't matter
+    scheduler = TickScheduler(FakeTick(), interval=1.0, max_catch_up_ticks=5)
+    start = scheduler.next_tick_time = monotonic() - 0.5
+
+    scheduler._run_tick()  # pylint: disable=protected-access
+    assert scheduler.next_tick_time == start + 1.0
+    assert scheduler.ticks == 1
+    assert scheduler.skipped_ticks == 0
+    assert 0.5 <= scheduler.jitter[-1] < 1.0
+
+
+def test_late_ticks_are_caught_up():
+    tick = FakeTick()
+    scheduler = TickScheduler(tick, interval=1.0, max_catch_up_ticks=5)
+    start = scheduler.next_tick_time = monotonic() - 4.5
+
+    # Behind by fewer ticks than can be caught up, so they're all run
+    while scheduler.next_tick_time <= monotonic():
+        scheduler._run_tick()  # pylint: disable=protected-access
+    assert tick.ticks == 5
+    assert scheduler.skipped_ticks == 0
+    assert scheduler.next_tick_time == start + 5.0
+
+
+def test_too_many_late_ticks_are_skipped():
+    tick = FakeTick()
+    scheduler = TickScheduler(tick, interval=1.0, max_catch_up_ticks=3)
+    start = scheduler.next_tick_time = monotonic() - 10.5
+
+    scheduler._run_tick()  # pylint: disable=protected-access
+    # 9 more were due, which is over 3
+    assert scheduler.skipped_ticks == 9
+    assert scheduler.next_tick_time == start + 10.0
+    assert scheduler.next_tick_time <= monotonic() < scheduler.next_tick_time + 1.0
+    assert tick.ticks == 1
+
+
+def test_ticks_on_its_thread():
+    tick = FakeTick()
+    scheduler = TickScheduler(tick, interval=0.01)
+    scheduler.start()
+    sleep(0.3)
+    scheduler.stop()
+
+    assert not scheduler.alive
+    # Never ahead, as the deadlines move by the interval (it can be behind on a
+    # busy machine)
+    assert 10 <= tick.ticks <= 31
+
+
+def test_stall_is_skipped():
+    tick = FakeTick(duration=0.2)
+    scheduler = TickScheduler(tick, interval=0.01, max_catch_up_ticks=2)
+    scheduler.start()
+    sleep(0.1)
+    tick.duration = 0.0
+    sleep(0.2)
+    scheduler.stop()
+
+    assert scheduler.skipped_ticks >= 15
+    assert scheduler.ticks == tick.ticks
+
+
+def test_errors_go_to_the_error_handler():
+    errors = []
+    scheduler = TickScheduler(
+        FakeTick(fail=True), interval=0.01, error_handler=errors.append
+    )
+    scheduler.start()
+    sleep(0.1)
+    scheduler.stop()
+
+    # It keeps going
+    assert len(errors) == scheduler.ticks > 1
+    assert all(isinstance(error, RuntimeError) for error in errors)
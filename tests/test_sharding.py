@@ -0,0 +1,70 @@
+"""
+Snake, but multiplayer
+Created by sheepy0125
+2022-08-26
+
+A worker sends each room's frame over the pipe once, and the front process sends
+it to every player in the room
+"""
+
+### Setup ###
+from multiprocessing import Pipe
+from multiplayer_snake.shared.hisock_tools import GlobalHiSock, HiSockCache
+from multiplayer_snake.server.game import SnakeGame
+from multiplayer_snake.server.sharding import PipeConnection, ShardedRoomManager
+
+CLIENTS = [("127.0.0.1", 1), ("127.0.0.1", 2)]
+
+### Helpers ###
+def receive_all(pipe) -> list[tuple]:
+    messages = []
+    while pipe.poll():
+        messages.append(pipe.recv())
+    return messages
+
+
+### Tests ###
+def test_frame_is_sent_once_per_room(connection, monkeypatch):
+    front_pipe, worker_pipe = Pipe()
+    monkeypatch.setattr(GlobalHiSock, "connection", PipeConnection(worker_pipe))
+
+    game = SnakeGame(seed=0)
+    game.add_player(CLIENTS[0], "alice#1234")
+    game.add_player(CLIENTS[1], "bobby#1234")
+    game.start()
+    receive_all(front_pipe)
+    game.update()
+    HiSockCache.cache["sent"].clear()
+
+    messages = receive_all(front_pipe)
+    assert [message[:3] for message in messages] == [("send", CLIENTS, "update")]
+
+    # The front process sends it to each of them (without spawning any workers)
+    monkeypatch.setattr(GlobalHiSock, "connection", connection)
+    front = ShardedRoomManager.__new__(ShardedRoomManager)
+    front._handle_worker_message(None, messages[0])  # pylint: disable=protected-access
+    assert [(client, command) for client, command, _ in connection.sent] == [
+        (client, "update") for client in CLIENTS
+    ]
+    assert connection.sent[0][2] is connection.sent[1][2] == messages[0][3]
+
+
+def test_keyframe_requests_get_their_own_message(connection, monkeypatch):
+    # pylint: disable=unused-argument
+    front_pipe, worker_pipe = Pipe()
+    monkeypatch.setattr(GlobalHiSock, "connection", PipeConnection(worker_pipe))
+
+    game = SnakeGame(seed=0)
+    game.add_player(CLIENTS[0], "alice#1234")
+    game.add_player(CLIENTS[1], "bobby#1234")
+    game.start()
+    game.update()
+    receive_all(front_pipe)
+
+    game.request_keyframe(CLIENTS[1])
+    game.update()
+    HiSockCache.cache["sent"].clear()
+
+    messages = receive_all(front_pipe)
+    assert [message[1] for message in messages] == [[CLIENTS[0]], [CLIENTS[1]]]
+    assert messages[0][3] != messages[1][3]